@@ -1,28 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+import logging
+import math
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, Field
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
 from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
-import os
 from dotenv import load_dotenv
+from database import get_database
+from local_store import local_store
+from executors import hashing_executor, ExecutorSaturated
+from user_cache import user_cache
+from tokens import token_service, InvalidToken, ACCESS_TOKEN_EXPIRE_MINUTES
+from password_hasher import password_hasher
+from login_limiter import login_limiter
 
 # Load environment variables
 load_dotenv()
 
-# JWT Configuration
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
-if not SECRET_KEY:
-    SECRET_KEY = "temporarysecretkeychangethisinproduction"
-    print("WARNING: Using default JWT secret key. Set JWT_SECRET_KEY in .env file.")
-
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger("auth")
 
 # OAuth2 with Password flow
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
@@ -54,6 +50,14 @@ class User(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # seconds
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -64,20 +68,40 @@ class UserUpdate(BaseModel):
     disabled: Optional[bool] = None
     role: Optional[str] = None
 
-# Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Helper functions (bcrypt runs in the hashing pool, never on the event loop)
+async def _run_hashing(fn, *args):
+    try:
+        return await hashing_executor.run(fn, *args)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy, retry later",
+            headers={"Retry-After": "1"},
+        )
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password):
+    """(valid, new hash when the stored one uses outdated parameters)"""
+    return await _run_hashing(password_hasher.verify, plain_password, hashed_password)
 
-# Dependency to get the database - MOVED UP
-async def get_database():
-    from main import mongo_client, db_name
-    return mongo_client[db_name]
+async def get_password_hash(password):
+    return await _run_hashing(password_hasher.hash, password)
+
+# Rate limiting happens before any lookup or hashing
+def _client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def check_rate_limit(username: Optional[str], request: Request):
+    wait = login_limiter.check(username, _client_ip(request))
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, retry later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
 
 async def get_user(db: AsyncIOMotorDatabase, username: str):
-    user_doc = await db.users.find_one({"username": username})
+    # Local copy of the users collection, MongoDB for users not synced yet
+    user_doc = await local_store.find_one(db, "users", "username", username)
     if user_doc:
         return UserInDB(**user_doc)
     return None
@@ -86,19 +110,33 @@ async def authenticate_user(db: AsyncIOMotorDatabase, username: str, password: s
     user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        # Stored hash made with other parameters: replace it while we have the password
+        try:
+            await db.users.update_one(
+                {"username": username, "hashed_password": user.hashed_password},
+                {"$set": {"hashed_password": new_hash}}
+            )
+            await local_store.remove("users", "username", username)
+        except Exception as e:
+            # Retried on the next login
+            logger.warning(f"Failed to rehash password of {username}: {e}")
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    claims = {key: value for key, value in data.items() if key != "sub"}
+    return token_service.create_access_token(data["sub"], expires_delta, claims)
+
+def create_token_pair(username: str) -> dict:
+    return {
+        "access_token": token_service.create_access_token(username),
+        "refresh_token": token_service.create_refresh_token(username),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorDatabase = Depends(get_database)):
     credentials_exception = HTTPException(
@@ -107,16 +145,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotor
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Signature checks are cached per token, revocations checked on each call
+        payload = await token_service.verify(token, "access")
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except InvalidToken:
         raise credentials_exception
-    user = await get_user(db, username=token_data.username)
-    if user is None:
+    # Resolved users are cached per token (username + iat)
+    issued_at = payload.get("iat")
+    cached_user = user_cache.get(token_data.username, issued_at)
+    if cached_user is not None:
+        return cached_user
+    user_db = await get_user(db, username=token_data.username)
+    if user_db is None:
         raise credentials_exception
+    user = User(
+        username=user_db.username,
+        email=user_db.email,
+        disabled=user_db.disabled,
+        role=user_db.role
+    )
+    user_cache.put(token_data.username, issued_at, user)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -126,7 +177,8 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
 
 # Routes
 @auth_router.post("/register", response_model=User)
-async def register_user(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
+async def register_user(user: UserCreate, request: Request, db: AsyncIOMotorDatabase = Depends(get_database)):
+    check_rate_limit(None, request)
     # Check if username already exists
     existing_user = await db.users.find_one({"username": user.username})
     if existing_user:
@@ -144,7 +196,7 @@ async def register_user(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_in_db = UserInDB(
         username=user.username,
         email=user.email,
@@ -153,13 +205,16 @@ async def register_user(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get
     )
     
     # Insert user into database
-    await db.users.insert_one(user_in_db.dict())
+    user_doc = user_in_db.dict()
+    await db.users.insert_one(user_doc)
+    await local_store.put("users", [user_doc])
     
     # Return user without hashed password
     return User(username=user.username, email=user.email)
 
 @auth_router.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncIOMotorDatabase = Depends(get_database)):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncIOMotorDatabase = Depends(get_database)):
+    check_rate_limit(form_data.username, request)
     user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -167,11 +222,47 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    login_limiter.succeeded(user.username)
+    return create_token_pair(user.username)
+
+@auth_router.post("/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """New token pair from a refresh token (rotated: the old one is revoked)"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    try:
+        payload = await token_service.verify(request.refresh_token, "refresh")
+    except InvalidToken:
+        raise credentials_exception
+    # Claimed before anything else: of two concurrent refreshes with the same
+    # token, only one gets a new pair
+    if not await token_service.claim(payload):
+        raise credentials_exception
+    # The account may have been disabled or deleted since the login
+    user = await get_user(db, username=payload.get("sub"))
+    if user is None or user.disabled:
+        raise credentials_exception
+    return create_token_pair(user.username)
+
+@auth_router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    request: LogoutRequest = LogoutRequest(),
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Revoke the current access token and, if given, the refresh token"""
+    await token_service.revoke(await token_service.verify(token, "access"))
+    if request.refresh_token:
+        try:
+            payload = await token_service.verify(request.refresh_token, "refresh")
+        except InvalidToken:
+            payload = None
+        if payload is not None and payload.get("sub") == current_user.username:
+            await token_service.revoke(payload)
+    return None
 
 @auth_router.get("/me", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
@@ -213,7 +304,7 @@ async def update_user(
         update_data["email"] = user_update.email
     
     if user_update.password:
-        update_data["hashed_password"] = get_password_hash(user_update.password)
+        update_data["hashed_password"] = await get_password_hash(user_update.password)
     
     # Seuls les admins peuvent modifier ces champs
     if current_user.role == "admin":
@@ -229,6 +320,8 @@ async def update_user(
             {"username": username},
             {"$set": update_data}
         )
+        await local_store.remove("users", "username", username)
+        user_cache.invalidate(username)
     
     # Récupérer et retourner l'utilisateur mis à jour
     updated_user = await get_user(db, username)
@@ -272,6 +365,8 @@ async def delete_user(
     
     # Supprimer l'utilisateur
     result = await db.users.delete_one({"username": username})
+    await local_store.remove("users", "username", username)
+    user_cache.invalidate(username)
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -335,4 +430,22 @@ async def get_user_by_username(
         email=user.email,
         disabled=user.disabled,
         role=user.role
-    )
\ No newline at end of file
+    )
+
+# Route pour consulter les statistiques du cache utilisateurs (admin uniquement)
+@auth_router.get("/cache/stats")
+async def get_user_cache_stats(
+    current_user: User = Depends(get_current_active_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    return {
+        **user_cache.stats(),
+        "tokens": token_service.stats(),
+        "password_hashing": password_hasher.stats(),
+        "login_limiter": login_limiter.stats(),
+    }
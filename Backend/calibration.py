@@ -0,0 +1,131 @@
+"""
+Per-probe calibration of the humidity sensors.
+
+Each place with a probe may have a profile in the `calibrations` collection:
+
+- "two_point":  linear between dry_raw (0 %) and wet_raw (100 %); works for
+                both polarities (capteurH.py wires probes the other way round)
+- "piecewise":  linear interpolation through (raw, percent) points
+- "polynomial": percent = polyval(coefficients, raw), highest degree first
+
+Places without a profile use the historical mapping 100 - raw / 1023 * 100.
+Conversions work on NumPy arrays so a whole batch of samples (a sweep, or
+an hour of stored history) is converted in one call.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+CALIBRATIONS_COLLECTION = "calibrations"
+
+ADC_MAX = 1023
+
+PROFILE_KINDS = ("two_point", "piecewise", "polynomial")
+
+
+@dataclass
+class CalibrationProfile:
+    place: int
+    kind: str = "two_point"
+    dry_raw: float = ADC_MAX
+    wet_raw: float = 0
+    points: List[List[float]] = field(default_factory=list)   # [[raw, percent], ...]
+    coefficients: List[float] = field(default_factory=list)
+    updated_at: Optional[str] = None
+
+    def validate(self):
+        if self.kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown calibration kind '{self.kind}'")
+        if self.kind == "two_point" and self.dry_raw == self.wet_raw:
+            raise ValueError("dry_raw and wet_raw must differ")
+        if self.kind == "piecewise":
+            if len(self.points) < 2:
+                raise ValueError("A piecewise profile needs at least two points")
+            raws = [point[0] for point in self.points]
+            if len(set(raws)) != len(raws):
+                raise ValueError("Piecewise points must have distinct raw values")
+        if self.kind == "polynomial" and not self.coefficients:
+            raise ValueError("A polynomial profile needs coefficients")
+
+    def convert(self, raw) -> np.ndarray:
+        """Humidity percentage (0-100) of raw ADC values, vectorized"""
+        raw = np.asarray(raw, dtype=np.float64)
+        if self.kind == "piecewise":
+            points = np.asarray(sorted(self.points), dtype=np.float64)
+            percent = np.interp(raw, points[:, 0], points[:, 1])
+        elif self.kind == "polynomial":
+            percent = np.polyval(np.asarray(self.coefficients, dtype=np.float64), raw)
+        else:
+            percent = (self.dry_raw - raw) / (self.dry_raw - self.wet_raw) * 100.0
+        return np.clip(percent, 0.0, 100.0)
+
+    def to_document(self) -> dict:
+        return {
+            "place": self.place,
+            "kind": self.kind,
+            "dry_raw": self.dry_raw,
+            "wet_raw": self.wet_raw,
+            "points": self.points,
+            "coefficients": self.coefficients,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "CalibrationProfile":
+        return cls(
+            place=doc["place"],
+            kind=doc.get("kind", "two_point"),
+            dry_raw=doc.get("dry_raw", ADC_MAX),
+            wet_raw=doc.get("wet_raw", 0),
+            points=[list(point) for point in doc.get("points", [])],
+            coefficients=list(doc.get("coefficients", [])),
+            updated_at=doc.get("updated_at"),
+        )
+
+
+class CalibrationStore:
+    """In-memory copy of the calibrations collection"""
+
+    def __init__(self):
+        self.profiles: Dict[int, CalibrationProfile] = {}
+
+    def get(self, place: int) -> CalibrationProfile:
+        profile = self.profiles.get(place)
+        if profile is None:
+            # Historical linear mapping
+            profile = CalibrationProfile(place=place)
+        return profile
+
+    def convert(self, place: int, raw: Sequence[float]) -> np.ndarray:
+        return self.get(place).convert(raw)
+
+    async def load(self, db) -> int:
+        profiles = {}
+        async for doc in db[CALIBRATIONS_COLLECTION].find():
+            profile = CalibrationProfile.from_document(doc)
+            profiles[profile.place] = profile
+        self.profiles = profiles
+        return len(profiles)
+
+    async def save(self, db, profile: CalibrationProfile) -> CalibrationProfile:
+        profile.validate()
+        profile.updated_at = datetime.now().isoformat()
+        await db[CALIBRATIONS_COLLECTION].replace_one(
+            {"place": profile.place},
+            profile.to_document(),
+            upsert=True
+        )
+        self.profiles[profile.place] = profile
+        return profile
+
+    async def delete(self, db, place: int) -> bool:
+        result = await db[CALIBRATIONS_COLLECTION].delete_one({"place": place})
+        self.profiles.pop(place, None)
+        return result.deleted_count > 0
+
+
+# Create a single instance of the store
+calibration_store = CalibrationStore()
@@ -0,0 +1,200 @@
+"""
+The MongoDB client, shared by every module.
+
+The Motor client is built once here with explicit pool settings, timeouts and
+read preference, and `get_database` is the only database dependency of the
+routes.
+
+A pymongo pool listener keeps gauges on the connection pool (connections
+open, in use, requests waiting for one) and the time spent checking a
+connection out, so a saturated pool shows up as waits instead of slow
+requests. `ready()` pings the deployment with a short timeout for the
+readiness probe.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.server_api import ServerApi
+
+load_dotenv()
+
+# MongoDB configuration
+MONGODB_URL = os.getenv("MONGODB_URL", "").strip()
+MONGODB_DB = os.getenv("MONGODB_DB", "").strip()
+
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "20"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "2"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "20000"))
+# Longest wait for a free connection once the pool is full
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGODB_READ_PREFERENCE = os.getenv("MONGODB_READ_PREFERENCE", "primary")
+# Timeout of the readiness ping
+MONGODB_READY_TIMEOUT_MS = int(os.getenv("MONGODB_READY_TIMEOUT_MS", "1500"))
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool gauges and checkout latency, fed by pymongo events
+
+    Events are delivered on the threads running the operations, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.clears = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # Connections
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    # Checkouts (started and finished on the same thread)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+
+    def _waited(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        wait = self._waited()
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.clears,
+                "avg_checkout_ms": round(self._wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_checkout_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+class Database:
+    def __init__(self, uri: str = MONGODB_URL, name: str = MONGODB_DB):
+        self.name = name
+        self.pool = PoolMetrics()
+        self.client = AsyncIOMotorClient(
+            uri,
+            server_api=ServerApi('1'),
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            readPreference=MONGODB_READ_PREFERENCE,
+            event_listeners=[self.pool],
+        )
+        self.db: AsyncIOMotorDatabase = self.client[name]
+        self.last_ping_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def ping(self, timeout_ms: Optional[float] = None) -> float:
+        """Round trip of a ping in milliseconds; raises on failure or timeout"""
+        started = time.perf_counter()
+        try:
+            command = self.client.admin.command('ping')
+            if timeout_ms is not None:
+                await asyncio.wait_for(command, timeout_ms / 1000)
+            else:
+                await command
+        except asyncio.TimeoutError:
+            self.last_error = f"no reply within {timeout_ms:g} ms"
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self.last_ping_ms = (time.perf_counter() - started) * 1000
+        self.last_error = None
+        return self.last_ping_ms
+
+    async def ready(self) -> bool:
+        try:
+            await self.ping(MONGODB_READY_TIMEOUT_MS)
+        except Exception:
+            return False
+        return True
+
+    def close(self):
+        self.client.close()
+
+    def stats(self) -> dict:
+        return {
+            "database": self.name,
+            "max_pool_size": MONGODB_MAX_POOL_SIZE,
+            "min_pool_size": MONGODB_MIN_POOL_SIZE,
+            "read_preference": MONGODB_READ_PREFERENCE,
+            "last_ping_ms": round(self.last_ping_ms, 3) if self.last_ping_ms is not None else None,
+            "last_error": self.last_error,
+            "pool": self.pool.metrics(),
+        }
+
+
+# Create a single instance of the database
+database = Database()
+
+
+# Dependency to get the database
+async def get_database() -> AsyncIOMotorDatabase:
+    return database.db
@@ -0,0 +1,86 @@
+"""
+Fan-out hub for server-sent events.
+
+Producers (sensor sampler, watering scheduler, plant routes) publish events
+once; the hub encodes each event a single time and hands the same frame to
+every connected client. Each client has a bounded queue: a slow client loses
+its oldest events instead of slowing down producers or other clients.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+from typing import Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Events buffered per client before the oldest are dropped
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+# Seconds between keep-alive comments on idle streams
+EVENT_KEEPALIVE = float(os.getenv("EVENT_KEEPALIVE", "15"))
+
+
+class Subscription:
+    def __init__(self, hub: "EventHub", max_size: int):
+        self.hub = hub
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def push(self, frame: str):
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(frame)
+
+    async def next(self, timeout: float):
+        """Next encoded frame, or None after `timeout` seconds without events"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, max_queue: int = EVENT_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._subscribers: Set[Subscription] = set()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, self.max_queue)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data) -> None:
+        """Broadcast an event to every subscriber (never blocks)"""
+        self.published += 1
+        if not self._subscribers:
+            return
+        payload = json.dumps(data, default=str, separators=(",", ":"))
+        frame = f"id: {next(self._ids)}\nevent: {event}\ndata: {payload}\n\n"
+        for subscription in list(self._subscribers):
+            subscription.push(frame)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in self._subscribers),
+        }
+
+
+# Create a single instance of the hub
+event_hub = EventHub()
@@ -0,0 +1,121 @@
+"""
+Bounded thread pools for blocking work that must stay off the asyncio event loop.
+
+- hardware_executor: SPI / I2C / GPIO transfers
+- hashing_executor: bcrypt password hashing and verification
+- storage_executor: the local SQLite store (a single thread owns the connection)
+
+Each pool rejects new work once its queue is full instead of letting
+latency grow without bound, and keeps counters on queue depth and wait time.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HARDWARE_POOL_SIZE = int(os.getenv("HARDWARE_POOL_SIZE", "1"))
+HARDWARE_QUEUE_LIMIT = int(os.getenv("HARDWARE_QUEUE_LIMIT", "16"))
+HASHING_POOL_SIZE = int(os.getenv("HASHING_POOL_SIZE", "2"))
+HASHING_QUEUE_LIMIT = int(os.getenv("HASHING_QUEUE_LIMIT", "8"))
+STORAGE_QUEUE_LIMIT = int(os.getenv("STORAGE_QUEUE_LIMIT", "256"))
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a pool already holds as many jobs as it accepts"""
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0   # submitted but not started
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def _execute(self, enqueued_at, fn, args, kwargs):
+        started = time.perf_counter()
+        wait = started - enqueued_at
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._run_total += elapsed
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool and await its result"""
+        with self._lock:
+            if self._pending + self._running >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturated(f"{self.name} executor is saturated")
+            self._pending += 1
+            self._submitted += 1
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._execute, time.perf_counter(), fn, args, kwargs)
+        try:
+            return await loop.run_in_executor(self._pool, call)
+        except RuntimeError:
+            # The pool refused the job (shutdown): it was never started
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def metrics(self) -> dict:
+        with self._lock:
+            completed = self._completed
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "queue_limit": self.max_queue,
+                "queue_depth": self._pending,
+                "running": self._running,
+                "submitted": self._submitted,
+                "completed": completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_total / completed * 1000, 3) if completed else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "avg_run_ms": round(self._run_total / completed * 1000, 3) if completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+hardware_executor = BoundedExecutor("hardware", HARDWARE_POOL_SIZE, HARDWARE_QUEUE_LIMIT)
+hashing_executor = BoundedExecutor("hashing", HASHING_POOL_SIZE, HASHING_QUEUE_LIMIT)
+storage_executor = BoundedExecutor("storage", 1, STORAGE_QUEUE_LIMIT)
+
+
+def executors_metrics() -> dict:
+    return {
+        executor.name: executor.metrics()
+        for executor in (hardware_executor, hashing_executor, storage_executor)
+    }
+
+
+def shutdown_executors():
+    hardware_executor.shutdown()
+    hashing_executor.shutdown()
+    storage_executor.shutdown()
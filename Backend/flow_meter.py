@@ -0,0 +1,141 @@
+"""
+Flow metering of the valve lines.
+
+Lines listed in FLOW_SENSOR_PINS have a flow sensor whose pulses are counted
+by the hardware layer on edge interrupts. For those lines a dosing job closes
+its valve as soon as the target volume has gone through, and every job gets
+its measured volume and flow rate.
+
+Each line also has a learned flow rate (ml/s), an exponential average of the
+metered jobs, persisted in the `valve_flow` collection. Lines without a
+sensor dose in timed mode: duration = target / learned rate, starting from
+FLOW_DEFAULT_ML_S (the historical 40 ml per minute estimate).
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Dict
+
+from dotenv import load_dotenv
+
+from hardware import get_hardware, FLOW_PULSES_PER_ML
+from valve_controller import FLOW_SENSOR_MAPPING
+
+load_dotenv()
+
+logger = logging.getLogger("flow_meter")
+
+FLOW_COLLECTION = "valve_flow"
+
+FLOW_DEFAULT_ML_S = float(os.getenv("FLOW_DEFAULT_ML_S", str(40 / 60)))
+# Weight of the latest metered job in the learned rate
+FLOW_LEARNING_RATE = float(os.getenv("FLOW_LEARNING_RATE", "0.3"))
+# Metered jobs shorter than this are too noisy to learn from (seconds)
+FLOW_MIN_LEARN_SECONDS = float(os.getenv("FLOW_MIN_LEARN_SECONDS", "5"))
+# A metered job is stopped after this many times its expected duration
+FLOW_TIMEOUT_FACTOR = float(os.getenv("FLOW_TIMEOUT_FACTOR", "3"))
+
+
+class FlowMeter:
+    def __init__(self, sensors: Dict[int, int] = FLOW_SENSOR_MAPPING,
+                 pulses_per_ml: float = FLOW_PULSES_PER_ML):
+        self.sensors = dict(sensors)   # position -> flow sensor GPIO
+        self.pulses_per_ml = pulses_per_ml
+        self.counters = None
+        self.rates: Dict[int, dict] = {}
+
+    async def start(self, db) -> int:
+        """Set up the sensor inputs and load the learned rates"""
+        self.counters = get_hardware().pulses
+        if self.sensors:
+            if self.counters is None:
+                logger.warning("Flow sensors configured but no pulse counter available, using timed mode")
+            else:
+                self.counters.setup(set(self.sensors.values()))
+        try:
+            async for doc in db[FLOW_COLLECTION].find():
+                self.rates[doc["position"]] = doc
+        except Exception as e:
+            logger.error(f"Failed to load learned flow rates: {e}")
+        return len(self.rates)
+
+    def metered(self, position: int) -> bool:
+        return self.counters is not None and position in self.sensors
+
+    def rate(self, position: int) -> float:
+        """Learned flow rate of a line in ml/s"""
+        doc = self.rates.get(position)
+        return doc["ml_per_s"] if doc else FLOW_DEFAULT_ML_S
+
+    def timed_duration(self, position: int, target_ml: float) -> float:
+        """Seconds needed to deliver `target_ml` at the learned rate"""
+        return target_ml / self.rate(position)
+
+    def count(self, position: int) -> int:
+        return self.counters.count(self.sensors[position])
+
+    def to_ml(self, pulses: int) -> float:
+        return pulses / self.pulses_per_ml
+
+    def watch(self, position: int, start_count: int, target_ml: float,
+              callback: Callable[[], None]) -> Callable[[], None]:
+        """Run `callback` on the event loop once `target_ml` has flowed since `start_count`"""
+        loop = asyncio.get_running_loop()
+
+        def reached():
+            # Called from the interrupt thread of the hardware layer
+            loop.call_soon_threadsafe(callback)
+
+        target = start_count + max(1, round(target_ml * self.pulses_per_ml))
+        self.counters.watch(self.sensors[position], target, reached)
+        return reached
+
+    def unwatch(self, position: int, handle: Callable[[], None]):
+        self.counters.unwatch(self.sensors[position], handle)
+
+    async def learn(self, db, position: int, measured_ml: float, seconds: float):
+        """Fold a metered job into the learned rate of its line"""
+        if seconds < FLOW_MIN_LEARN_SECONDS or measured_ml <= 0:
+            return
+        observed = measured_ml / seconds
+        previous = self.rates.get(position)
+        if previous is None:
+            rate, samples = observed, 1
+        else:
+            rate = previous["ml_per_s"] + FLOW_LEARNING_RATE * (observed - previous["ml_per_s"])
+            samples = previous.get("samples", 0) + 1
+        doc = {
+            "position": position,
+            "ml_per_s": rate,
+            "last_ml_per_s": observed,
+            "samples": samples,
+            "updated_at": datetime.now().isoformat(),
+        }
+        self.rates[position] = doc
+        try:
+            await db[FLOW_COLLECTION].replace_one({"position": position}, doc, upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to save flow rate of position {position}: {e}")
+
+    def state(self) -> dict:
+        positions = sorted(set(self.sensors) | set(self.rates))
+        return {
+            "pulses_per_ml": self.pulses_per_ml,
+            "lines": [
+                {
+                    "position": position,
+                    "sensor_gpio": self.sensors.get(position),
+                    "metered": self.metered(position),
+                    "ml_per_s": round(self.rate(position), 3),
+                    "last_ml_per_s": self.rates.get(position, {}).get("last_ml_per_s"),
+                    "samples": self.rates.get(position, {}).get("samples", 0),
+                }
+                for position in positions
+            ],
+        }
+
+
+# Create a single instance of the meter
+flow_meter = FlowMeter()
@@ -0,0 +1,805 @@
+"""
+Hardware abstraction for the garden: digital outputs (pump and valves), the
+MCP3008 ADC (humidity probes), the MCP9808 I2C temperature sensor and the
+pulse counters of the flow sensors (GPIO inputs, counted on falling edges).
+
+The backend is selected with HARDWARE_BACKEND:
+
+- "rpi":       RPi.GPIO outputs and edge callbacks, spidev ADC, smbus2 temperature sensor
+- "gpiod":     GPIO character device (libgpiod) outputs and edge events, spidev / smbus2 sensors
+- "sysfs":     /sys/class/gpio outputs and edge interrupts, spidev / smbus2 sensors
+- "simulated": no hardware at all; soil moisture, temperature and flow are modelled
+- "auto":      "rpi" when RPi.GPIO can be used, "simulated" on a host without
+               GPIO at all (a development machine); a host with GPIO lines
+               where RPi.GPIO fails is an error, not a silent simulation
+
+Nothing touches the hardware at import time: drivers are created by
+get_hardware() on first use.
+"""
+
+import ctypes
+import fcntl
+import logging
+import math
+import os
+import random
+import select
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("hardware")
+
+HARDWARE_BACKEND = os.getenv("HARDWARE_BACKEND", "auto").strip().lower()
+
+# SPI / I2C configuration
+SPI_BUS = int(os.getenv("SPI_BUS", "0"))
+SPI_DEVICE = int(os.getenv("SPI_DEVICE", "0"))
+SPI_MAX_SPEED_HZ = int(os.getenv("SPI_MAX_SPEED_HZ", "50000"))
+# Clock of batched sweeps (MCP3008 is rated 1.35 MHz at 2.7 V, 3.6 MHz at 5 V)
+SPI_BATCH_SPEED_HZ = int(os.getenv("SPI_BATCH_SPEED_HZ", "1000000"))
+I2C_BUS = int(os.getenv("I2C_BUS", "1"))
+MCP9808_I2C_ADDR = 0x18  # Adresse I2C par défaut
+MCP9808_REG_AMBIENT_TEMP = 0x05
+
+# gpiod configuration
+GPIO_CHIP = os.getenv("GPIO_CHIP", "/dev/gpiochip0")
+
+# Flow sensors: pulses per millilitre (YF-S201: ~450 pulses per litre)
+FLOW_PULSES_PER_ML = float(os.getenv("FLOW_PULSES_PER_ML", "0.45"))
+
+# Simulation configuration
+SIMULATION_SEED = int(os.getenv("SIMULATION_SEED", "42"))
+# Simulated seconds per real second (speeds up drying / watering)
+SIMULATION_TIME_SCALE = float(os.getenv("SIMULATION_TIME_SCALE", "1.0"))
+# Flow through one open valve of the simulated garden
+SIMULATION_FLOW_ML_S = float(os.getenv("SIMULATION_FLOW_ML_S", "25"))
+
+
+# Interfaces
+
+class DigitalOutputs:
+    """Push-pull outputs addressed by BCM GPIO number"""
+
+    def setup(self, pins: Iterable[int]):
+        raise NotImplementedError
+
+    def write(self, pin: int, active: bool):
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+
+class ADC:
+    """10-bit MCP3008-style analog inputs"""
+
+    def read_channel(self, channel: int) -> int:
+        raise NotImplementedError
+
+    def read_channels(self, channels: Iterable[int], samples: int = 1) -> Dict[int, List[int]]:
+        """`samples` conversions of every channel, interleaved across channels"""
+        channels = list(channels)
+        readings = {channel: [] for channel in channels}
+        for _ in range(samples):
+            for channel in channels:
+                readings[channel].append(self.read_channel(channel))
+        return readings
+
+    def close(self):
+        pass
+
+
+class Thermometer:
+    def read_celsius(self) -> float:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PulseCounters:
+    """
+    Falling-edge counters on GPIO inputs (flow sensors).
+
+    Backends call _pulse() from their interrupt / event thread. A watch fires
+    its callback, in that thread, once a pin's count reaches a target.
+    """
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self._watches: Dict[int, List[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def setup(self, pins: Iterable[int]):
+        raise NotImplementedError
+
+    def count(self, pin: int) -> int:
+        """Pulses seen on `pin` since setup"""
+        return self._counts.get(pin, 0)
+
+    def watch(self, pin: int, target: int, callback: Callable[[], None]):
+        """Call `callback` once the count of `pin` reaches `target`"""
+        with self._lock:
+            if self._counts.get(pin, 0) >= target:
+                fire = True
+            else:
+                fire = False
+                self._watches.setdefault(pin, []).append((target, callback))
+        if fire:
+            callback()
+
+    def unwatch(self, pin: int, callback: Callable[[], None]):
+        with self._lock:
+            self._watches[pin] = [w for w in self._watches.get(pin, []) if w[1] is not callback]
+
+    def _pulse(self, pin: int, pulses: int = 1):
+        with self._lock:
+            count = self._counts.get(pin, 0) + pulses
+            self._counts[pin] = count
+            watches = self._watches.get(pin)
+            due = []
+            if watches:
+                due = [w for w in watches if w[0] <= count]
+                if due:
+                    self._watches[pin] = [w for w in watches if w[0] > count]
+        for _, callback in due:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Flow watch callback on GPIO {pin} failed: {e}")
+
+    def close(self):
+        pass
+
+
+# Real hardware backends
+
+class RPiGPIOOutputs(DigitalOutputs):
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup(self, pins):
+        for pin in pins:
+            self.GPIO.setup(pin, self.GPIO.OUT, initial=self.GPIO.LOW)
+
+    def write(self, pin, active):
+        self.GPIO.output(pin, self.GPIO.HIGH if active else self.GPIO.LOW)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class GpiodOutputs(DigitalOutputs):
+    """GPIO character device outputs (libgpiod 2.x bindings, 1.x as fallback)"""
+
+    def __init__(self, chip_path: str = GPIO_CHIP):
+        import gpiod
+        self.gpiod = gpiod
+        self.chip_path = chip_path
+        self._request = None
+        self._lines = {}
+        self._chip = None
+
+    def setup(self, pins):
+        pins = sorted(set(pins))
+        gpiod = self.gpiod
+        if hasattr(gpiod, "request_lines"):
+            from gpiod.line import Direction, Value
+            self._value = Value
+            self._request = gpiod.request_lines(
+                self.chip_path,
+                consumer="e-garden",
+                config={tuple(pins): gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)},
+            )
+        else:
+            self._chip = gpiod.Chip(self.chip_path)
+            for pin in pins:
+                line = self._chip.get_line(pin)
+                line.request(consumer="e-garden", type=gpiod.LINE_REQ_DIR_OUT, default_val=0)
+                self._lines[pin] = line
+
+    def write(self, pin, active):
+        if self._request is not None:
+            self._request.set_value(pin, self._value.ACTIVE if active else self._value.INACTIVE)
+        else:
+            self._lines[pin].set_value(1 if active else 0)
+
+    def cleanup(self):
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+        for line in self._lines.values():
+            line.release()
+        self._lines.clear()
+        if self._chip is not None:
+            self._chip.close()
+            self._chip = None
+
+
+class SysfsOutputs(DigitalOutputs):
+    SYSFS_GPIO_PATH = Path("/sys/class/gpio")
+
+    def __init__(self):
+        if not self.SYSFS_GPIO_PATH.exists():
+            raise RuntimeError("sysfs GPIO interface not available")
+        self._exported = set()
+
+    def _pin_path(self, pin):
+        return self.SYSFS_GPIO_PATH / f"gpio{pin}"
+
+    def setup(self, pins):
+        for pin in pins:
+            if not self._pin_path(pin).exists():
+                (self.SYSFS_GPIO_PATH / "export").write_text(str(pin))
+                # udev needs a moment to apply permissions on the new files
+                for _ in range(20):
+                    if (self._pin_path(pin) / "direction").exists():
+                        break
+                    time.sleep(0.05)
+            self._exported.add(pin)
+            (self._pin_path(pin) / "direction").write_text("low")
+
+    def write(self, pin, active):
+        (self._pin_path(pin) / "value").write_text("1" if active else "0")
+
+    def cleanup(self):
+        for pin in self._exported:
+            try:
+                (self.SYSFS_GPIO_PATH / "unexport").write_text(str(pin))
+            except OSError:
+                pass
+        self._exported.clear()
+
+
+class RPiGPIOPulseCounters(PulseCounters):
+    """RPi.GPIO edge detection: callbacks run in the library's event thread"""
+
+    def __init__(self):
+        super().__init__()
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        self._pins = set()
+
+    def setup(self, pins):
+        for pin in pins:
+            self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+            self.GPIO.add_event_detect(pin, self.GPIO.FALLING, callback=self._pulse)
+            self._pins.add(pin)
+
+    def close(self):
+        for pin in self._pins:
+            try:
+                self.GPIO.remove_event_detect(pin)
+            except Exception:
+                pass
+        self._pins.clear()
+
+
+class GpiodPulseCounters(PulseCounters):
+    """Kernel edge events of the GPIO character device, read by one thread"""
+
+    def __init__(self, chip_path: str = GPIO_CHIP):
+        super().__init__()
+        import gpiod
+        self.gpiod = gpiod
+        self.chip_path = chip_path
+        self._request = None
+        self._chip = None
+        self._lines = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def setup(self, pins):
+        pins = sorted(set(pins))
+        gpiod = self.gpiod
+        if hasattr(gpiod, "request_lines"):
+            from gpiod.line import Bias, Direction, Edge
+            self._request = gpiod.request_lines(
+                self.chip_path,
+                consumer="e-garden-flow",
+                config={tuple(pins): gpiod.LineSettings(direction=Direction.INPUT, edge_detection=Edge.FALLING,
+                                                        bias=Bias.PULL_UP)},
+            )
+            target = self._read_v2
+        else:
+            self._chip = gpiod.Chip(self.chip_path)
+            for pin in pins:
+                line = self._chip.get_line(pin)
+                line.request(consumer="e-garden-flow", type=gpiod.LINE_REQ_EV_FALLING_EDGE)
+                self._lines.append((pin, line))
+            target = self._read_v1
+        self._thread = threading.Thread(target=target, name="flow-pulses", daemon=True)
+        self._thread.start()
+
+    def _read_v2(self):
+        while not self._stop.is_set():
+            if self._request.wait_edge_events(1.0):
+                for event in self._request.read_edge_events():
+                    self._pulse(event.line_offset)
+
+    def _read_v1(self):
+        while not self._stop.is_set():
+            for pin, line in self._lines:
+                # Blocks in the kernel until an edge arrives (or the short timeout)
+                if line.event_wait(nsec=100_000_000):
+                    line.event_read()
+                    self._pulse(pin)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._request is not None:
+            self._request.release()
+            self._request = None
+        for _, line in self._lines:
+            line.release()
+        self._lines.clear()
+        if self._chip is not None:
+            self._chip.close()
+            self._chip = None
+
+
+class SysfsPulseCounters(PulseCounters):
+    """sysfs edge interrupts: poll() on the value files wakes on each falling edge"""
+
+    SYSFS_GPIO_PATH = SysfsOutputs.SYSFS_GPIO_PATH
+
+    def __init__(self):
+        super().__init__()
+        if not self.SYSFS_GPIO_PATH.exists():
+            raise RuntimeError("sysfs GPIO interface not available")
+        self._files = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def setup(self, pins):
+        poller = select.poll()
+        for pin in pins:
+            path = self.SYSFS_GPIO_PATH / f"gpio{pin}"
+            if not path.exists():
+                (self.SYSFS_GPIO_PATH / "export").write_text(str(pin))
+                for _ in range(20):
+                    if (path / "edge").exists():
+                        break
+                    time.sleep(0.05)
+            (path / "direction").write_text("in")
+            (path / "edge").write_text("falling")
+            value = open(path / "value", "rb")
+            value.read()
+            self._files[value.fileno()] = (pin, value)
+            poller.register(value.fileno(), select.POLLPRI | select.POLLERR)
+        self._thread = threading.Thread(target=self._read, args=(poller,), name="flow-pulses", daemon=True)
+        self._thread.start()
+
+    def _read(self, poller):
+        while not self._stop.is_set():
+            for fd, _ in poller.poll(1000):
+                pin, value = self._files[fd]
+                value.seek(0)
+                value.read()
+                self._pulse(pin)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        for _, value in self._files.values():
+            value.close()
+        self._files.clear()
+
+
+class _SpiIocTransfer(ctypes.Structure):
+    """struct spi_ioc_transfer from <linux/spi/spidev.h>"""
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("word_delay_usecs", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8),
+    ]
+
+
+def _spi_ioc_message(count: int) -> int:
+    """SPI_IOC_MESSAGE(count) = _IOW('k', 0, char[count * sizeof(spi_ioc_transfer)])"""
+    size = count * ctypes.sizeof(_SpiIocTransfer)
+    return (1 << 30) | (size << 16) | (ord("k") << 8)
+
+
+class SpidevMCP3008(ADC):
+    # SPI_MSGSIZE must stay below 1 << 14 bytes
+    MAX_TRANSFERS_PER_MESSAGE = ((1 << 14) - 1) // 32
+
+    def __init__(self, bus: int = SPI_BUS, device: int = SPI_DEVICE, max_speed_hz: int = SPI_MAX_SPEED_HZ,
+                 batch_speed_hz: int = SPI_BATCH_SPEED_HZ):
+        import spidev
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = max_speed_hz
+        self.batch_speed_hz = batch_speed_hz
+        self.batch_supported = True
+
+    @staticmethod
+    def _check_channel(channel):
+        if channel < 0 or channel > 7:
+            raise ValueError("Channel must be between 0 and 7.")
+
+    def read_channel(self, channel):
+        self._check_channel(channel)
+        # SPI message to read from ADC
+        response = self.spi.xfer2([1, (8 + channel) << 4, 0])
+        # Convert the raw value (10-bit value)
+        return ((response[1] & 3) << 8) + response[2]
+
+    def _transfer_batch(self, channels: List[int]) -> List[int]:
+        """
+        One conversion per entry of `channels` in a single SPI_IOC_MESSAGE.
+
+        The MCP3008 needs CS to rise between two conversions, so each
+        conversion is its own 3-byte transfer with cs_change set; the kernel
+        still runs them all in one syscall at batch_speed_hz.
+        """
+        count = len(channels)
+        tx = (ctypes.c_uint8 * (3 * count))()
+        rx = (ctypes.c_uint8 * (3 * count))()
+        transfers = (_SpiIocTransfer * count)()
+        for index, channel in enumerate(channels):
+            tx[3 * index] = 1
+            tx[3 * index + 1] = (8 + channel) << 4
+            transfer = transfers[index]
+            transfer.tx_buf = ctypes.addressof(tx) + 3 * index
+            transfer.rx_buf = ctypes.addressof(rx) + 3 * index
+            transfer.len = 3
+            transfer.speed_hz = self.batch_speed_hz
+            transfer.bits_per_word = 8
+            # Release CS after each conversion except the last one (released anyway)
+            transfer.cs_change = 1 if index < count - 1 else 0
+        fcntl.ioctl(self.spi.fileno(), _spi_ioc_message(count), transfers)
+        return [((rx[3 * index + 1] & 3) << 8) + rx[3 * index + 2] for index in range(count)]
+
+    def read_channels(self, channels, samples=1):
+        channels = list(channels)
+        for channel in channels:
+            self._check_channel(channel)
+        if not self.batch_supported:
+            return super().read_channels(channels, samples)
+
+        sequence = channels * samples
+        values = []
+        try:
+            for start in range(0, len(sequence), self.MAX_TRANSFERS_PER_MESSAGE):
+                values.extend(self._transfer_batch(sequence[start:start + self.MAX_TRANSFERS_PER_MESSAGE]))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Batched SPI transfer unavailable ({e}), reading channels one by one")
+            self.batch_supported = False
+            return super().read_channels(channels, samples)
+
+        readings = {channel: [] for channel in channels}
+        for channel, value in zip(sequence, values):
+            readings[channel].append(value)
+        return readings
+
+    def close(self):
+        self.spi.close()
+
+
+class Smbus2MCP9808(Thermometer):
+    def __init__(self, bus: int = I2C_BUS, address: int = MCP9808_I2C_ADDR):
+        import smbus2
+        self.smbus2 = smbus2
+        self.bus_number = bus
+        self.address = address
+        self.bus = None
+
+    def read_celsius(self):
+        if self.bus is None:
+            self.bus = self.smbus2.SMBus(self.bus_number)
+        try:
+            data = self.bus.read_i2c_block_data(self.address, MCP9808_REG_AMBIENT_TEMP, 2)
+        except OSError:
+            # Reopen the bus on the next read
+            self.close()
+            raise
+        raw_temp = (data[0] << 8) | data[1]
+        temp_c = (raw_temp & 0x0FFF) / 16.0
+        if raw_temp & 0x1000:  # Bit de signe
+            temp_c -= 256.0
+        return temp_c
+
+    def close(self):
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+
+# Simulated backend
+
+class SimulatedGarden:
+    """
+    Deterministic soil model shared by the simulated drivers.
+
+    Each humidity channel dries exponentially towards DRY_LEVEL,
+    faster when it is warm, and wets towards 100% while its valve and the
+    pump are both on. Time is the monotonic clock scaled by
+    SIMULATION_TIME_SCALE; measurement noise comes from a seeded generator.
+    """
+
+    DRY_LEVEL = 10.0            # % reached after a long time without water
+    DRYING_TIME_CONSTANT = 2 * 24 * 3600.0   # seconds at 20°C
+    WETTING_TIME_CONSTANT = 120.0             # seconds with the valve open
+    NOISE = 0.4                 # % standard deviation of a reading
+
+    def __init__(self, channel_valves: Dict[int, int], pump_pin: int,
+                 seed: int = SIMULATION_SEED, time_scale: float = SIMULATION_TIME_SCALE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.channel_valves = dict(channel_valves)
+        self.pump_pin = pump_pin
+        self.time_scale = time_scale
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.moisture = {channel: 55.0 + 5 * index for index, channel in enumerate(sorted(self.channel_valves))}
+        self.outputs: Dict[int, bool] = {}
+        self.delivered_ml: Dict[int, float] = {}   # per valve pin
+        self.flow_ml_s = SIMULATION_FLOW_ML_S
+        self._started = clock()
+        self._last = self._started
+        local = time.localtime()
+        self._start_hour = local.tm_hour + local.tm_min / 60
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        """Simulated seconds elapsed since the garden was created"""
+        return (self.clock() - self._started) * self.time_scale
+
+    def temperature(self) -> float:
+        """Daily cycle between 14°C and 26°C, warmest mid-afternoon"""
+        local_hour = (self._start_hour + self.now() / 3600) % 24
+        return 20.0 + 6.0 * math.sin((local_hour - 9) / 24 * 2 * math.pi)
+
+    def _advance(self):
+        now = self.clock()
+        dt = (now - self._last) * self.time_scale
+        self._last = now
+        if dt <= 0:
+            return
+        drying_factor = max(0.2, 1 + (self.temperature() - 20) / 20)
+        pump_on = self.outputs.get(self.pump_pin, False)
+        if pump_on:
+            for pin, active in self.outputs.items():
+                if active and pin != self.pump_pin:
+                    self.delivered_ml[pin] = self.delivered_ml.get(pin, 0.0) + self.flow_ml_s * dt
+        for channel, valve in self.channel_valves.items():
+            level = self.moisture[channel]
+            if pump_on and self.outputs.get(valve, False):
+                level = 100 - (100 - level) * math.exp(-dt / self.WETTING_TIME_CONSTANT)
+            else:
+                tau = self.DRYING_TIME_CONSTANT / drying_factor
+                level = self.DRY_LEVEL + (level - self.DRY_LEVEL) * math.exp(-dt / tau)
+            self.moisture[channel] = level
+
+    def set_output(self, pin: int, active: bool):
+        with self._lock:
+            # Integrate up to now with the previous output state
+            self._advance()
+            self.outputs[pin] = active
+
+    def read_moisture(self, channel: int) -> Optional[float]:
+        with self._lock:
+            self._advance()
+            if channel not in self.moisture:
+                return None
+            return min(100.0, max(0.0, self.moisture[channel] + self.random.gauss(0, self.NOISE)))
+
+    def read_delivered(self, valve_pin: int) -> float:
+        """Millilitres that went through a valve since the garden was created"""
+        with self._lock:
+            self._advance()
+            return self.delivered_ml.get(valve_pin, 0.0)
+
+
+class SimulatedOutputs(DigitalOutputs):
+    def __init__(self, garden: SimulatedGarden):
+        self.garden = garden
+
+    def setup(self, pins):
+        for pin in pins:
+            self.garden.set_output(pin, False)
+
+    def write(self, pin, active):
+        logger.debug(f"SIMULATION: GPIO {pin} {'HIGH' if active else 'LOW'}")
+        self.garden.set_output(pin, active)
+
+
+class SimulatedADC(ADC):
+    def __init__(self, garden: SimulatedGarden):
+        self.garden = garden
+
+    def read_channel(self, channel):
+        if channel < 0 or channel > 7:
+            raise ValueError("Channel must be between 0 and 7.")
+        moisture = self.garden.read_moisture(channel)
+        if moisture is None:
+            # Floating input: reads as dry soil
+            return 1023
+        # Same polarity as the real probes: wet soil = low ADC value
+        return int(round((100 - moisture) / 100 * 1023))
+
+
+class SimulatedThermometer(Thermometer):
+    def __init__(self, garden: SimulatedGarden):
+        self.garden = garden
+
+    def read_celsius(self):
+        return self.garden.temperature() + self.garden.random.gauss(0, 0.05)
+
+
+class SimulatedPulseCounters(PulseCounters):
+    """Flow sensors of the simulated garden, one per valve line
+
+    A background thread turns the volume delivered through each valve into
+    pulses, as a real sensor would.
+    """
+
+    def __init__(self, garden: SimulatedGarden, sensor_valves: Dict[int, int],
+                 pulses_per_ml: float = FLOW_PULSES_PER_ML, period: float = 0.05):
+        super().__init__()
+        self.garden = garden
+        self.sensor_valves = dict(sensor_valves)   # flow sensor pin -> valve pin
+        self.pulses_per_ml = pulses_per_ml
+        self.period = period
+        self._pins: List[int] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def setup(self, pins):
+        self._pins = [pin for pin in pins if pin in self.sensor_valves]
+        if not self._pins:
+            return
+        self._thread = threading.Thread(target=self._run, name="flow-pulses", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            for pin in self._pins:
+                total = int(self.garden.read_delivered(self.sensor_valves[pin]) * self.pulses_per_ml)
+                missing = total - self.count(pin)
+                if missing > 0:
+                    self._pulse(pin, missing)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+
+# Backend selection
+
+@dataclass
+class Hardware:
+    backend: str
+    outputs: DigitalOutputs
+    adc: Optional[ADC]
+    thermometer: Optional[Thermometer]
+    pulses: Optional[PulseCounters] = None
+
+    @property
+    def simulated(self) -> bool:
+        return self.backend == "simulated"
+
+    def close(self):
+        for driver in (self.adc, self.thermometer, self.pulses):
+            if driver is not None:
+                try:
+                    driver.close()
+                except Exception as e:
+                    logger.error(f"Failed to close {type(driver).__name__}: {e}")
+        self.outputs.cleanup()
+
+
+_hardware: Optional[Hardware] = None
+_hardware_lock = threading.Lock()
+
+
+def _build_simulated() -> Hardware:
+    # Imported here: both modules import this one
+    from humidity_service import CHANNEL_MAPPING
+    from valve_controller import VALVE_MAPPING, PUMP_GPIO, FLOW_SENSOR_MAPPING
+    garden = SimulatedGarden(
+        {channel: VALVE_MAPPING[place] for place, channel in CHANNEL_MAPPING.items()},
+        PUMP_GPIO,
+    )
+    pulses = SimulatedPulseCounters(
+        garden,
+        {sensor: VALVE_MAPPING[place] for place, sensor in FLOW_SENSOR_MAPPING.items()},
+    )
+    return Hardware("simulated", SimulatedOutputs(garden), SimulatedADC(garden), SimulatedThermometer(garden),
+                    pulses)
+
+
+def _build_pulses(counters_class) -> Optional[PulseCounters]:
+    try:
+        return counters_class()
+    except Exception as e:
+        logger.error(f"Failed to initialize flow sensor inputs: {e}")
+        return None
+
+
+def _build_sensors():
+    adc = thermometer = None
+    try:
+        adc = SpidevMCP3008()
+    except Exception as e:
+        logger.error(f"Failed to initialize SPI: {e}")
+    try:
+        thermometer = Smbus2MCP9808()
+    except Exception as e:
+        logger.error(f"Failed to initialize I2C: {e}")
+    return adc, thermometer
+
+
+def _has_gpio() -> bool:
+    """Whether this host exposes GPIO lines (character devices or sysfs)"""
+    return any(Path("/dev").glob("gpiochip*")) or Path("/sys/class/gpio").exists()
+
+
+def _build(backend: str) -> Hardware:
+    if backend == "simulated":
+        return _build_simulated()
+    if backend == "auto":
+        try:
+            outputs = RPiGPIOOutputs()
+        except (ImportError, RuntimeError) as e:
+            if _has_gpio():
+                # On the Pi a broken RPi.GPIO must not turn the valves into a simulation
+                raise RuntimeError(
+                    f"RPi.GPIO unavailable on a host with GPIO lines ({e}): fix it, pick "
+                    "HARDWARE_BACKEND=gpiod or sysfs, or set HARDWARE_BACKEND=simulated explicitly"
+                ) from e
+            logger.warning(f"No GPIO on this host ({e}), using the simulated hardware backend")
+            return _build_simulated()
+        return Hardware("rpi", outputs, *_build_sensors(), _build_pulses(RPiGPIOPulseCounters))
+    classes = {
+        "rpi": (RPiGPIOOutputs, RPiGPIOPulseCounters),
+        "gpiod": (GpiodOutputs, GpiodPulseCounters),
+        "sysfs": (SysfsOutputs, SysfsPulseCounters),
+    }.get(backend)
+    if classes is None:
+        raise ValueError(f"Unknown HARDWARE_BACKEND: {backend}")
+    outputs_class, pulses_class = classes
+    return Hardware(backend, outputs_class(), *_build_sensors(), _build_pulses(pulses_class))
+
+
+def get_hardware() -> Hardware:
+    """Hardware drivers of the configured backend, created on first call"""
+    global _hardware
+    with _hardware_lock:
+        if _hardware is None:
+            _hardware = _build(HARDWARE_BACKEND)
+            logger.info(f"Hardware backend: {_hardware.backend}")
+        return _hardware
+
+
+def close_hardware():
+    global _hardware
+    with _hardware_lock:
+        if _hardware is not None:
+            _hardware.close()
+            _hardware = None
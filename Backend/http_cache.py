@@ -0,0 +1,108 @@
+"""
+Conditional GET for the plant read endpoints.
+
+Every write handler bumps the revision of the collections it modifies. The
+ETag of a cached route is derived from the request URL, the revisions of the
+collections the route reads and a nonce drawn at boot (counters restart at
+zero with the process). A request whose If-None-Match still matches is
+answered 304 by the middleware, before the route queries MongoDB or builds
+its body.
+
+A 304 is only returned to an authenticated client: the bearer token is
+verified and its user must already be resolved in the user cache, otherwise
+the request goes through the route (and its auth dependencies) as usual.
+"""
+
+import hashlib
+import re
+import uuid
+from typing import Dict, List, Pattern, Tuple
+
+from fastapi import Request, Response, status
+
+from tokens import token_service, InvalidToken
+from user_cache import user_cache
+
+# Clients may keep responses but must revalidate them before each use
+CACHE_CONTROL = "private, no-cache"
+
+
+class RevisionCounters:
+    def __init__(self):
+        self.nonce = uuid.uuid4().hex
+        self._revisions: Dict[str, int] = {}
+
+    def bump(self, *collections: str):
+        for collection in collections:
+            self._revisions[collection] = self._revisions.get(collection, 0) + 1
+
+    def get(self, collection: str) -> int:
+        return self._revisions.get(collection, 0)
+
+    def stats(self) -> dict:
+        return dict(self._revisions)
+
+
+# Create a single instance of the counters
+revisions = RevisionCounters()
+
+# Cached GET routes and the collections their body depends on
+CACHED_ROUTES: List[Tuple[Pattern, Tuple[str, ...]]] = [
+    (re.compile(r"^/plant/semis/?$"), ("semis",)),
+    (re.compile(r"^/plant/semis/[^/]+$"), ("semis",)),
+    (re.compile(r"^/plant/arrosages/[^/]+$"), ("arrosages",)),
+]
+
+
+def _dependencies(path: str):
+    for pattern, collections in CACHED_ROUTES:
+        if pattern.match(path):
+            return collections
+    return None
+
+
+def compute_etag(request: Request, collections) -> str:
+    key = "|".join(
+        [revisions.nonce, request.url.path, request.url.query]
+        + [f"{collection}={revisions.get(collection)}" for collection in collections]
+    )
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+async def _authenticated(request: Request) -> bool:
+    """Valid bearer token whose active user is already cached"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = await token_service.verify(token, "access")
+    except InvalidToken:
+        return False
+    user = user_cache.get(payload.get("sub"), payload.get("iat"))
+    return user is not None and not user.disabled
+
+
+async def http_cache_middleware(request: Request, call_next):
+    if request.method != "GET":
+        return await call_next(request)
+    collections = _dependencies(request.url.path)
+    if collections is None:
+        response = await call_next(request)
+        if "etag" in response.headers and "cache-control" not in response.headers:
+            response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    # Computed before the route runs: a write racing with it bumps the revision,
+    # so this ETag can never be served for newer data
+    etag = compute_etag(request, collections)
+    if request.headers.get("if-none-match") == etag and await _authenticated(request):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        )
+
+    response = await call_next(request)
+    if response.status_code == status.HTTP_200_OK:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
@@ -2,60 +2,139 @@
 Service for managing humidity sensors through MCP3008 ADC
 """
 
+import logging
+import os
+import statistics
 import time
-import spidev
 from datetime import datetime
+from dotenv import load_dotenv
+from hardware import get_hardware
+from calibration import calibration_store
+
+load_dotenv()
+
+logger = logging.getLogger("humidity_service")
+
+# Conversions per channel and per sweep
+HUMIDITY_OVERSAMPLING = int(os.getenv("HUMIDITY_OVERSAMPLING", "8"))
+# How samples of one sweep are combined: "median", "trimmed_mean" or "mean"
+HUMIDITY_FILTER = os.getenv("HUMIDITY_FILTER", "median").strip().lower()
+# Fraction of samples dropped at each end by the trimmed mean
+HUMIDITY_TRIM = float(os.getenv("HUMIDITY_TRIM", "0.25"))
+# Smoothing factor of the per-place exponential moving average (0 disables it)
+HUMIDITY_EMA_ALPHA = float(os.getenv("HUMIDITY_EMA_ALPHA", "0.3"))
+
+# Places equipped with a humidity probe and their MCP3008 channel
+CHANNEL_MAPPING = {
+    5: 0,  # Place 5 maps to channel 0
+    8: 1,  # Place 8 maps to channel 1
+    11: 2  # Place 11 maps to channel 2
+}
+
+def combine_samples(samples, method=HUMIDITY_FILTER, trim=HUMIDITY_TRIM):
+    """Reduce the raw samples of one channel to a single value"""
+    if method == "mean":
+        return statistics.fmean(samples)
+    if method == "trimmed_mean":
+        ordered = sorted(samples)
+        cut = int(len(ordered) * trim)
+        kept = ordered[cut:len(ordered) - cut] or ordered
+        return statistics.fmean(kept)
+    return statistics.median(samples)
 
 class HumiditySensor:
-    def __init__(self):
-        self.last_readings = {
-            5: None,  # Place 5 maps to channel 0
-            8: None,  # Place 8 maps to channel 1
-            11: None  # Place 11 maps to channel 2
-        }
-        self.channel_mapping = {
-            5: 0,  # Place 5 maps to channel 0
-            8: 1,  # Place 8 maps to channel 1
-            11: 2  # Place 11 maps to channel 2
-        }
+    def __init__(self, oversampling=HUMIDITY_OVERSAMPLING, ema_alpha=HUMIDITY_EMA_ALPHA):
+        self.last_readings = {place: None for place in CHANNEL_MAPPING}
+        self.channel_mapping = dict(CHANNEL_MAPPING)
         self.last_timestamp = None
-        
-        # Initialize SPI
-        try:
-            self.spi = spidev.SpiDev()
-            self.spi.open(0, 0)  # Use /dev/spidev0.0 for SPI communication
-            self.spi.max_speed_hz = 50000
-            self.spi_available = True
-        except Exception as e:
-            print(f"Failed to initialize SPI: {e}")
-            self.spi_available = False
+        self.oversampling = max(1, oversampling)
+        self.ema_alpha = ema_alpha
+        self.ema = {place: None for place in CHANNEL_MAPPING}
+        self.last_sweep_seconds = None
+    
+    @property
+    def adc(self):
+        # The ADC driver is only opened on first use
+        return get_hardware().adc
+    
+    @property
+    def spi_available(self):
+        return self.adc is not None
     
     def read_adc(self, channel):
         """Read a value from the MCP3008 ADC"""
-        if not self.spi_available:
+        adc = self.adc
+        if adc is None:
             return None
-            
-        if channel < 0 or channel > 7:
-            raise ValueError("Channel must be between 0 and 7.")
-        
-        # SPI message to read from ADC
-        command = [1, (8 + channel) << 4, 0]
-        response = self.spi.xfer2(command)
-        
-        # Convert the raw value (10-bit value)
-        result = ((response[1] & 3) << 8) + response[2]
-        return result
+        return adc.read_channel(channel)
     
-    def raw_to_percentage(self, raw_value):
+    def raw_to_percentage(self, raw_value, place=None):
         """Convert raw ADC value to humidity percentage"""
         if raw_value is None:
             return None
+        
+        # Per-probe calibration profile when the place is known
+        if place is not None:
+            return float(calibration_store.convert(place, raw_value))
             
         # For soil moisture sensors, we invert the percentage
         # Dry soil = high resistance = high ADC value
         # Wet soil = low resistance = low ADC value
         return 100 - (raw_value / 1023.0 * 100)
     
+    def sweep(self, places):
+        """
+        Read every given place in one batched ADC transaction.
+
+        Returns {place: (raw_sample, filtered_raw)} where raw_sample is the
+        first conversion and filtered_raw the combination of all of them.
+        """
+        adc = self.adc
+        if adc is None:
+            return {place: (None, None) for place in places}
+        channels = [self.channel_mapping[place] for place in places]
+        started = time.perf_counter()
+        samples = adc.read_channels(channels, self.oversampling)
+        self.last_sweep_seconds = time.perf_counter() - started
+        return {
+            place: (samples[channel][0], combine_samples(samples[channel]))
+            for place, channel in zip(places, channels)
+        }
+    
+    def _smooth(self, place, humidity):
+        """Exponential moving average of the filtered humidity of a place"""
+        if humidity is None or not self.ema_alpha:
+            return humidity
+        previous = self.ema.get(place)
+        value = humidity if previous is None else previous + self.ema_alpha * (humidity - previous)
+        self.ema[place] = value
+        return value
+    
+    def reset_smoothing(self, place=None):
+        """Forget the moving average (e.g. after a calibration change)"""
+        for key in ([place] if place is not None else list(self.ema)):
+            self.ema[key] = None
+    
+    def _reading(self, place, raw_value, filtered_raw, now):
+        unfiltered = humidity = None
+        if raw_value is not None:
+            # Both values converted by the place's calibration in one call
+            unfiltered, filtered = calibration_store.convert(place, [raw_value, filtered_raw]).tolist()
+            humidity = self._smooth(place, filtered)
+        
+        if humidity is not None:
+            self.last_readings[place] = humidity
+        
+        return {
+            "humidity": round(humidity, 2) if humidity is not None else None,
+            "humidity_unfiltered": round(unfiltered, 2) if unfiltered is not None else None,
+            "raw_value": raw_value,
+            "raw_filtered": round(filtered_raw, 2) if filtered_raw is not None else None,
+            "samples": self.oversampling,
+            "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "status": "success" if humidity is not None else "error"
+        }
+    
     def read_humidity(self, place=None):
         """Read humidity for a specific place or all places"""
         try:
@@ -70,44 +149,26 @@ class HumiditySensor:
                         "timestamp": now.strftime("%Y-%m-%d %H:%M:%S")
                     }
                 
-                channel = self.channel_mapping[place]
-                raw_value = self.read_adc(channel)
-                humidity = self.raw_to_percentage(raw_value)
-                
-                if humidity is not None:
-                    self.last_readings[place] = humidity
+                raw_value, filtered_raw = self.sweep([place])[place]
+                reading = self._reading(place, raw_value, filtered_raw, now)
+                if reading["humidity"] is not None:
                     self.last_timestamp = now
                 
-                return {
-                    "place": place, 
-                    "humidity": round(humidity, 2) if humidity is not None else None,
-                    "raw_value": raw_value,
-                    "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
-                    "status": "success" if humidity is not None else "error"
-                }
+                return {"place": place, **reading}
             
-            # Read all places with sensors
-            results = {}
-            for place, channel in self.channel_mapping.items():
-                raw_value = self.read_adc(channel)
-                humidity = self.raw_to_percentage(raw_value)
-                
-                if humidity is not None:
-                    self.last_readings[place] = humidity
-                
-                results[place] = {
-                    "humidity": round(humidity, 2) if humidity is not None else None,
-                    "raw_value": raw_value,
-                    "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
-                    "status": "success" if humidity is not None else "error"
-                }
+            # Read all places with sensors in a single sweep
+            sweep = self.sweep(list(self.channel_mapping))
+            results = {
+                place: self._reading(place, raw_value, filtered_raw, now)
+                for place, (raw_value, filtered_raw) in sweep.items()
+            }
             
             self.last_timestamp = now
             return results
             
         except Exception as e:
             error_msg = str(e)
-            print(f"Error reading humidity sensor: {error_msg}")
+            logger.error(f"Error reading humidity sensor: {error_msg}")
             
             # In case of error, return the last valid reading if available
             if place is not None and self.last_readings.get(place) is not None:
@@ -129,7 +190,7 @@ class HumiditySensor:
     def cleanup(self):
         """Clean up SPI resources"""
         if self.spi_available:
-            self.spi.close()
+            self.adc.close()
 
 # Create a single instance of the service
 humidity_service = HumiditySensor()
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+MongoDB indexes required by the hot query paths.
+
+ensure_indexes() is called at startup and creates whatever is missing from
+INDEXES. Existing indexes are left untouched.
+
+Some indexes are the only guard of an invariant (one plant per place, one
+use per refresh token): they are `required`. The API refuses to start when
+one of them cannot be built (e.g. duplicates in the data), and the readiness
+probe reports it until it exists.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+# Case-insensitive comparison (strength 2 ignores case, not accents)
+CASE_INSENSITIVE_COLLATION = {"locale": "fr", "strength": 2}
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    name: str
+    unique: bool = False
+    collation: Optional[dict] = field(default=None, hash=False)
+    expire_after_seconds: Optional[int] = None
+    required: bool = False
+
+    def options(self) -> dict:
+        options = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.collation:
+            options["collation"] = self.collation
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return options
+
+
+INDEXES: List[IndexSpec] = [
+    # Authentication: get_current_user, register / update checks
+    IndexSpec("users", (("username", ASCENDING),), "username_unique", unique=True),
+    IndexSpec("users", (("email", ASCENDING),), "email_unique", unique=True),
+    # Revoked token ids, dropped by MongoDB once the token has expired
+    IndexSpec("revoked_tokens", (("jti", ASCENDING),), "jti_unique", unique=True, required=True),
+    IndexSpec("revoked_tokens", (("exp", ASCENDING),), "exp_ttl", expire_after_seconds=0),
+    # Plants: one plant per grid position (enforces slot allocation in create / update), sort("place")
+    IndexSpec("semis", (("place", ASCENDING),), "place_unique", unique=True, required=True),
+    # Watering history per plant, newest first, paginated on (dateTime, _id);
+    # also serves delete_many by plantId
+    IndexSpec("arrosages", (("plantId", ASCENDING), ("dateTime", DESCENDING), ("_id", DESCENDING)),
+              "plantId_dateTime_id"),
+    # Plant reference data looked up by name, case-insensitively
+    IndexSpec("infos", (("name", ASCENDING),), "name_ci", collation=CASE_INSENSITIVE_COLLATION),
+    # Hourly sensor buckets
+    IndexSpec("sensor_history", (("sensor", ASCENDING), ("hour", ASCENDING)), "sensor_hour_unique", unique=True),
+    # Watering job journal: recovery and sweeps only scan open jobs
+    IndexSpec("watering_jobs", (("status", ASCENDING), ("deadline", ASCENDING)), "status_deadline"),
+    # Irrigation engine: decision log per place, newest first
+    IndexSpec("irrigation_decisions", (("place", ASCENDING), ("at", DESCENDING)), "place_at"),
+]
+
+
+async def ensure_indexes(db, indexes: List[IndexSpec] = INDEXES) -> List[dict]:
+    """Create missing indexes, returns one status entry per declared index"""
+    report = []
+    existing = {}
+    for spec in indexes:
+        entry = {"collection": spec.collection, "name": spec.name}
+        try:
+            if spec.collection not in existing:
+                existing[spec.collection] = await db[spec.collection].index_information()
+            if spec.name in existing[spec.collection]:
+                entry["status"] = "present"
+            else:
+                await db[spec.collection].create_index(list(spec.keys), **spec.options())
+                existing[spec.collection][spec.name] = {"key": list(spec.keys)}
+                entry["status"] = "created"
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        report.append(entry)
+    return report
+
+
+class MissingIndexError(RuntimeError):
+    pass
+
+
+# Set once every required index has been seen
+_required_verified = False
+
+
+async def ensure_required_indexes(db, indexes: List[IndexSpec] = INDEXES) -> List[str]:
+    """Create the required indexes if needed; returns those still missing ("collection.name")
+
+    Once all of them exist, later calls return at once.
+    """
+    global _required_verified
+    if _required_verified:
+        return []
+    required = [spec for spec in indexes if spec.required]
+    report = await ensure_indexes(db, required)
+    missing = [f"{entry['collection']}.{entry['name']}" for entry in report if entry["status"] == "failed"]
+    _required_verified = not missing
+    return missing
@@ -0,0 +1,153 @@
+"""
+In-memory copy of the `infos` reference catalog.
+
+The catalog is small and almost never changes, so it is loaded once at
+startup and served from memory. Names are indexed in a normalized form
+(casefolded, accents stripped) so "Carotte", "carotte" and "CAROTTE" hit
+the same entry, and unknown names fall back to a prefix match
+("carot" -> "carotte", "carottes" -> "carotte").
+
+Changes are picked up through a MongoDB change stream on `infos`. When the
+deployment does not support change streams, the catalog is reloaded every
+INFOS_REFRESH_INTERVAL seconds instead; the version only moves when the
+content actually changed.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import unicodedata
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+
+load_dotenv()
+
+logger = logging.getLogger("infos_cache")
+
+# Seconds between two reloads when change streams are not available
+INFOS_REFRESH_INTERVAL = float(os.getenv("INFOS_REFRESH_INTERVAL", "300"))
+
+
+def normalize_name(name: str) -> str:
+    """Casefolded name without accents or surrounding spaces"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+class InfosCache:
+    def __init__(self, refresh_interval: float = INFOS_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self.digest = ""
+        self.source = "none"
+        self._entries: Dict[str, dict] = {}
+        self._etags: Dict[str, str] = {}
+        self._keys: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+
+    # Lifecycle
+
+    async def start(self, db) -> int:
+        count = await self.reload(db)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch(db))
+        return count
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reload(self, db) -> int:
+        """Load the whole catalog; bumps the version if anything changed"""
+        documents = []
+        async for doc in db.infos.find():
+            doc["_id"] = str(doc["_id"])
+            documents.append(doc)
+        self._build(documents)
+        return len(documents)
+
+    def _build(self, documents: List[dict]):
+        entries, etags = {}, {}
+        for doc in sorted(documents, key=lambda d: d["_id"]):
+            key = normalize_name(str(doc.get("name", "")))
+            if not key or key in entries:
+                continue
+            body = json.dumps(doc, sort_keys=True, default=str, separators=(",", ":"))
+            entries[key] = doc
+            etags[key] = hashlib.sha1(body.encode()).hexdigest()
+
+        digest = hashlib.sha1("".join(f"{k}:{etags[k]}" for k in sorted(etags)).encode()).hexdigest()
+        if digest == self.digest:
+            return
+        self._entries = entries
+        self._etags = etags
+        self._keys = sorted(entries)
+        self.digest = digest
+        self.version += 1
+
+    async def _watch(self, db):
+        try:
+            async with db.infos.watch() as stream:
+                self.source = "change_stream"
+                async for _ in stream:
+                    await self.reload(db)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.info(f"Change streams unavailable on infos ({e}), polling every {self.refresh_interval:g}s")
+        self.source = "polling"
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.reload(db)
+            except Exception as e:
+                logger.error(f"Failed to reload infos catalog: {e}")
+
+    # Lookups
+
+    def _resolve(self, name: str) -> Optional[str]:
+        key = normalize_name(name)
+        if not key:
+            return None
+        if key in self._entries:
+            return key
+        # Catalog entry starting with the requested name
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index].startswith(key):
+            return self._keys[index]
+        # Longest catalog entry the requested name starts with (plurals, suffixes)
+        for candidate in sorted(self._keys, key=len, reverse=True):
+            if key.startswith(candidate):
+                return candidate
+        return None
+
+    def get(self, name: str) -> Optional[dict]:
+        key = self._resolve(name)
+        return self._entries.get(key) if key else None
+
+    def etag(self, name: str) -> Optional[str]:
+        """Strong ETag of the entry `name` resolves to"""
+        key = self._resolve(name)
+        return f'"{self._etags[key]}"' if key else None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "source": self.source,
+        }
+
+
+# Create a single instance of the cache
+infos_cache = InfosCache()
@@ -0,0 +1,295 @@
+"""
+Closed-loop automatic irrigation.
+
+Every IRRIGATION_TICK seconds the engine compares the filtered humidity of
+each sensor-equipped place (from the sensor sampler snapshot) with the
+target band of the plant growing there, taken from the `infos` catalog:
+
+- minHumidityLevel / maxHumidityLevel when the plant info defines them,
+- otherwise recommandedHumidityLevel -/+ IRRIGATION_BAND,
+- otherwise IRRIGATION_DEFAULT_TARGET -/+ IRRIGATION_BAND.
+
+A place starts needing water below the low end and is satisfied again only
+above the high end (hysteresis). Watering is dispatched to the scheduler
+with automatic priority, at most once per IRRIGATION_MIN_INTERVAL and within
+IRRIGATION_DAILY_BUDGET minutes of watering per place and per day.
+
+Every dispatch, and every change of decision for a place, is stored in the
+`irrigation_decisions` collection with automated: True (written to the local
+store first, then pushed by the replicator).
+"""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+
+from event_hub import event_hub
+from flow_meter import flow_meter
+from http_cache import revisions
+from humidity_service import humidity_service
+from infos_cache import infos_cache
+from local_store import local_store
+from sensor_sampler import sensor_sampler
+from watering_scheduler import watering_scheduler, PRIORITY_AUTOMATIC
+
+load_dotenv()
+
+logger = logging.getLogger("irrigation_engine")
+
+IRRIGATION_ENABLED = os.getenv("IRRIGATION_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+IRRIGATION_TICK = float(os.getenv("IRRIGATION_TICK", "60"))
+# Watering duration of one automatic cycle, in minutes like the API
+IRRIGATION_DURATION = float(os.getenv("IRRIGATION_DURATION", "0.5"))
+# Minimum seconds between two automatic waterings of the same place
+IRRIGATION_MIN_INTERVAL = float(os.getenv("IRRIGATION_MIN_INTERVAL", "1800"))
+# Maximum automatic watering per place and per day, in minutes
+IRRIGATION_DAILY_BUDGET = float(os.getenv("IRRIGATION_DAILY_BUDGET", "5"))
+IRRIGATION_BAND = float(os.getenv("IRRIGATION_BAND", "10"))
+IRRIGATION_DEFAULT_TARGET = float(os.getenv("IRRIGATION_DEFAULT_TARGET", "60"))
+
+DECISIONS_COLLECTION = "irrigation_decisions"
+
+
+@dataclass
+class PlaceState:
+    needs_water: bool = False
+    last_watering: Optional[datetime] = None
+    budget_day: Optional[str] = None
+    budget_used: float = 0
+    last_decision: Optional[str] = None
+
+
+class IrrigationEngine:
+    def __init__(self, enabled: bool = IRRIGATION_ENABLED, tick: float = IRRIGATION_TICK):
+        self.enabled = enabled
+        self.tick = tick
+        self.db = None
+        self.places: Dict[int, PlaceState] = {place: PlaceState() for place in humidity_service.channel_mapping}
+        self._task: Optional[asyncio.Task] = None
+
+    # Lifecycle
+
+    async def start(self, db):
+        self.db = db
+        await self._restore_state()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _restore_state(self):
+        """Rebuild today's budget and last watering from automated records
+
+        Records are read from MongoDB and from the local store, where the
+        latest ones may still wait to be pushed; a record in both counts once.
+        Only waterings that delivered water count: successful ones, or
+        interrupted ones with a measured volume.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        records = {}
+        try:
+            async for doc in self.db.arrosages.find(
+                {"automated": True, "place": {"$in": list(self.places)}, "dateTime": {"$gte": today},
+                 "$or": [{"success": True}, {"measured_ml": {"$gt": 0}}]},
+                {"place": 1, "duration": 1, "dateTime": 1}
+            ):
+                records[str(doc["_id"])] = doc
+        except Exception as e:
+            logger.error(f"Failed to read automated waterings from MongoDB: {e}")
+        for doc in await local_store.find("arrosages", "automated", True):
+            if doc.get("place") in self.places and doc.get("dateTime", "") >= today and (
+                doc.get("success") is True or (doc.get("measured_ml") or 0) > 0
+            ):
+                records[str(doc["_id"])] = doc
+
+        used, last = {}, {}
+        for doc in records.values():
+            place = doc["place"]
+            used[place] = used.get(place, 0.0) + float(doc["duration"])
+            last[place] = max(last.get(place, doc["dateTime"]), doc["dateTime"])
+        for place, minutes in used.items():
+            state = self.places[place]
+            state.budget_day = today
+            state.budget_used = minutes
+            state.last_watering = datetime.fromisoformat(last[place])
+
+    # Evaluation
+
+    @staticmethod
+    def target_band(info: Optional[dict]):
+        info = info or {}
+        if info.get("minHumidityLevel") is not None and info.get("maxHumidityLevel") is not None:
+            return float(info["minHumidityLevel"]), float(info["maxHumidityLevel"])
+        target = info.get("recommandedHumidityLevel", IRRIGATION_DEFAULT_TARGET)
+        return float(target) - IRRIGATION_BAND, float(target) + IRRIGATION_BAND
+
+    def evaluate(self, place: int, humidity: Optional[float], low: float, high: float, now: datetime):
+        """Decision for a place: ('water' | 'skip', reason)"""
+        state = self.places[place]
+        today = now.strftime("%Y-%m-%d")
+        if state.budget_day != today:
+            state.budget_day = today
+            state.budget_used = 0
+
+        if humidity is None:
+            return "skip", "no_reading"
+        # Hysteresis: needs water below `low`, satisfied again above `high`
+        if humidity < low:
+            state.needs_water = True
+        elif humidity >= high:
+            state.needs_water = False
+        if not state.needs_water:
+            return "skip", "in_band"
+        if state.last_watering and (now - state.last_watering).total_seconds() < IRRIGATION_MIN_INTERVAL:
+            return "skip", "min_interval"
+        if state.budget_used + IRRIGATION_DURATION > IRRIGATION_DAILY_BUDGET:
+            return "skip", "daily_budget"
+        return "water", "below_target"
+
+    async def _load_plants(self):
+        """Plants growing on sensor places"""
+        plants = {}
+        for plant in await local_store.find("semis"):
+            if plant.get("place") in self.places:
+                plants[plant["place"]] = plant
+        return plants
+
+    async def run_once(self):
+        snapshot = sensor_sampler.snapshot
+        if snapshot is None or snapshot.age() > sensor_sampler.stale_after:
+            logger.warning("Irrigation tick skipped: no fresh sensor snapshot")
+            return
+        now = datetime.now()
+        plants = await self._load_plants()
+        humidity_updates = []
+
+        for place, state in self.places.items():
+            plant = plants.get(place)
+            if plant is None:
+                continue
+            reading = snapshot.humidity.get(place) or {}
+            humidity = reading.get("humidity") if reading.get("status") == "success" else None
+            low, high = self.target_band(infos_cache.get(plant.get("nom") or ""))
+            decision, reason = self.evaluate(place, humidity, low, high, now)
+
+            if humidity is not None and plant.get("txHumidMesure") != round(humidity):
+                # Replace the simulated humidity by the measured one
+                humidity_updates.append((plant["_id"], round(humidity)))
+
+            if decision == "water":
+                watering_id = await self._dispatch(plant, place, now)
+                if watering_id is None:
+                    decision, reason = "skip", "dispatch_failed"
+                await self._record(place, plant, humidity, low, high, decision, reason, now, watering_id)
+            elif reason != state.last_decision:
+                await self._record(place, plant, humidity, low, high, decision, reason, now)
+            state.last_decision = reason
+
+        if humidity_updates:
+            for plant_id, value in humidity_updates:
+                await local_store.update_one(self.db, "semis", plant_id, {"txHumidMesure": value})
+            revisions.bump("semis")
+
+    async def _dispatch(self, plant: dict, place: int, now: datetime) -> Optional[str]:
+        """Queue an automatic watering; returns its arrosages id, None if it was not started"""
+        plant_id = str(plant["_id"])
+        watering_record = {
+            "_id": ObjectId(),
+            "plantId": plant_id,
+            "place": place,
+            "dateTime": now.isoformat(),
+            "duration": IRRIGATION_DURATION,
+            "amount": round(IRRIGATION_DURATION * 60 * flow_meter.rate(place)),  # Learned flow of the line
+            "created_at": now.isoformat(),
+            "created_by": "irrigation_engine",
+            "automated": True,
+            "completed": False
+        }
+        await local_store.insert("arrosages", [watering_record])
+        watering_id = str(watering_record["_id"])
+        try:
+            await watering_scheduler.submit(place, IRRIGATION_DURATION * 60, watering_id=watering_id,
+                                            plant_id=plant_id, priority=PRIORITY_AUTOMATIC)
+        except (ValueError, RuntimeError) as e:
+            await local_store.update_one(self.db, "arrosages", watering_record["_id"], {
+                "completed": True, "success": False, "completed_at": datetime.now().isoformat()
+            })
+            revisions.bump("arrosages")
+            logger.error(f"Automatic watering of place {place} not started: {e}")
+            return None
+        await local_store.update_one(self.db, "semis", plant["_id"], {"dernier_arrosage": now.isoformat()})
+        revisions.bump("semis", "arrosages")
+        state = self.places[place]
+        state.last_watering = now
+        state.budget_used += IRRIGATION_DURATION
+        logger.info(f"Automatic watering of place {place} ({IRRIGATION_DURATION:g} min)")
+        return watering_id
+
+    async def _record(self, place, plant, humidity, low, high, decision, reason, now, watering_id=None):
+        document = {
+            "_id": ObjectId(),
+            "place": place,
+            "plantId": str(plant["_id"]),
+            "humidity": humidity,
+            "low": low,
+            "high": high,
+            "decision": decision,
+            "reason": reason,
+            "watering_id": watering_id,
+            "automated": True,
+            "at": now.isoformat(),
+        }
+        try:
+            # Pushed to MongoDB by the replicator
+            await local_store.insert(DECISIONS_COLLECTION, [document])
+        except Exception as e:
+            # The decision log never holds up watering
+            logger.error(f"Failed to log irrigation decision for place {place}: {e}")
+        document = {key: value for key, value in document.items() if key != "_id"}
+        event_hub.publish("irrigation", document)
+
+    async def _run(self):
+        while True:
+            if self.enabled:
+                try:
+                    await self.run_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Irrigation tick failed: {e}")
+            await asyncio.sleep(self.tick)
+
+    def state(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tick": self.tick,
+            "duration": IRRIGATION_DURATION,
+            "min_interval": IRRIGATION_MIN_INTERVAL,
+            "daily_budget": IRRIGATION_DAILY_BUDGET,
+            "places": {
+                place: {
+                    "needs_water": state.needs_water,
+                    "last_watering": state.last_watering.isoformat() if state.last_watering else None,
+                    "budget_used": state.budget_used,
+                    "last_decision": state.last_decision,
+                }
+                for place, state in self.places.items()
+            },
+        }
+
+
+# Create a single instance of the engine
+irrigation_engine = IrrigationEngine()
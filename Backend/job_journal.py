@@ -0,0 +1,154 @@
+"""
+Durable journal of watering jobs.
+
+Every job of the watering scheduler has a document in the `watering_jobs`
+collection, keyed by the job id and updated on each state transition:
+
+    queued -> running -> completed | failed | cancelled
+
+A running job also records its deadline: the time by which its valve must
+be closed.
+
+The journal is written to the local store and pushed to MongoDB by the
+replicator, like the watering records: a watering never waits on Atlas, and
+jobs are recovered at startup from the local file even when Atlas is out of
+reach. Open jobs found only in MongoDB (local file lost or replaced) are
+closed there too when it answers.
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson.objectid import ObjectId
+
+from local_store import local_store
+
+logger = logging.getLogger("job_journal")
+
+JOBS_COLLECTION = "watering_jobs"
+
+OPEN_STATUSES = ("queued", "running")
+
+
+class JobJournal:
+    def __init__(self):
+        self.db = None
+
+    def attach(self, db):
+        self.db = db
+
+    async def _write(self, job_id: str, fields: dict, new: bool = False):
+        try:
+            if new:
+                await local_store.insert(JOBS_COLLECTION, [{"_id": job_id, **fields}])
+            else:
+                await local_store.update(JOBS_COLLECTION, job_id, fields)
+        except Exception as e:
+            # The watering itself does not depend on the journal
+            logger.error(f"Failed to journal job {job_id}: {e}")
+
+    async def queued(self, job):
+        await self._write(job.id, {
+            "position": job.position,
+            "gpio": job.gpio,
+            "duration": job.duration,
+            "target_ml": job.target_ml,
+            "watering_id": job.watering_id,
+            "plantId": job.plant_id,
+            "priority": job.priority,
+            "status": "queued",
+            "created_at": job.created_at,
+            "deadline": None,
+        }, new=True)
+
+    async def running(self, job, deadline: datetime):
+        await self._write(job.id, {
+            "status": "running",
+            "started_at": job.started_at,
+            "deadline": deadline,
+        })
+
+    async def finished(self, job, reason: Optional[str] = None):
+        await self._write(job.id, {
+            "status": job.status,
+            "finished_at": job.finished_at,
+            "reason": reason,
+        })
+
+    async def _open_jobs(self, exclude: List[str], overdue_before: Optional[datetime]) -> List[dict]:
+        statuses = OPEN_STATUSES if overdue_before is None else ("running",)
+        jobs = []
+        for status in statuses:
+            for doc in await local_store.find(JOBS_COLLECTION, "status", status):
+                if doc["_id"] in exclude:
+                    continue
+                if overdue_before is not None and not (doc.get("deadline") and doc["deadline"] < overdue_before):
+                    continue
+                jobs.append(doc)
+        return jobs
+
+    async def _close_remote_jobs(self, reason: str, now: datetime) -> Tuple[int, List[str]]:
+        """Close open jobs that only MongoDB knows; returns their number and arrosages ids"""
+        known = {doc["_id"] for doc in await local_store.find(JOBS_COLLECTION)}
+        job_ids, watering_ids = [], []
+        async for doc in self.db[JOBS_COLLECTION].find(
+            {"status": {"$in": list(OPEN_STATUSES)}, "_id": {"$nin": list(known)}}, {"watering_id": 1}
+        ):
+            job_ids.append(doc["_id"])
+            if doc.get("watering_id"):
+                watering_ids.append(doc["watering_id"])
+        if job_ids:
+            await self.db[JOBS_COLLECTION].update_many(
+                {"_id": {"$in": job_ids}},
+                {"$set": {"status": "failed", "finished_at": now, "reason": reason}}
+            )
+        return len(job_ids), watering_ids
+
+    async def close_open_jobs(self, reason: str, exclude: List[str] = (),
+                              overdue_before: Optional[datetime] = None) -> int:
+        """Mark open jobs failed, and their arrosages records unsuccessful
+
+        With `overdue_before`, only running jobs whose deadline has passed are
+        closed. Jobs listed in `exclude` are left alone. Without it (startup),
+        open jobs only found in MongoDB are closed as well if it is reachable.
+        """
+        now = datetime.now()
+        jobs = await self._open_jobs(list(exclude), overdue_before)
+        for doc in jobs:
+            await local_store.update(JOBS_COLLECTION, doc["_id"],
+                                     {"status": "failed", "finished_at": now, "reason": reason})
+        watering_ids = [doc["watering_id"] for doc in jobs if doc.get("watering_id")]
+        closed = len(jobs)
+        if overdue_before is None and self.db is not None:
+            try:
+                count, remote_watering_ids = await self._close_remote_jobs(reason, now)
+                closed += count
+                watering_ids += remote_watering_ids
+            except Exception as e:
+                logger.warning(f"Open jobs in MongoDB not checked: {e}")
+        if not closed:
+            return 0
+
+        failed = {"completed": True, "success": False, "completed_at": now.isoformat()}
+        remote_ids = []
+        for watering_id in watering_ids:
+            # Records still in the local store are closed there (they may not be in MongoDB yet)
+            record = await local_store.get("arrosages", watering_id)
+            if record is None:
+                remote_ids.append(ObjectId(watering_id))
+            elif not record.get("completed"):
+                await local_store.update("arrosages", watering_id, failed)
+        if remote_ids and self.db is not None:
+            try:
+                await self.db.arrosages.update_many(
+                    {"_id": {"$in": remote_ids}, "completed": False},
+                    {"$set": failed}
+                )
+            except Exception as e:
+                logger.error(f"Failed to close watering records of interrupted jobs: {e}")
+        return closed
+
+
+# Create a single instance of the journal
+job_journal = JobJournal()
@@ -0,0 +1,435 @@
+"""
+Local SQLite store: the garden keeps working when Atlas is out of reach.
+
+MongoDB Atlas stays the system of record, but the hot paths no longer wait
+on it:
+
+- `semis` and `users` are mirrored locally (pulled by the replicator and
+  refreshed by the routes that write them to Atlas), so watering, plant reads
+  and authentication are answered from the local file;
+- watering records (`arrosages`), the watering fields of `semis`, the
+  journal of watering jobs and sensor readings are written locally first and
+  queued in an outbox that the replicator pushes to Atlas in batches.
+
+Outbox entries are idempotent (inserts with their final _id, $set of absolute
+values, deletions by filter, readings guarded by their timestamp) so a batch
+can be retried whenever its outcome is unknown.
+
+The file runs in WAL mode and is only used from the single thread of the
+storage executor: reads are never blocked by a write and the connection is
+never shared between threads.
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from bson import json_util
+from dotenv import load_dotenv
+
+from executors import storage_executor
+
+load_dotenv()
+
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "data/local_store.db")
+
+# Collections kept in full locally and refreshed from Atlas
+MIRRORED_COLLECTIONS = ("semis", "users")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    doc_id TEXT,
+    op TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_doc ON outbox (collection, doc_id);
+"""
+
+
+def _dumps(value) -> str:
+    return json_util.dumps(value)
+
+
+def _loads(body: str):
+    return json_util.loads(body)
+
+
+class LocalStore:
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # Set whenever something is queued for Atlas
+        self.changed = asyncio.Event()
+
+    async def _call(self, fn, *args):
+        return await storage_executor.run(fn, *args)
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # Lifecycle
+
+    def _open(self) -> int:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+        return self._pending()
+
+    async def open(self) -> int:
+        """Open (or create) the file; returns the number of changes still to push"""
+        pending = await self._call(self._open)
+        if pending:
+            self.changed.set()
+        return pending
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        await self._call(self._close)
+
+    # Documents
+
+    def _get(self, collection: str, doc_id: str) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT body FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    def _get_many(self, collection: str, doc_ids: List[str]) -> Dict[str, dict]:
+        if not doc_ids:
+            return {}
+        rows = self._conn.execute(
+            f"SELECT id, body FROM documents WHERE collection = ? AND id IN ({', '.join('?' * len(doc_ids))})",
+            (collection, *doc_ids)
+        )
+        return {row[0]: _loads(row[1]) for row in rows}
+
+    def _find(self, collection: str, field: Optional[str], value) -> List[dict]:
+        if field is None:
+            rows = self._conn.execute("SELECT body FROM documents WHERE collection = ?", (collection,))
+        else:
+            rows = self._conn.execute(
+                "SELECT body FROM documents WHERE collection = ? AND json_extract(body, ?) = ?",
+                (collection, f"$.{field}", value)
+            )
+        return [_loads(row[0]) for row in rows]
+
+    def _write(self, collection: str, doc: dict):
+        self._conn.execute(
+            "INSERT INTO documents (collection, id, body, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (collection, id) DO UPDATE SET body = excluded.body, updated_at = excluded.updated_at",
+            (collection, str(doc["_id"]), _dumps(doc), time.time())
+        )
+
+    def _enqueue(self, collection: str, doc_id: Optional[str], op: str, body):
+        self._conn.execute(
+            "INSERT INTO outbox (collection, doc_id, op, body, created_at) VALUES (?, ?, ?, ?, ?)",
+            (collection, doc_id, op, _dumps(body), time.time())
+        )
+
+    def _insert(self, collection: str, docs: List[dict]):
+        with self._transaction():
+            for doc in docs:
+                self._write(collection, doc)
+                self._enqueue(collection, str(doc["_id"]), "insert", doc)
+
+    def _update(self, collection: str, doc_id: str, set_fields: dict, inc_fields: dict) -> Optional[dict]:
+        with self._transaction():
+            doc = self._get(collection, doc_id)
+            if doc is None:
+                return None
+            # Increments are queued as the resulting values, so a replay is harmless
+            changes = dict(set_fields)
+            for key, increment in inc_fields.items():
+                changes[key] = doc.get(key, 0) + increment
+            doc.update(changes)
+            self._write(collection, doc)
+            self._enqueue(collection, doc_id, "set", changes)
+            return doc
+
+    def _set_many(self, collection: str, doc_ids: List[str], set_fields: dict) -> List[str]:
+        with self._transaction():
+            docs = self._get_many(collection, doc_ids)
+            for doc_id, doc in docs.items():
+                doc.update(set_fields)
+                self._write(collection, doc)
+                self._enqueue(collection, doc_id, "set", set_fields)
+        return [doc_id for doc_id in doc_ids if doc_id not in docs]
+
+    def _patch(self, collection: str, doc_id: str, fields: dict) -> Optional[dict]:
+        with self._transaction():
+            doc = self._get(collection, doc_id)
+            if doc is None:
+                return None
+            doc.update(fields)
+            self._write(collection, doc)
+            return doc
+
+    def _put(self, collection: str, docs: List[dict]):
+        with self._transaction():
+            for doc in docs:
+                self._write(collection, doc)
+
+    def _mirror(self, collection: str, docs: List[dict], started: float) -> int:
+        """Replace the local copy by the Atlas one read at `started`
+
+        Documents with unpushed changes, or written locally since `started`,
+        keep their local copy. Returns the number of local documents that
+        changed.
+        """
+        with self._transaction():
+            pending = {row[0] for row in self._conn.execute(
+                "SELECT DISTINCT doc_id FROM outbox WHERE collection = ?", (collection,)
+            )}
+            pending.update(row[0] for row in self._conn.execute(
+                "SELECT id FROM documents WHERE collection = ? AND updated_at >= ?", (collection, started)
+            ))
+            local_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM documents WHERE collection = ?", (collection,)
+            )]
+            remote_ids = {str(doc["_id"]) for doc in docs}
+            changed = 0
+            for doc_id in local_ids:
+                if doc_id not in remote_ids and doc_id not in pending:
+                    self._conn.execute("DELETE FROM documents WHERE collection = ? AND id = ?", (collection, doc_id))
+                    changed += 1
+            for doc in docs:
+                doc_id = str(doc["_id"])
+                if doc_id not in pending and self._get(collection, doc_id) != doc:
+                    self._write(collection, doc)
+                    changed += 1
+        return changed
+
+    def _drop(self, collection: str, doc_id: str):
+        self._conn.execute("DELETE FROM documents WHERE collection = ? AND id = ?", (collection, doc_id))
+        self._conn.execute("DELETE FROM outbox WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+
+    def _matching_ids(self, collection: str, field: str, value) -> List[str]:
+        if field == "_id":
+            return [str(value)] if self._get(collection, str(value)) is not None else []
+        return [str(doc["_id"]) for doc in self._find(collection, field, value)]
+
+    def _remove(self, collection: str, field: str, value) -> int:
+        """Drop matching documents and their unpushed changes (removed from Atlas by the caller)"""
+        with self._transaction():
+            ids = self._matching_ids(collection, field, value)
+            for doc_id in ids:
+                self._drop(collection, doc_id)
+        return len(ids)
+
+    def _delete(self, collection: str, field: str, value) -> int:
+        """Drop matching documents and their unpushed changes, and queue the deletion"""
+        with self._transaction():
+            ids = self._matching_ids(collection, field, value)
+            for doc_id in ids:
+                self._drop(collection, doc_id)
+            # Keyed by document when deleting one, so a pull does not bring it back before the push
+            self._enqueue(collection, str(value) if field == "_id" else None, "delete", {field: value})
+        return len(ids)
+
+    def _forget(self, collection: str, doc_id: str):
+        """Drop a document deleted in Atlas, with its unpushed changes"""
+        with self._transaction():
+            self._drop(collection, doc_id)
+
+    def _purge(self, collection: str, before: float) -> int:
+        """Drop pushed documents not written since `before`"""
+        cursor = self._conn.execute(
+            "DELETE FROM documents WHERE collection = ? AND updated_at < ? "
+            "AND id NOT IN (SELECT doc_id FROM outbox WHERE collection = ? AND doc_id IS NOT NULL)",
+            (collection, before, collection)
+        )
+        return cursor.rowcount
+
+    async def get(self, collection: str, doc_id: str) -> Optional[dict]:
+        return await self._call(self._get, collection, doc_id)
+
+    async def get_many(self, collection: str, doc_ids: Iterable[str]) -> Dict[str, dict]:
+        """Local documents among `doc_ids`, by id"""
+        return await self._call(self._get_many, collection, list(doc_ids))
+
+    async def find(self, collection: str, field: Optional[str] = None, value=None) -> List[dict]:
+        """Local documents of a collection, optionally where `field` == `value`"""
+        return await self._call(self._find, collection, field, value)
+
+    async def insert(self, collection: str, docs: Iterable[dict]):
+        """Store new documents (with their _id) and queue them for Atlas"""
+        await self._call(self._insert, collection, list(docs))
+        self.changed.set()
+
+    async def update(self, collection: str, doc_id: str, set_fields: Optional[dict] = None,
+                     inc_fields: Optional[dict] = None) -> Optional[dict]:
+        """Update a local document and queue the change; None if there is no local copy"""
+        doc = await self._call(self._update, collection, doc_id, set_fields or {}, inc_fields or {})
+        if doc is not None:
+            self.changed.set()
+        return doc
+
+    async def set_many(self, collection: str, doc_ids: Iterable[str], set_fields: dict) -> List[str]:
+        """Set the same fields on several local documents in one transaction and
+        queue the changes; returns the ids without a local copy"""
+        missing = await self._call(self._set_many, collection, list(doc_ids), set_fields)
+        self.changed.set()
+        return missing
+
+    async def patch(self, collection: str, doc_id: str, fields: dict) -> Optional[dict]:
+        """Apply fields already written to Atlas to the local copy, keeping its other
+        (possibly unpushed) fields; None if there is no local copy"""
+        return await self._call(self._patch, collection, doc_id, fields)
+
+    async def put(self, collection: str, docs: Iterable[dict]):
+        """Store documents already written to Atlas"""
+        await self._call(self._put, collection, list(docs))
+
+    async def mirror(self, collection: str, docs: List[dict], started: float) -> int:
+        return await self._call(self._mirror, collection, docs, started)
+
+    async def remove(self, collection: str, field: str, value) -> int:
+        return await self._call(self._remove, collection, field, value)
+
+    async def delete(self, collection: str, field: str, value) -> int:
+        """Delete documents where `field` == `value`, locally and (queued) in Atlas"""
+        count = await self._call(self._delete, collection, field, value)
+        self.changed.set()
+        return count
+
+    async def forget(self, collection: str, doc_id: str):
+        await self._call(self._forget, collection, doc_id)
+
+    async def purge(self, collection: str, before: float) -> int:
+        return await self._call(self._purge, collection, before)
+
+    # Local first, Atlas as a fallback
+
+    async def find_one(self, db, collection: str, field: str, value) -> Optional[dict]:
+        """Local document where `field` == `value`, else the Atlas one (then kept locally)"""
+        if field == "_id":
+            doc = await self.get(collection, str(value))
+        else:
+            docs = await self.find(collection, field, value)
+            doc = docs[0] if docs else None
+        if doc is None:
+            doc = await db[collection].find_one({field: value})
+            if doc is not None:
+                await self.put(collection, [doc])
+        return doc
+
+    async def update_one(self, db, collection: str, doc_id, set_fields: Optional[dict] = None,
+                         inc_fields: Optional[dict] = None):
+        """Update the local copy and queue it; documents only in Atlas are updated there"""
+        doc = await self.update(collection, str(doc_id), set_fields, inc_fields)
+        if doc is None:
+            update = {}
+            if set_fields:
+                update["$set"] = set_fields
+            if inc_fields:
+                update["$inc"] = inc_fields
+            await db[collection].update_one({"_id": doc_id}, update)
+
+    async def find_many(self, db, collection: str, doc_ids: Iterable) -> Dict[str, dict]:
+        """Documents by _id (as a string): local ones, the others from Atlas in one query (then kept locally)"""
+        doc_ids = list(doc_ids)
+        docs = await self.get_many(collection, [str(doc_id) for doc_id in doc_ids])
+        missing = [doc_id for doc_id in doc_ids if str(doc_id) not in docs]
+        if missing:
+            remote = await db[collection].find({"_id": {"$in": missing}}).to_list(length=None)
+            if remote:
+                await self.put(collection, remote)
+            docs.update((str(doc["_id"]), doc) for doc in remote)
+        return docs
+
+    async def update_many(self, db, collection: str, doc_ids: Iterable, set_fields: dict):
+        """Set fields on several documents: local copies in one transaction (queued),
+        documents only in Atlas in one update there"""
+        doc_ids = list(doc_ids)
+        missing = set(await self.set_many(collection, [str(doc_id) for doc_id in doc_ids], set_fields))
+        if missing:
+            await db[collection].update_many(
+                {"_id": {"$in": [doc_id for doc_id in doc_ids if str(doc_id) in missing]}},
+                {"$set": set_fields}
+            )
+
+    # Sensor readings
+
+    def _queue_readings(self, readings: List[dict]):
+        with self._transaction():
+            for reading in readings:
+                self._enqueue("sensor_history", None, "reading", reading)
+
+    async def queue_readings(self, readings: List[dict]):
+        if readings:
+            await self._call(self._queue_readings, readings)
+            self.changed.set()
+
+    # Outbox
+
+    def _batch(self, limit: int) -> List[dict]:
+        rows = self._conn.execute(
+            "SELECT seq, collection, doc_id, op, body FROM outbox ORDER BY seq LIMIT ?", (limit,)
+        )
+        return [
+            {"seq": seq, "collection": collection, "doc_id": doc_id, "op": op, "body": _loads(body)}
+            for seq, collection, doc_id, op, body in rows
+        ]
+
+    def _ack(self, seqs: List[int]):
+        with self._transaction():
+            self._conn.executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def _pending(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _stats(self) -> dict:
+        oldest = self._conn.execute("SELECT MIN(created_at) FROM outbox").fetchone()[0]
+        documents = dict(self._conn.execute(
+            "SELECT collection, COUNT(*) FROM documents GROUP BY collection"
+        ).fetchall())
+        return {
+            "path": self.path,
+            "documents": documents,
+            "pending": self._pending(),
+            "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest is not None else None,
+        }
+
+    async def batch(self, limit: int) -> List[dict]:
+        """Oldest queued changes, in order"""
+        return await self._call(self._batch, limit)
+
+    async def ack(self, seqs: List[int]):
+        if seqs:
+            await self._call(self._ack, seqs)
+
+    async def stats(self) -> dict:
+        return await self._call(self._stats)
+
+
+# Create a single instance of the store
+local_store = LocalStore()
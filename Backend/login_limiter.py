@@ -0,0 +1,109 @@
+"""
+Token-bucket rate limiting of the password endpoints.
+
+Every login attempt takes one token from the bucket of its username and one
+from the bucket of its client IP; registrations only use the IP bucket. The
+check runs before any database lookup or bcrypt work, so a credential
+stuffing burst is answered 429 at the cost of a dictionary lookup.
+
+- per username: LOGIN_USER_BURST attempts, refilled at LOGIN_USER_PER_MINUTE
+  (a successful login refills the bucket)
+- per IP: LOGIN_IP_BURST attempts, refilled at LOGIN_IP_PER_MINUTE
+
+Buckets live in memory; at most LOGIN_LIMITER_SIZE keys per kind are kept,
+the least recently used being dropped first.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOGIN_USER_BURST = float(os.getenv("LOGIN_USER_BURST", "5"))
+LOGIN_USER_PER_MINUTE = float(os.getenv("LOGIN_USER_PER_MINUTE", "2"))
+LOGIN_IP_BURST = float(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "10"))
+LOGIN_LIMITER_SIZE = int(os.getenv("LOGIN_LIMITER_SIZE", "4096"))
+
+
+class TokenBuckets:
+    """Token buckets keyed by string, refilled continuously"""
+
+    def __init__(self, capacity: float, per_minute: float, max_keys: int = LOGIN_LIMITER_SIZE):
+        self.capacity = capacity
+        self.rate = per_minute / 60   # tokens per second
+        self.max_keys = max(1, max_keys)
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()   # key -> [tokens, updated]
+
+    def _bucket(self, key: str, now: float) -> List[float]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.capacity, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def wait(self, key: str, now: float) -> float:
+        """Seconds until `key` has a token (0 if it has one now)"""
+        tokens = self._bucket(key, now)[0]
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, key: str, now: float):
+        self._bucket(key, now)[0] -= 1
+
+    def reset(self, key: str):
+        self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginLimiter:
+    def __init__(self):
+        self.users = TokenBuckets(LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE)
+        self.ips = TokenBuckets(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, username: Optional[str], ip: str) -> float:
+        """Take a token for the attempt; returns 0, or the seconds to wait if refused
+
+        A refused attempt takes nothing, so it does not push the wait further.
+        """
+        now = time.monotonic()
+        wait = self.ips.wait(ip, now)
+        if username is not None:
+            wait = max(wait, self.users.wait(username, now))
+        if wait > 0:
+            self.rejected += 1
+            return wait
+        self.ips.take(ip, now)
+        if username is not None:
+            self.users.take(username, now)
+        self.allowed += 1
+        return 0.0
+
+    def succeeded(self, username: str):
+        self.users.reset(username)
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "tracked_users": len(self.users),
+            "tracked_ips": len(self.ips),
+        }
+
+
+# Create a single instance of the limiter
+login_limiter = LoginLimiter()
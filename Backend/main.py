@@ -1,23 +1,48 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.server_api import ServerApi
+from fastapi.responses import JSONResponse
 import uvicorn
+import logging
 import os
 from dotenv import load_dotenv
 import json
 
 # Import the auth router
 from auth import auth_router
-from protected_routes import protected_router
+from protected_routes import protected_router, stream_router
 from plant import plants_router
+from database import database, get_database
+from indexes import ensure_indexes, ensure_required_indexes, MissingIndexError
+from calibration import calibration_store
+from infos_cache import infos_cache
+from http_cache import http_cache_middleware
+from tokens import token_service
+from local_store import local_store
+from replicator import replicator
+from sensor_sampler import sensor_sampler
+from sensor_history import sensor_history
+from executors import shutdown_executors, hashing_executor
+from password_hasher import password_hasher
+from hardware import close_hardware
+from watering_scheduler import watering_scheduler
+from irrigation_engine import irrigation_engine
 
 # Load environment variables
 load_dotenv()
 
+# Log records of every module (uvicorn keeps its own handlers)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("main")
+
 # Initialize FastAPI app
 app = FastAPI(title="E-Garden Smart Gardening System")
 
+# Conditional GET on the plant read endpoints (registered first so CORS wraps its 304s)
+app.middleware("http")(http_cache_middleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -25,49 +50,112 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# MongoDB configuration
-uri = os.getenv("MONGODB_URL", "").strip()
-db_name = os.getenv("MONGODB_DB", "").strip()
-
-# Global MongoDB client
-mongo_client = AsyncIOMotorClient(uri, server_api=ServerApi('1'))
-
 # Startup event: connect to MongoDB
 @app.on_event("startup")
 async def startup_db_client():
     try:
         # Send a ping to confirm a successful connection
-        await mongo_client.admin.command('ping')
-        print("Pinged your deployment. You successfully connected to MongoDB!")
-        print("Routes disponibles:")
+        latency = await database.ping()
+        logger.info(f"Pinged your deployment. You successfully connected to MongoDB! ({latency:.0f} ms)")
+        # Make sure the hot query paths are indexed
+        for index in await ensure_indexes(database.db):
+            line = f"Index {index['collection']}.{index['name']}: {index['status']}"
+            if index["status"] == "failed":
+                line += f" ({index['error']})"
+            logger.log(logging.ERROR if index["status"] == "failed" else logging.INFO, line)
+        missing = await ensure_required_indexes(database.db)
+        if missing:
+            raise MissingIndexError(
+                f"Required index(es) {', '.join(missing)} could not be built, fix the data and restart"
+            )
+        profiles = await calibration_store.load(database.db)
+        logger.info(f"Loaded {profiles} humidity calibration profile(s)")
+        entries = await infos_cache.start(database.db)
+        logger.info(f"Loaded {entries} plant info entries")
+        revoked = await token_service.load(database.db)
+        logger.info(f"Loaded {revoked} revoked token(s)")
+        logger.info("Routes disponibles:")
         for route in app.routes:
-            print(f"{route.path} - {route.methods}")
+            logger.info(f"{route.path} - {route.methods}")
+    except MissingIndexError:
+        raise
     except Exception as e:
-        print(e)
+        logger.error(f"MongoDB startup failed: {e}")
+
+# Startup event: open the local store and start syncing it with MongoDB
+@app.on_event("startup")
+async def startup_local_store():
+    pending = await local_store.open()
+    replicator.start(database.db)
+    logger.info(f"Local store opened ({local_store.path}, {pending} change(s) to push)")
+
+# Startup event: pick the bcrypt cost before the sensors and valves load the CPU
+@app.on_event("startup")
+async def startup_password_hasher():
+    rounds = await hashing_executor.run(password_hasher.calibrate)
+    estimate = password_hasher.estimate_ms(rounds)
+    timing = f", ~{estimate:.0f} ms per hash" if estimate is not None else ""
+    logger.info(f"Password hashing calibrated (bcrypt cost {rounds}{timing})")
+
+# Startup event: start sensor acquisition
+@app.on_event("startup")
+async def startup_sensor_sampler():
+    sensor_sampler.start()
+    sensor_history.start(database.db)
+    logger.info(f"Sensor sampler started (interval {sensor_sampler.interval}s, history every {sensor_history.interval}s)")
+
+# Shutdown event: stop sensor acquisition
+@app.on_event("shutdown")
+async def shutdown_sensor_sampler():
+    await sensor_history.stop()
+    await sensor_sampler.stop()
+
+# Startup event: claim the GPIO lines for the watering scheduler
+@app.on_event("startup")
+async def startup_watering_scheduler():
+    recovered = await watering_scheduler.start(database.db)
+    backend = watering_scheduler.state()["controller"]["backend"]
+    logger.info(f"Watering scheduler started ({backend} hardware backend, max {watering_scheduler.max_open_valves} open valves)")
+    if recovered:
+        logger.info(f"Closed {recovered} watering job(s) interrupted by the previous shutdown")
+
+# Startup event: evaluate sensor places and water them automatically
+@app.on_event("startup")
+async def startup_irrigation_engine():
+    await irrigation_engine.start(database.db)
+    mode = "enabled" if irrigation_engine.enabled else "disabled"
+    logger.info(f"Irrigation engine started ({mode}, tick {irrigation_engine.tick:g}s)")
+
+# Shutdown event: stop automatic watering before the scheduler goes down
+@app.on_event("shutdown")
+async def shutdown_irrigation_engine():
+    await irrigation_engine.stop()
+
+# Shutdown event: switch every output off and release the GPIO lines
+@app.on_event("shutdown")
+async def shutdown_watering_scheduler():
+    await watering_scheduler.stop()
+    close_hardware()
 
 # Shutdown event: close MongoDB connection
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    global mongo_client
-    if mongo_client:
-        mongo_client.close()
-        print("MongoDB connection closed")
-
-# Dependency to get the database
-async def get_database():
-    if mongo_client is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Database connection not available"
-        )
-    return mongo_client[db_name]
+    await infos_cache.stop()
+    # Push what the shutdown wrote locally, then release the thread pools
+    await replicator.stop()
+    await local_store.close()
+    shutdown_executors()
+    database.close()
+    logger.info("MongoDB connection closed")
 
 # Include the auth router
 app.include_router(auth_router)
 # Include the protected router
 app.include_router(protected_router)
+app.include_router(stream_router)
 # Include the plant router
 app.include_router(plants_router)
 
@@ -76,14 +164,33 @@ app.include_router(plants_router)
 def read_root():
     return {"message": "Welcome to E-Garden Smart Gardening System!"}
 
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 503 as soon as MongoDB does not answer a ping in time,
+    or while a required index is missing (MongoDB was unreachable at startup).
+    The hardware backend in use is reported, so a simulated one is noticed."""
+    hardware = watering_scheduler.state()["controller"]["backend"]
+    if not await database.ready():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable", "mongodb": database.last_error, "hardware": hardware}
+        )
+    missing = await ensure_required_indexes(database.db)
+    if missing:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable", "missing_indexes": missing, "hardware": hardware}
+        )
+    return {"status": "ready", "mongodb_ping_ms": round(database.last_ping_ms, 3), "hardware": hardware}
+
 
 @app.get("/mongodb")
 async def test_mongodb(db=Depends(get_database)):
     try:
         # Test connection by listing collections
         collections = await db.list_collection_names()
-        print(f"Connected to database: {db_name}")
-        print(f"Collections found: {collections}")
+        logger.info(f"Connected to database: {database.name}")
+        logger.info(f"Collections found: {collections}")
         return {
             "status": "success",
             "collections": collections,
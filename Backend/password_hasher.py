@@ -0,0 +1,117 @@
+"""
+bcrypt hashing calibrated to the host.
+
+The bcrypt cost is chosen at startup from a benchmark: the highest cost
+whose hash time fits in PASSWORD_HASH_BUDGET_MS, never below
+PASSWORD_MIN_ROUNDS. A login on a Raspberry Pi then costs a known amount of
+CPU instead of whatever the library default happens to cost there.
+
+Hashes made with another cost (or another scheme) still verify, and are
+replaced by a hash with the current parameters on the next successful
+login (passlib's verify_and_update).
+
+All methods are blocking: callers run them in the hashing executor.
+"""
+
+import logging
+import os
+import statistics
+import threading
+import time
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+load_dotenv()
+
+logger = logging.getLogger("password_hasher")
+
+# Target time of one hash or verification (milliseconds)
+PASSWORD_HASH_BUDGET_MS = float(os.getenv("PASSWORD_HASH_BUDGET_MS", "250"))
+PASSWORD_MIN_ROUNDS = int(os.getenv("PASSWORD_MIN_ROUNDS", "10"))
+PASSWORD_MAX_ROUNDS = int(os.getenv("PASSWORD_MAX_ROUNDS", "14"))
+# Fixed cost, skips the benchmark
+PASSWORD_HASH_ROUNDS = os.getenv("PASSWORD_HASH_ROUNDS")
+
+# Cost measured by the benchmark (each extra round doubles the time)
+BENCHMARK_ROUNDS = 8
+BENCHMARK_SAMPLES = 3
+
+
+class PasswordHasher:
+    def __init__(self, budget_ms: float = PASSWORD_HASH_BUDGET_MS,
+                 min_rounds: int = PASSWORD_MIN_ROUNDS, max_rounds: int = PASSWORD_MAX_ROUNDS):
+        self.budget_ms = budget_ms
+        self.min_rounds = min_rounds
+        self.max_rounds = max(min_rounds, max_rounds)
+        self.rounds: Optional[int] = None
+        self.benchmark_ms: Optional[float] = None
+        # Until calibrated: passlib defaults, no hash is considered outdated
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._lock = threading.Lock()
+        self.rehashed = 0
+
+    def _benchmark(self) -> float:
+        """Median time of one hash at BENCHMARK_ROUNDS (milliseconds)"""
+        context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=BENCHMARK_ROUNDS)
+        samples = []
+        for _ in range(BENCHMARK_SAMPLES):
+            started = time.perf_counter()
+            context.hash("calibration")
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
+
+    def estimate_ms(self, rounds: int) -> Optional[float]:
+        if self.benchmark_ms is None:
+            return None
+        return self.benchmark_ms * 2 ** (rounds - BENCHMARK_ROUNDS)
+
+    def calibrate(self) -> int:
+        """Pick the bcrypt cost and switch to it; returns the cost"""
+        if PASSWORD_HASH_ROUNDS:
+            rounds = int(PASSWORD_HASH_ROUNDS)
+        else:
+            self.benchmark_ms = self._benchmark()
+            rounds = self.min_rounds
+            while rounds < self.max_rounds and self.estimate_ms(rounds + 1) <= self.budget_ms:
+                rounds += 1
+            if self.estimate_ms(rounds) > self.budget_ms:
+                logger.warning(
+                    f"bcrypt cost {rounds} takes ~{self.estimate_ms(rounds):.0f} ms, "
+                    f"over the {self.budget_ms:g} ms budget"
+                )
+        # min = max = default: any other cost is rehashed on login
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        self.rounds = rounds
+        return rounds
+
+    def hash(self, password: str) -> str:
+        return self.context.hash(password)
+
+    def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(valid, new hash if the stored one uses outdated parameters)"""
+        valid, new_hash = self.context.verify_and_update(password, hashed_password)
+        if new_hash is not None:
+            with self._lock:
+                self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "budget_ms": self.budget_ms,
+            "benchmark_ms": round(self.benchmark_ms, 3) if self.benchmark_ms is not None else None,
+            "estimated_ms": round(self.estimate_ms(self.rounds), 3) if self.rounds and self.benchmark_ms else None,
+            "rehashed": self.rehashed,
+        }
+
+
+# Create a single instance of the hasher
+password_hasher = PasswordHasher()
@@ -1,14 +1,28 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+import asyncio
+import base64
+import json
+import logging
 from auth import get_current_active_user, User
+from database import get_database
+from local_store import local_store
+from watering_scheduler import watering_scheduler, MAX_JOB_DURATION
+from flow_meter import flow_meter
+from infos_cache import infos_cache
+from http_cache import revisions
+from event_hub import event_hub
+from irrigation_engine import irrigation_engine, DECISIONS_COLLECTION
+from sensor_sampler import sensor_sampler
+from replicator import replicator
 
-import subprocess
-import os
-from pathlib import Path
+logger = logging.getLogger("plant")
 
 # Create a router with the /api prefix
 plants_router = APIRouter(prefix="/plant", tags=["plants"])
@@ -31,11 +45,58 @@ GPIO_MAPPING = {
     12: 16
 }
 
-# Model for immediate watering
+# Model for immediate watering: a duration, or a volume (dosing mode)
 class ImmediateWateringRequest(BaseModel):
     plantId: str
     position: int = Field(..., ge=1, le=12)
-    duration: int = Field(..., gt=0, le=60)
+    duration: Optional[int] = Field(None, gt=0, le=60, description="Duration in minutes")
+    amount: Optional[int] = Field(None, gt=0, le=1000, description="Volume in milliliters")
+
+    @model_validator(mode="after")
+    def check_duration_or_amount(self):
+        if (self.duration is None) == (self.amount is None):
+            raise ValueError("Give either a duration or an amount")
+        return self
+
+def _watering_plan(request: ImmediateWateringRequest) -> dict:
+    """Record fields and scheduler arguments of an immediate watering
+
+    Raises 422 before anything is written when the watering would last
+    longer than one job may (MAX_JOB_DURATION).
+    """
+    if request.amount is not None:
+        if request.amount > watering_scheduler.max_volume(request.position):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=(f"At most {watering_scheduler.max_volume(request.position):.0f} ml can be delivered "
+                        f"at position {request.position} in one watering")
+            )
+        # Dosing: metered on lines with a flow sensor, timed at the learned rate elsewhere
+        return {
+            "duration": round(flow_meter.timed_duration(request.position, request.amount) / 60, 2),
+            "amount": request.amount,
+            "target_ml": request.amount,
+            "seconds": None,
+        }
+    if request.duration * 60 > MAX_JOB_DURATION:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A watering cannot last more than {MAX_JOB_DURATION / 60:g} minutes"
+        )
+    return {
+        "duration": request.duration,
+        "amount": round(request.duration * 60 * flow_meter.rate(request.position)),  # Estimate from the learned flow
+        "target_ml": None,
+        "seconds": request.duration * 60,  # minutes -> seconds
+    }
+
+# Model for extending a running or queued watering
+class WateringExtension(BaseModel):
+    minutes: float = Field(..., gt=0, le=60, description="Minutes to add")
+
+# Model for watering several plants in one pump cycle
+class BatchWateringRequest(BaseModel):
+    items: List[ImmediateWateringRequest] = Field(..., min_length=1, max_length=12)
 
 class SemisBase(BaseModel):
     nom: str = Field(..., min_length=1, max_length=50, description="Name of the plant")
@@ -70,10 +131,70 @@ class WateringResponse(WateringBase):
     id: str
     created_at: Optional[str] = None
 
-# Helper function to get database
-async def get_database():
-    from main import mongo_client, db_name
-    return mongo_client[db_name]
+# Watering history pagination
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Waterings returned per plant by the dashboard
+DASHBOARD_WATERINGS = 5
+
+# Fields of an arrosages record returned by the history endpoint
+HISTORY_PROJECTION = {
+    "plantId": 1,
+    "dateTime": 1,
+    "duration": 1,
+    "amount": 1,
+    "automated": 1,
+    "completed": 1,
+    "success": 1,
+    "completed_at": 1,
+    "target_ml": 1,
+    "measured_ml": 1,
+    "flow_rate": 1,
+    "mode": 1
+}
+
+def encode_history_cursor(date_time: str, record_id: ObjectId) -> str:
+    """Opaque cursor pointing after the given (dateTime, _id) pair"""
+    raw = json.dumps([date_time, str(record_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_time, record_id = json.loads(raw)
+        return str(date_time), ObjectId(record_id)
+    except Exception as e:
+        raise ValueError(str(e))
+
+def _history_key(record: dict):
+    return record["dateTime"], record["_id"]
+
+def _history_fields(record: dict) -> dict:
+    return {key: record[key] for key in ("_id", *HISTORY_PROJECTION) if key in record}
+
+async def _merged_history(db, query: dict, local_records: List[dict], limit: int) -> List[dict]:
+    """Newest `limit` watering records from MongoDB and the local store
+
+    The local store holds the records not pushed yet and the latest state of
+    the recent ones, so its copy wins. MongoDB is skipped while the replicator
+    knows it is unreachable: the local records are served alone.
+    """
+    records = {}
+    if replicator.online is not False:
+        try:
+            cursor = (
+                db.arrosages.find(query, HISTORY_PROJECTION)
+                .sort([("dateTime", -1), ("_id", -1)])
+                .limit(limit)
+            )
+            for record in await cursor.to_list(length=limit):
+                records[record["_id"]] = record
+        except PyMongoError as e:
+            logger.warning(f"Watering history served from the local store only: {e}")
+    for record in local_records:
+        records[record["_id"]] = _history_fields(record)
+    return sorted(records.values(), key=_history_key, reverse=True)[:limit]
 
 # Routes
 @plants_router.get("/semis")
@@ -82,17 +203,81 @@ async def get_all_plants(
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Get all plants from the semis collection"""
-    # Fetch all plants
-    plants = []
-    cursor = db.semis.find().sort("place", 1)
+    # Served from the local copy, MongoDB only answers before the first sync
+    plants = await local_store.find("semis")
+    if not plants:
+        plants = await db.semis.find().to_list(length=None)
+    plants.sort(key=lambda plant: plant.get("place", 0))
     
-    async for plant in cursor:
+    for plant in plants:
         # Convert MongoDB _id to string
         plant["_id"] = str(plant["_id"])
-        plants.append(plant)
     
     return plants
 
+def _sensor_for_place(snapshot, place: int) -> Optional[dict]:
+    """Latest sampled reading of the probe at `place`, if it has one"""
+    if snapshot is None:
+        return None
+    reading = snapshot.humidity.get(place)
+    if reading is None:
+        return None
+    age = snapshot.age()
+    return {**reading, "age_seconds": round(age, 1), "stale": age > sensor_sampler.stale_after}
+
+@plants_router.get("/dashboard")
+async def get_dashboard(
+    waterings: int = Query(DASHBOARD_WATERINGS, ge=0, le=HISTORY_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Every plant with its infos entry, sensor reading, last waterings and pending jobs"""
+    # Plants from the local copy, MongoDB only answers before the first sync
+    semis = await local_store.find("semis")
+    if not semis:
+        semis = await db.semis.find().to_list(length=None)
+    semis.sort(key=lambda plant: plant.get("place", 0))
+
+    # Recent waterings: local records (unpushed ones included) merged over
+    # MongoDB's, one indexed query per plant on plantId_dateTime_id
+    local_waterings = {}
+    if waterings:
+        for record in await local_store.find("arrosages"):
+            local_waterings.setdefault(record.get("plantId"), []).append(record)
+        histories = await asyncio.gather(*(
+            _merged_history(
+                db, {"plantId": str(plant["_id"])},
+                local_waterings.get(str(plant["_id"]), []), waterings
+            )
+            for plant in semis
+        ))
+    else:
+        histories = [[] for _ in semis]
+
+    # Pending jobs grouped by plant, taken from the scheduler in memory
+    jobs = {}
+    scheduler_state = watering_scheduler.state()
+    for job in scheduler_state["running"] + scheduler_state["queued"]:
+        jobs.setdefault(job["plantId"], []).append(job)
+
+    snapshot = sensor_sampler.snapshot
+    plants = []
+    for plant, history in zip(semis, histories):
+        plant_id = str(plant["_id"])
+        plant["_id"] = plant_id
+        # Same in-memory catalog as /infos
+        plant["info"] = infos_cache.get(plant.get("nom") or "")
+        plant["waterings"] = [{**record, "_id": str(record["_id"])} for record in history]
+        plant["sensor"] = _sensor_for_place(snapshot, plant.get("place"))
+        plant["jobs"] = jobs.get(plant_id, [])
+        plants.append(plant)
+
+    return {
+        "plants": plants,
+        "temperature": dict(snapshot.temperature) if snapshot else None,
+        "taken_at": snapshot.taken_at.isoformat() if snapshot else None,
+    }
+
 @plants_router.get("/semis/{plant_id}")
 async def get_plant_by_id(
     plant_id: str,
@@ -109,7 +294,7 @@ async def get_plant_by_id(
         )
     
     # Fetch the plant
-    plant = await db.semis.find_one({"_id": plant_obj_id})
+    plant = await local_store.find_one(db, "semis", "_id", plant_obj_id)
     
     if not plant:
         raise HTTPException(
@@ -129,14 +314,6 @@ async def create_semis(
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """Create a new semis entry"""
-    # Check if the position is already taken
-    existing_place = await db.semis.find_one({"place": semis.place})
-    if existing_place:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Position {semis.place} is already occupied by another plant"
-        )
-    
     # Prepare the semis record
     semis_data = semis.dict()
     semis_data["created_at"] = datetime.now().isoformat()
@@ -146,12 +323,21 @@ async def create_semis(
     import random
     semis_data["txHumidMesure"] = random.randint(40, 60)
     
-    # Insert the record
-    result = await db.semis.insert_one(semis_data)
+    # Insert the record: the unique index on place allocates the slot atomically
+    try:
+        await db.semis.insert_one(semis_data)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Position {semis.place} is already occupied by another plant"
+        )
+    revisions.bump("semis")
     
-    # Return the created semis with its ID
-    created_semis = await db.semis.find_one({"_id": result.inserted_id})
+    # Return the created semis with its ID (insert_one added it to the record)
+    created_semis = semis_data
+    await local_store.put("semis", [created_semis])
     created_semis["_id"] = str(created_semis["_id"])
+    event_hub.publish("semis", {"action": "created", "semis": created_semis})
     
     return created_semis
 
@@ -171,26 +357,6 @@ async def update_semis(
             detail="Invalid ID format"
         )
     
-    # Verify semis exists
-    existing_semis = await db.semis.find_one({"_id": semis_obj_id})
-    if not existing_semis:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Semis with ID {semis_id} not found"
-        )
-    
-    # Check if trying to update to a place that's already taken by another semis
-    if semis_update.place is not None and semis_update.place != existing_semis.get("place"):
-        place_taken = await db.semis.find_one({
-            "place": semis_update.place,
-            "_id": {"$ne": semis_obj_id}
-        })
-        if place_taken:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Position {semis_update.place} is already occupied by another plant"
-            )
-    
     # Prepare the update data (only include fields that are provided)
     update_data = {}
     for key, value in semis_update.dict(exclude_unset=True).items():
@@ -201,15 +367,37 @@ async def update_semis(
     update_data["updated_at"] = datetime.now().isoformat()
     update_data["updated_by"] = current_user.username
     
-    # Update the semis
-    await db.semis.update_one(
-        {"_id": semis_obj_id},
-        {"$set": update_data}
-    )
+    # Update the semis and read it back in one round trip; a place already
+    # taken by another plant is rejected by the unique index on place
+    try:
+        updated_semis = await db.semis.find_one_and_update(
+            {"_id": semis_obj_id},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Position {semis_update.place} is already occupied by another plant"
+        )
+    if not updated_semis:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Semis with ID {semis_id} not found"
+        )
+    revisions.bump("semis")
+    
+    # Only the fields set here go into the local copy: it may hold a newer
+    # watering (dernier_arrosage, txHumidMesure) not pushed to MongoDB yet
+    local_semis = await local_store.patch("semis", semis_id, update_data)
+    if local_semis is not None:
+        updated_semis = local_semis
+    else:
+        await local_store.put("semis", [updated_semis])
     
     # Return the updated semis
-    updated_semis = await db.semis.find_one({"_id": semis_obj_id})
     updated_semis["_id"] = str(updated_semis["_id"])
+    event_hub.publish("semis", {"action": "updated", "semis": updated_semis})
     
     return updated_semis
 
@@ -229,18 +417,19 @@ async def delete_semis(
         )
     
     # Verify semis exists
-    existing_semis = await db.semis.find_one({"_id": semis_obj_id})
+    existing_semis = await local_store.find_one(db, "semis", "_id", semis_obj_id)
     if not existing_semis:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Semis with ID {semis_id} not found"
         )
     
-    # Delete any associated watering records
-    await db.arrosages.delete_many({"plantId": semis_id})
-    
-    # Delete the semis
-    await db.semis.delete_one({"_id": semis_obj_id})
+    # Delete the semis and its watering records locally; the deletions are
+    # queued and the replicator applies them to MongoDB
+    await local_store.delete("arrosages", "plantId", semis_id)
+    await local_store.delete("semis", "_id", semis_obj_id)
+    revisions.bump("semis", "arrosages")
+    event_hub.publish("semis", {"action": "deleted", "semis": {"_id": semis_id}})
     
     # No content returned for successful deletion
     return None
@@ -248,19 +437,13 @@ async def delete_semis(
 @plants_router.get("/infos/{plant_type}")
 async def get_plant_info(
     plant_type: str,
-    current_user: User = Depends(get_current_active_user),
-    db: AsyncIOMotorDatabase = Depends(get_database)
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user)
 ):
     """Get detailed information about a specific plant type from the infos collection"""
-    # Fetch the plant info
-    plant_info = await db.infos.find_one({"name": plant_type})
-    
-    if not plant_info:
-        # Try case-insensitive search
-        cursor = db.infos.find({"name": {"$regex": f"^{plant_type}$", "$options": "i"}})
-        async for doc in cursor:
-            plant_info = doc
-            break
+    # Served from the in-memory catalog (case and accent insensitive, prefix fallback)
+    plant_info = infos_cache.get(plant_type)
     
     if not plant_info:
         raise HTTPException(
@@ -268,18 +451,31 @@ async def get_plant_info(
             detail=f"Plant info for '{plant_type}' not found"
         )
     
-    # Convert MongoDB _id to string
-    plant_info["_id"] = str(plant_info["_id"])
+    etag = infos_cache.etag(plant_type)
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     
     return plant_info
 
 @plants_router.get("/arrosages/{semis_id}")
 async def get_watering_history(
     semis_id: str,
+    response: Response,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    automated: Optional[bool] = None,
+    success: Optional[bool] = None,
     current_user: User = Depends(get_current_active_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Get watering history for a specific plant"""
+    """Get watering history for a specific plant, newest first
+
+    Results are paginated on (dateTime, _id): when more records exist the
+    cursor of the next page is returned in the X-Next-Cursor header.
+    """
     try:
         ObjectId(semis_id)  # Validate ID format
     except:
@@ -288,14 +484,64 @@ async def get_watering_history(
             detail="Invalid semis ID format"
         )
     
-    # Fetch watering records - CHANGE IS HERE - query by plantId instead of semis_id
-    watering_records = []
-    cursor = db.arrosages.find({"plantId": semis_id}).sort("dateTime", -1)
-    
-    async for record in cursor:
+    # Filters are evaluated by MongoDB, on the plantId/dateTime index
+    query = {"plantId": semis_id}
+    date_range = {}
+    if start is not None:
+        date_range["$gte"] = start.isoformat()
+    if end is not None:
+        date_range["$lt"] = end.isoformat()
+    if date_range:
+        query["dateTime"] = date_range
+    if automated is not None:
+        query["automated"] = True if automated else {"$ne": True}
+    if success is not None:
+        query["success"] = success
+    last = None
+    if after:
+        try:
+            last = decode_history_cursor(after)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        last_date, last_id = last
+        query = {"$and": [query, {"$or": [
+            {"dateTime": {"$lt": last_date}},
+            {"dateTime": last_date, "_id": {"$lt": last_id}}
+        ]}]}
+    
+    # ... and by hand on the local records of the plant
+    def matches(record: dict) -> bool:
+        date_time = record.get("dateTime")
+        if date_time is None:
+            return False
+        if start is not None and date_time < start.isoformat():
+            return False
+        if end is not None and date_time >= end.isoformat():
+            return False
+        if automated is not None and (record.get("automated") is True) != automated:
+            return False
+        if success is not None and record.get("success") != success:
+            return False
+        return last is None or _history_key(record) < last
+    local_records = [
+        record for record in await local_store.find("arrosages", "plantId", semis_id)
+        if matches(record)
+    ]
+    
+    # Fetch one extra record to know whether another page exists
+    watering_records = await _merged_history(db, query, local_records, limit + 1)
+    
+    if len(watering_records) > limit:
+        watering_records = watering_records[:limit]
+        last = watering_records[-1]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(last["dateTime"], last["_id"])
+    
+    for record in watering_records:
         # Convert MongoDB _id to string
         record["_id"] = str(record["_id"])
-        watering_records.append(record)
     
     return watering_records
 
@@ -316,7 +562,7 @@ async def water_plant(
         )
     
     # Verify plant exists
-    plant = await db.semis.find_one({"_id": plant_obj_id})
+    plant = await local_store.find_one(db, "semis", "_id", plant_obj_id)
     if not plant:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -325,40 +571,53 @@ async def water_plant(
     
     # Prepare the watering record
     watering_record = watering.dict()
+    watering_record["_id"] = ObjectId()
     watering_record["created_at"] = datetime.now().isoformat()
     watering_record["created_by"] = current_user.username
     
-    # Insert the record
-    result = await db.arrosages.insert_one(watering_record)
+    # Insert the record (locally, pushed to MongoDB by the replicator)
+    await local_store.insert("arrosages", [watering_record])
     
     # Update plant's last watering info and humidity level
-    # Simulate humidity increasing after watering - adjust based on duration
     current_humidity = plant.get("txHumidMesure", 0)
-    
-    # More duration = more humidity increase, but with diminishing returns
-    base_increase = 15  # Base increase for short watering
-    max_increase = 30   # Maximum increase for long watering
-    
-    # Calculate humidity increase based on duration with diminishing returns
-    duration_factor = min(1.0, watering.duration / 30)  # Caps at 1.0 for durations >= 30 minutes
-    humidity_increase = min(base_increase + (max_increase - base_increase) * duration_factor, 
-                           100 - current_humidity)  # Ensure it doesn't exceed 100%
-    
-    await db.semis.update_one(
-        {"_id": plant_obj_id},
-        {
-            "$set": {
-                "dernier_arrosage": watering.dateTime,
-                "txHumidMesure": current_humidity + humidity_increase
-            }
-        }
-    )
+    measured = None
+    snapshot = sensor_sampler.snapshot
+    if snapshot is not None and snapshot.age() <= sensor_sampler.stale_after:
+        reading = snapshot.humidity.get(plant.get("place"))
+        if reading and reading.get("status") == "success":
+            measured = reading.get("humidity")
+
+    if measured is not None:
+        # Sensor-equipped place: keep the measured value, the irrigation engine refreshes it
+        new_humidity = round(measured)
+    else:
+        # Simulate humidity increasing after watering - adjust based on duration
+        # More duration = more humidity increase, but with diminishing returns
+        base_increase = 15  # Base increase for short watering
+        max_increase = 30   # Maximum increase for long watering
+
+        # Calculate humidity increase based on duration with diminishing returns
+        duration_factor = min(1.0, watering.duration / 30)  # Caps at 1.0 for durations >= 30 minutes
+        humidity_increase = min(base_increase + (max_increase - base_increase) * duration_factor, 
+                               100 - current_humidity)  # Ensure it doesn't exceed 100%
+        new_humidity = current_humidity + humidity_increase
+    
+    await local_store.update_one(db, "semis", plant_obj_id, {
+        "dernier_arrosage": watering.dateTime,
+        "txHumidMesure": new_humidity
+    })
+    revisions.bump("semis", "arrosages")
+    event_hub.publish("semis", {"action": "updated", "semis": {
+        "_id": watering.plantId,
+        "dernier_arrosage": watering.dateTime,
+        "txHumidMesure": new_humidity
+    }})
     
     # Return success
     return {
         "status": "success",
         "message": "Arrosage enregistré avec succès",
-        "id": str(result.inserted_id)
+        "id": str(watering_record["_id"])
     }
 
 @plants_router.post("/watering/now", status_code=status.HTTP_200_OK)
@@ -371,7 +630,7 @@ async def trigger_immediate_watering(
     try:
         # Verify plant exists
         plant_obj_id = ObjectId(request.plantId)
-        plant = await db.semis.find_one({"_id": plant_obj_id})
+        plant = await local_store.find_one(db, "semis", "_id", plant_obj_id)
         
         if not plant:
             raise HTTPException(
@@ -387,57 +646,63 @@ async def trigger_immediate_watering(
             )
         
         # Record watering in database first
+        plan = _watering_plan(request)
         watering_record = {
+            "_id": ObjectId(),
             "plantId": request.plantId,
             "dateTime": datetime.now().isoformat(),
-            "duration": request.duration,
-            "amount": request.duration * 40,  # Estimate 40ml per minute
+            "duration": plan["duration"],
+            "amount": plan["amount"],
+            "target_ml": plan["target_ml"],
             "created_at": datetime.now().isoformat(),
             "created_by": current_user.username,
             "automated": False,
-            "completed": False  # Will be updated by script callback
+            "completed": False  # Will be updated by the watering scheduler
         }
         
-        result = await db.arrosages.insert_one(watering_record)
-        watering_id = str(result.inserted_id)
+        await local_store.insert("arrosages", [watering_record])
+        watering_id = str(watering_record["_id"])
         
         # Update plant's last watering timestamp
-        await db.semis.update_one(
-            {"_id": plant_obj_id},
-            {"$set": {"dernier_arrosage": datetime.now().isoformat()}}
-        )
-        
-        # Path to watering script
-        script_path = Path(__file__).parent / "scripts" / "water_plant.py"
-        
-        if not script_path.exists():
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Watering script not found"
-            )
+        dernier_arrosage = datetime.now().isoformat()
+        await local_store.update_one(db, "semis", plant_obj_id, {"dernier_arrosage": dernier_arrosage})
+        revisions.bump("semis", "arrosages")
+        event_hub.publish("semis", {"action": "updated", "semis": {
+            "_id": request.plantId,
+            "dernier_arrosage": dernier_arrosage
+        }})
         
-        # Execute the watering script with position directly (not GPIO pin)
+        # Hand the job to the watering scheduler (non-blocking)
         try:
-            # Non-blocking execution with watering_id
-            process = subprocess.Popen([
-                "sudo", "python3", 
-                str(script_path), 
-                str(request.position),  # Pass position directly, not GPIO pin
-                str(request.duration),
-                watering_id
-            ])
-            
-            return {
-                "status": "success",
-                "message": f"Watering triggered at position {request.position} for {request.duration} minutes",
-                "watering_id": watering_id
-            }
-            
-        except Exception as e:
+            job = await watering_scheduler.submit(
+                request.position,
+                plan["seconds"],
+                watering_id=watering_id,
+                plant_id=request.plantId,
+                target_ml=plan["target_ml"]
+            )
+        except (ValueError, RuntimeError) as e:
+            await local_store.update_one(db, "arrosages", watering_record["_id"], {
+                "completed": True, "success": False, "completed_at": datetime.now().isoformat()
+            })
+            revisions.bump("arrosages")
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to execute watering script: {str(e)}"
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Failed to start watering: {str(e)}"
             )
+        
+        return {
+            "status": "success",
+            "message": (
+                f"Watering triggered at position {request.position} for {request.amount} ml"
+                if request.amount is not None else
+                f"Watering triggered at position {request.position} for {request.duration} minutes"
+            ),
+            "mode": job.to_dict()["mode"],
+            "watering_id": watering_id,
+            "job_id": job.id,
+            "job_status": job.status
+        }
             
     except HTTPException:
         raise
@@ -447,25 +712,239 @@ async def trigger_immediate_watering(
             detail=f"Unexpected error: {str(e)}"
         )
 
+@plants_router.post("/watering/batch", status_code=status.HTTP_200_OK)
+async def trigger_batch_watering(
+    request: BatchWateringRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Trigger immediate watering for several plants in a single pump cycle"""
+    items = request.items
+    try:
+        plant_obj_ids = [ObjectId(item.plantId) for item in items]
+    except:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid plant ID format"
+        )
+    if len(set(plant_obj_ids)) != len(plant_obj_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Each plant can only appear once in a batch"
+        )
+    
+    # Verify every plant and its position (one local read, one MongoDB query for the others)
+    plants = await local_store.find_many(db, "semis", plant_obj_ids)
+    for item, plant_obj_id in zip(items, plant_obj_ids):
+        plant = plants.get(str(plant_obj_id))
+        if plant is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Plant with ID {item.plantId} not found"
+            )
+        if plant.get("place") != item.position:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Position mismatch with the registered position of plant {item.plantId}"
+            )
+    
+    # Record every watering first
+    now = datetime.now().isoformat()
+    plans = [_watering_plan(item) for item in items]
+    watering_records = [
+        {
+            "_id": ObjectId(),
+            "plantId": item.plantId,
+            "dateTime": now,
+            "duration": plan["duration"],
+            "amount": plan["amount"],
+            "target_ml": plan["target_ml"],
+            "created_at": now,
+            "created_by": current_user.username,
+            "automated": False,
+            "completed": False  # Will be updated by the watering scheduler
+        }
+        for item, plan in zip(items, plans)
+    ]
+    await local_store.insert("arrosages", watering_records)
+    watering_ids = [str(record["_id"]) for record in watering_records]
+    
+    # Update every plant's last watering timestamp
+    await local_store.update_many(db, "semis", plant_obj_ids, {"dernier_arrosage": now})
+    revisions.bump("semis", "arrosages")
+    for item in items:
+        event_hub.publish("semis", {"action": "updated", "semis": {
+            "_id": item.plantId,
+            "dernier_arrosage": now
+        }})
+    
+    # Queue all jobs together so they share one pump window
+    try:
+        jobs = await watering_scheduler.submit_many([
+            {
+                "position": item.position,
+                "duration": plan["seconds"],
+                "target_ml": plan["target_ml"],
+                "watering_id": watering_id,
+                "plant_id": item.plantId
+            }
+            for item, plan, watering_id in zip(items, plans, watering_ids)
+        ])
+    except (ValueError, RuntimeError) as e:
+        await local_store.update_many(db, "arrosages", [record["_id"] for record in watering_records], {
+            "completed": True, "success": False, "completed_at": datetime.now().isoformat()
+        })
+        revisions.bump("arrosages")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to start watering: {str(e)}"
+        )
+    
+    return {
+        "status": "success",
+        "message": f"Watering triggered for {len(jobs)} plant(s)",
+        "waterings": [
+            {
+                "plantId": item.plantId,
+                "position": item.position,
+                "watering_id": watering_id,
+                "job_id": job.id,
+                "job_status": job.status
+            }
+            for item, watering_id, job in zip(items, watering_ids, jobs)
+        ]
+    }
+
+def _find_watering_job(watering_id: str):
+    job = watering_scheduler.find(watering_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No queued or running watering with ID {watering_id}"
+        )
+    return job
+
+@plants_router.delete("/watering/{watering_id}")
+async def cancel_watering(
+    watering_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Cancel a queued or running watering (job ID or watering record ID)"""
+    job = _find_watering_job(watering_id)
+    watering_scheduler.cancel(job, reason=f"cancelled by {current_user.username}")
+    return job.to_dict()
+
+@plants_router.patch("/watering/{watering_id}")
+async def extend_watering(
+    watering_id: str,
+    extension: WateringExtension,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Extend a queued or running watering by some minutes"""
+    job = _find_watering_job(watering_id)
+    try:
+        watering_scheduler.extend(job, extension.minutes * 60)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if job.watering_id:
+        increments = {"duration": extension.minutes}
+        # A metered job still stops on its target volume: only its timeout grows
+        metered = job.metered or (job.target_ml is not None and flow_meter.metered(job.position))
+        if not metered:
+            increments["amount"] = round(extension.minutes * 60 * flow_meter.rate(job.position))
+        await local_store.update_one(db, "arrosages", ObjectId(job.watering_id), inc_fields=increments)
+        revisions.bump("arrosages")
+    return job.to_dict()
+
+@plants_router.get("/watering/flow")
+async def get_flow_rates(
+    current_user: User = Depends(get_current_active_user)
+):
+    """Flow sensor and learned flow rate of each valve line"""
+    return flow_meter.state()
+
+@plants_router.get("/watering/queue")
+async def get_watering_queue(
+    current_user: User = Depends(get_current_active_user)
+):
+    """Running and queued watering jobs, with the pump and valve state"""
+    return watering_scheduler.state()
+
+class IrrigationSettings(BaseModel):
+    enabled: bool
+
+@plants_router.get("/irrigation")
+async def get_irrigation_state(
+    current_user: User = Depends(get_current_active_user)
+):
+    """Settings and per-place state of the automatic irrigation engine"""
+    return irrigation_engine.state()
+
+@plants_router.put("/irrigation")
+async def update_irrigation_settings(
+    settings: IrrigationSettings,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Enable or disable automatic irrigation (admin only)"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can change the irrigation settings"
+        )
+    irrigation_engine.enabled = settings.enabled
+    return irrigation_engine.state()
+
+@plants_router.get("/irrigation/decisions")
+async def get_irrigation_decisions(
+    place: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Latest decisions of the irrigation engine, newest first
+
+    Decisions are logged locally first: the local ones, pushed or not, are
+    merged over MongoDB's, which is skipped while it is unreachable.
+    """
+    decisions = {}
+    if replicator.online is not False:
+        try:
+            query = {"place": place} if place is not None else {}
+            cursor = db[DECISIONS_COLLECTION].find(query).sort("at", -1).limit(limit)
+            for decision in await cursor.to_list(length=limit):
+                decisions[decision["_id"]] = decision
+        except PyMongoError as e:
+            logger.warning(f"Irrigation decisions served from the local store only: {e}")
+    for decision in await local_store.find(DECISIONS_COLLECTION, "place" if place is not None else None, place):
+        decisions[decision["_id"]] = decision
+    latest = sorted(decisions.values(), key=lambda decision: decision["at"], reverse=True)[:limit]
+    return [{key: value for key, value in decision.items() if key != "_id"} for decision in latest]
+
 @plants_router.post("/watering/status/internal")
 async def update_watering_status_internal(
     watering_id: str,
     success: bool,
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    """Internal endpoint for updating watering status without authentication"""
+    """Internal endpoint for updating watering status without authentication
+
+    Only used by the standalone scripts in scripts/; the watering scheduler
+    writes the status directly.
+    """
     try:
         watering_obj_id = ObjectId(watering_id)
         
         # Update the status
-        await db.arrosages.update_one(
-            {"_id": watering_obj_id},
-            {"$set": {
-                "completed": True,
-                "success": success,
-                "completed_at": datetime.now().isoformat()
-            }}
-        )
+        await local_store.update_one(db, "arrosages", watering_obj_id, {
+            "completed": True,
+            "success": success,
+            "completed_at": datetime.now().isoformat()
+        })
+        revisions.bump("arrosages")
         
         return {"status": "success", "message": "Watering status updated"}
     except Exception as e:
@@ -1,7 +1,23 @@
-from fastapi import APIRouter, Depends
-from auth import get_current_active_user
-from temperature_service import temperature_service
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from datetime import datetime
+import dataclasses
+import json
+import statistics
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from auth import User, get_current_active_user, get_current_user, oauth2_scheme
+from database import database, get_database
+from local_store import local_store
+from replicator import replicator
+from event_hub import event_hub, EVENT_KEEPALIVE
+from sensor_sampler import sensor_sampler
+from sensor_history import sensor_history, resolve_range, humidity_sensor_id, TEMPERATURE_SENSOR_ID
 from humidity_service import humidity_service
+from calibration import calibration_store, CalibrationProfile
+from executors import hardware_executor, ExecutorSaturated
+from executors import executors_metrics
 
 # Créer un routeur avec une dépendance globale
 protected_router = APIRouter(
@@ -11,6 +27,20 @@ protected_router = APIRouter(
     responses={401: {"description": "Non autorisé"}},
 )
 
+def _check_sensor_place(place: int):
+    if place not in humidity_service.channel_mapping:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No humidity sensor for place {place}"
+        )
+
+def _check_admin(current_user: User):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can change the sensor calibration"
+        )
+
 @protected_router.get("/data")
 async def get_data():
     # Tous les endpoints de ce routeur sont protégés
@@ -19,18 +49,215 @@ async def get_data():
 @protected_router.get("/temperature")
 async def get_temperature():
     # Endpoint protégé pour obtenir la température
-    data = temperature_service.read_temperature()
+    data = await sensor_sampler.get_temperature()
     return data
     # return {"temperature": 22.5}
 
+@protected_router.get("/temperature/history")
+async def get_temperature_history(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    step: int = Query(3600, description="Bucket width in seconds"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Temperature min/max/avg per step between from and to (UTC, last 24h by default)"""
+    try:
+        start, end = resolve_range(start, end, step)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    points = await sensor_history.query(db, TEMPERATURE_SENSOR_ID, start, end, step)
+    return {"from": start.isoformat(), "to": end.isoformat(), "step": step, "points": points}
+
 @protected_router.get("/humidity")
 async def get_all_humidity():
     """Endpoint to get humidity readings for all sensors"""
-    data = humidity_service.read_humidity()
+    data = await sensor_sampler.get_humidity()
     return data
 
 @protected_router.get("/humidity/{place}")
 async def get_humidity_by_place(place: int):
     """Endpoint to get humidity reading for a specific place"""
-    data = humidity_service.read_humidity(place)
+    data = await sensor_sampler.get_humidity(place)
     return data
+
+@protected_router.get("/humidity/{place}/history")
+async def get_humidity_history(
+    place: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    step: int = Query(3600, description="Bucket width in seconds"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Humidity min/max/avg per step for a place between from and to (UTC, last 24h by default)"""
+    _check_sensor_place(place)
+    try:
+        start, end = resolve_range(start, end, step)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    points = await sensor_history.query(db, humidity_sensor_id(place), start, end, step)
+    return {"place": place, "from": start.isoformat(), "to": end.isoformat(), "step": step, "points": points}
+
+class CalibrationUpdate(BaseModel):
+    kind: str = Field("two_point", description="two_point, piecewise or polynomial")
+    dry_raw: float = Field(1023, ge=0, le=1023, description="Raw value of dry soil (0 %)")
+    wet_raw: float = Field(0, ge=0, le=1023, description="Raw value of saturated soil (100 %)")
+    points: List[List[float]] = Field(default_factory=list, description="[[raw, percent], ...] for piecewise")
+    coefficients: List[float] = Field(default_factory=list, description="Polynomial coefficients, highest degree first")
+
+@protected_router.get("/calibration")
+async def get_calibrations():
+    """Calibration profile in use for every place with a humidity sensor"""
+    return {
+        place: calibration_store.get(place).to_document()
+        for place in humidity_service.channel_mapping
+    }
+
+@protected_router.put("/calibration/{place}")
+async def set_calibration(
+    place: int,
+    calibration: CalibrationUpdate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Replace the calibration profile of a place"""
+    _check_admin(current_user)
+    _check_sensor_place(place)
+    profile = CalibrationProfile(place=place, **calibration.dict())
+    try:
+        profile = await calibration_store.save(db, profile)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    humidity_service.reset_smoothing(place)
+    return profile.to_document()
+
+@protected_router.post("/calibration/{place}/capture")
+async def capture_calibration_point(
+    place: int,
+    point: str = Query(..., pattern="^(dry|wet|point)$", description="dry (0 %), wet (100 %) or point"),
+    percent: Optional[float] = Query(None, ge=0, le=100, description="Humidity of the probe's soil for 'point'"),
+    samples: int = Query(32, ge=1, le=256),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Measure the probe of a place now and store the reading as a calibration point"""
+    _check_admin(current_user)
+    _check_sensor_place(place)
+    adc = humidity_service.adc
+    if adc is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="ADC not available")
+    channel = humidity_service.channel_mapping[place]
+    try:
+        readings = await hardware_executor.run(adc.read_channels, [channel], samples)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    raw = float(statistics.median(readings[channel]))
+
+    profile = dataclasses.replace(calibration_store.get(place))
+    if point == "point":
+        if percent is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'percent' is required for point")
+        if profile.kind != "piecewise":
+            # Start a piecewise curve from the current endpoints
+            profile.points = [[profile.dry_raw, 0.0], [profile.wet_raw, 100.0]]
+            profile.kind = "piecewise"
+    else:
+        percent = 0.0 if point == "dry" else 100.0
+        if profile.kind == "polynomial":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Polynomial profiles are set with PUT /protected/calibration/{place}"
+            )
+        if profile.kind == "two_point":
+            if point == "dry":
+                profile.dry_raw = raw
+            else:
+                profile.wet_raw = raw
+    if profile.kind == "piecewise":
+        profile.points = [p for p in profile.points if p[0] != raw and p[1] != percent] + [[raw, percent]]
+
+    try:
+        profile = await calibration_store.save(db, profile)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    humidity_service.reset_smoothing(place)
+    return {"captured_raw": raw, "percent": percent, "profile": profile.to_document()}
+
+@protected_router.post("/calibration/{place}/recompute")
+async def recompute_humidity_history(
+    place: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """Recompute stored humidity history of a place from its raw values with the current profile"""
+    _check_admin(current_user)
+    _check_sensor_place(place)
+    try:
+        start, end = resolve_range(start, end, 3600)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    profile = calibration_store.get(place)
+    buckets = await sensor_history.recompute(db, humidity_sensor_id(place), profile.convert, start, end)
+    return {"place": place, "from": start.isoformat(), "to": end.isoformat(), "buckets": buckets}
+
+@protected_router.get("/executors")
+async def get_executors_metrics():
+    """Queue depth and wait time of the blocking-work thread pools"""
+    return executors_metrics()
+
+@protected_router.get("/database")
+async def get_database_metrics():
+    """Connection pool gauges and checkout latency of the MongoDB client"""
+    return database.stats()
+
+@protected_router.get("/replication")
+async def get_replication_state():
+    """Local store backlog and state of the sync with MongoDB"""
+    return {**replicator.state(), "store": await local_store.stats()}
+
+
+# Routeur du flux d'événements : EventSource ne peut pas envoyer d'en-tête
+# Authorization, le jeton est donc aussi accepté en paramètre de requête
+stream_router = APIRouter(
+    prefix="/protected",
+    tags=["protected"],
+    responses={401: {"description": "Non autorisé"}},
+)
+
+async def get_stream_user(
+    request: Request,
+    token: Optional[str] = Query(None, description="Access token (EventSource clients)"),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    if token is None:
+        token = await oauth2_scheme(request)
+    user = await get_current_user(token=token, db=db)
+    return await get_current_active_user(current_user=user)
+
+@stream_router.get("/stream")
+async def stream_events(request: Request, current_user=Depends(get_stream_user)):
+    """Server-sent events: sensor snapshots, watering jobs and semis updates"""
+    subscription = event_hub.subscribe()
+
+    async def event_source():
+        try:
+            # Start with the current sensor snapshot so clients render immediately
+            if sensor_sampler.snapshot is not None:
+                yield f"event: sensors\ndata: {json.dumps(sensor_sampler.snapshot.to_dict(), default=str)}\n\n"
+            while not await request.is_disconnected():
+                frame = await subscription.next(EVENT_KEEPALIVE)
+                yield frame if frame is not None else ": keep-alive\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@protected_router.get("/stream/stats")
+async def get_stream_stats():
+    """Connected clients and events published by the hub"""
+    return event_hub.stats()
@@ -0,0 +1,282 @@
+"""
+Background replication between the local store and MongoDB Atlas.
+
+- push: changes queued in the local store are sent in batches of
+  REPLICATION_BATCH_SIZE, shortly after they are written. All changes of a
+  document in a batch are merged into one operation, so the batch is sent
+  unordered in one round trip per collection. Deletions are sent after the
+  other changes of the batch.
+- pull: every REPLICATION_PULL_INTERVAL seconds the mirrored collections
+  (semis, users) are reloaded from Atlas.
+- the revisions of the collections pushed or reloaded are bumped, so
+  conditional GETs served from either copy are revalidated.
+- failures back off exponentially from REPLICATION_RETRY_BASE up to
+  REPLICATION_MAX_BACKOFF seconds (with jitter); the garden keeps running
+  from the local store meanwhile.
+
+Conflicts are resolved as follows:
+- a document deleted in Atlas wins: its local copy and changes are dropped;
+- fields in MONOTONIC_FIELDS only move forward ($max), so a late offline
+  write never replaces a newer value (last watering time, completion);
+- other fields are merged field by field, the pushed value winning.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from http_cache import revisions
+from irrigation_engine import DECISIONS_COLLECTION
+from job_journal import JOBS_COLLECTION
+from local_store import local_store, MIRRORED_COLLECTIONS
+from sensor_history import sensor_history, HISTORY_COLLECTION
+
+load_dotenv()
+
+logger = logging.getLogger("replicator")
+
+REPLICATION_BATCH_SIZE = int(os.getenv("REPLICATION_BATCH_SIZE", "200"))
+# Wait after a local write so that a burst of writes goes in one batch
+REPLICATION_DEBOUNCE = float(os.getenv("REPLICATION_DEBOUNCE", "1"))
+REPLICATION_PULL_INTERVAL = float(os.getenv("REPLICATION_PULL_INTERVAL", "300"))
+REPLICATION_RETRY_BASE = float(os.getenv("REPLICATION_RETRY_BASE", "5"))
+REPLICATION_MAX_BACKOFF = float(os.getenv("REPLICATION_MAX_BACKOFF", "300"))
+# Time given to the last push at shutdown
+REPLICATION_STOP_TIMEOUT = float(os.getenv("REPLICATION_STOP_TIMEOUT", "5"))
+# Local copies of pushed watering records, jobs and irrigation decisions are kept this long
+LOCAL_RETENTION_DAYS = float(os.getenv("LOCAL_RETENTION_DAYS", "7"))
+
+# Fields whose newest value is the greatest one
+MONOTONIC_FIELDS = {
+    "semis": ("dernier_arrosage",),
+    "arrosages": ("completed",),
+}
+
+DUPLICATE_KEY = 11000
+
+
+def _document_id(doc_id: str):
+    return ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id
+
+
+class Replicator:
+    def __init__(self):
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self.online: Optional[bool] = None
+        self.failures = 0
+        self.pushed = 0
+        self.conflicts = 0
+        self.rejected = 0
+        self.last_push: Optional[str] = None
+        self.last_pull: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.retry_at: Optional[float] = None
+
+    # Lifecycle
+
+    def start(self, db):
+        self.db = db
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Last chance for what was written during shutdown
+        if self.db is not None:
+            try:
+                await asyncio.wait_for(self.drain(), REPLICATION_STOP_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Changes left in the local store at shutdown: {e}")
+
+    # Push
+
+    def _update(self, collection: str, doc_id: str, fields: dict, upsert: bool) -> Optional[UpdateOne]:
+        fields = {key: value for key, value in fields.items() if key != "_id"}
+        monotonic = MONOTONIC_FIELDS.get(collection, ())
+        update = {}
+        plain = {key: value for key, value in fields.items() if key not in monotonic}
+        forward = {key: value for key, value in fields.items() if key in monotonic}
+        if plain:
+            update["$set"] = plain
+        if forward:
+            update["$max"] = forward
+        if not update:
+            return None
+        return UpdateOne({"_id": _document_id(doc_id)}, update, upsert=upsert)
+
+    async def _push_documents(self, collection: str, changes: Dict[str, dict]):
+        """Send the merged changes of a collection's documents"""
+        operations, updated = [], []
+        for doc_id, change in changes.items():
+            # New documents are upserted: replaying their insert is harmless
+            operation = self._update(collection, doc_id, change["fields"], upsert=change["new"])
+            if operation is not None:
+                operations.append(operation)
+                if not change["new"]:
+                    updated.append(doc_id)
+        if not operations:
+            return
+        matched, upserted = await self._bulk_write(collection, operations)
+
+        # Updates that matched nothing: the document was deleted in Atlas, which wins
+        inserted = len(operations) - len(updated)
+        if updated and matched - (inserted - upserted) < len(updated):
+            existing = {
+                str(doc["_id"])
+                async for doc in self.db[collection].find(
+                    {"_id": {"$in": [_document_id(doc_id) for doc_id in updated]}}, {"_id": 1}
+                )
+            }
+            for doc_id in updated:
+                if doc_id not in existing:
+                    self.conflicts += 1
+                    logger.info(f"{collection} {doc_id} was deleted in MongoDB, dropping its local changes")
+                    await local_store.forget(collection, doc_id)
+
+    async def _bulk_write(self, collection: str, operations) -> tuple:
+        """Unordered bulk write; returns (matched, upserted)
+
+        Duplicate keys mean the operation was already applied. Other write
+        errors would fail on every retry: they are logged and dropped.
+        """
+        try:
+            result = await self.db[collection].bulk_write(operations, ordered=False)
+            return result.matched_count, result.upserted_count
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != DUPLICATE_KEY:
+                    self.rejected += 1
+                    logger.error(f"Rejected change on {collection}: {error.get('errmsg')}")
+            return e.details.get("nMatched", 0), e.details.get("nUpserted", 0)
+
+    async def push(self) -> int:
+        """Push one batch of queued changes; returns the number of changes sent"""
+        rows = await local_store.batch(REPLICATION_BATCH_SIZE)
+        if not rows:
+            return 0
+
+        documents: Dict[str, Dict[str, dict]] = {}
+        deletions: Dict[str, List[DeleteMany]] = {}
+        readings: List[dict] = []
+        for row in rows:
+            if row["op"] == "reading":
+                readings.append(row["body"])
+                continue
+            if row["op"] == "delete":
+                deletions.setdefault(row["collection"], []).append(DeleteMany(row["body"]))
+                continue
+            change = documents.setdefault(row["collection"], {}).setdefault(
+                row["doc_id"], {"new": False, "fields": {}}
+            )
+            if row["op"] == "insert":
+                change["new"] = True
+            change["fields"].update(row["body"])
+
+        for collection, changes in documents.items():
+            await self._push_documents(collection, changes)
+        for collection, operations in deletions.items():
+            await self._bulk_write(collection, operations)
+        if readings:
+            await self._bulk_write(HISTORY_COLLECTION, sensor_history.operations(readings))
+
+        await local_store.ack([row["seq"] for row in rows])
+        # Routes reading Atlas now see these changes
+        revisions.bump(*documents, *deletions)
+        self.pushed += len(rows)
+        self.last_push = datetime.now().isoformat()
+        return len(rows)
+
+    async def drain(self) -> int:
+        pushed = 0
+        while True:
+            count = await self.push()
+            if not count:
+                return pushed
+            pushed += count
+
+    # Pull
+
+    async def pull(self) -> int:
+        """Reload the mirrored collections from Atlas; returns the number of local changes"""
+        count = 0
+        for collection in MIRRORED_COLLECTIONS:
+            started = time.time()
+            docs = await self.db[collection].find().to_list(length=None)
+            changed = await local_store.mirror(collection, docs, started)
+            if changed:
+                revisions.bump(collection)
+            count += changed
+        self.last_pull = datetime.now().isoformat()
+        return count
+
+    async def _run(self):
+        next_pull = 0.0
+        while True:
+            local_store.changed.clear()
+            delay = None
+            try:
+                if time.monotonic() >= next_pull:
+                    await self.pull()
+                    for collection in ("arrosages", JOBS_COLLECTION, DECISIONS_COLLECTION):
+                        await local_store.purge(collection, time.time() - LOCAL_RETENTION_DAYS * 86400)
+                    next_pull = time.monotonic() + REPLICATION_PULL_INTERVAL
+                await self.drain()
+                if self.online is False:
+                    logger.info("MongoDB reachable again, local changes pushed")
+                self.online = True
+                self.failures = 0
+                self.last_error = None
+                self.retry_at = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.online = False
+                self.failures += 1
+                self.last_error = str(e)
+                delay = min(REPLICATION_MAX_BACKOFF, REPLICATION_RETRY_BASE * 2 ** (self.failures - 1))
+                delay *= random.uniform(0.5, 1)
+                self.retry_at = time.monotonic() + delay
+                logger.warning(f"Replication failed ({e}), retrying in {delay:.0f}s")
+
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+            # Wait for local changes, or the next pull
+            try:
+                await asyncio.wait_for(local_store.changed.wait(), max(0.0, next_pull - time.monotonic()))
+                await asyncio.sleep(REPLICATION_DEBOUNCE)
+            except asyncio.TimeoutError:
+                pass
+
+    def state(self) -> dict:
+        return {
+            "online": self.online,
+            "failures": self.failures,
+            "pushed": self.pushed,
+            "conflicts": self.conflicts,
+            "rejected": self.rejected,
+            "last_push": self.last_push,
+            "last_pull": self.last_pull,
+            "last_error": self.last_error,
+            "retry_in": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.retry_at else None,
+        }
+
+
+# Create a single instance of the replicator
+replicator = Replicator()
@@ -79,8 +79,8 @@ def water_plant(position, duration):
         GPIO.output(PUMP_GPIO, GPIO.HIGH)
         GPIO.output(valve_gpio_pin, GPIO.HIGH)  # Note: LOW pour activer conformément au code original
         
-        
-        time.sleep(duration)
+        # Durée en minutes, comme l'API et les autres scripts
+        time.sleep(duration * 60)
         
         # Désactivation de la pompe et de l'électrovanne
         logger.info(f"Désactivation électrovanne (GPIO {valve_gpio_pin}) et pompe (GPIO {PUMP_GPIO})")
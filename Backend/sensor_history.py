@@ -0,0 +1,249 @@
+"""
+Persistent humidity / temperature history.
+
+Readings from the sensor sampler are stored in the `sensor_history`
+collection as one document per sensor per hour:
+
+    {
+        "sensor": "humidity:5",          # or "temperature"
+        "hour": <UTC hour start>,
+        "samples": [{"t": <UTC datetime>, "v": 42.1, "raw": 593}, ...],
+        "count": 60, "sum": 2526.0, "min": 41.7, "max": 42.6
+    }
+
+`samples` is capped at HISTORY_BUCKET_SIZE entries so a bucket never grows
+past one hour of readings. Downsampled series (min/max/avg per step) are
+computed by an aggregation pipeline in MongoDB.
+
+Readings are first queued in the local store; the replicator turns them into
+bucket upserts (`operations`) when it pushes to MongoDB.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from local_store import local_store
+from sensor_sampler import sensor_sampler
+
+load_dotenv()
+
+logger = logging.getLogger("sensor_history")
+
+# Seconds between two persisted readings of the same sensor
+HISTORY_INTERVAL = float(os.getenv("HISTORY_INTERVAL", "60"))
+# Maximum number of samples in one hourly bucket
+HISTORY_BUCKET_SIZE = int(os.getenv("HISTORY_BUCKET_SIZE", str(max(1, int(3600 // HISTORY_INTERVAL)))))
+# Maximum number of points returned by a history query
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "5000"))
+
+HISTORY_COLLECTION = "sensor_history"
+
+
+def humidity_sensor_id(place: int) -> str:
+    return f"humidity:{place}"
+
+
+TEMPERATURE_SENSOR_ID = "temperature"
+
+
+class SensorHistory:
+    def __init__(self, interval: float = HISTORY_INTERVAL, bucket_size: int = HISTORY_BUCKET_SIZE):
+        self.interval = interval
+        self.bucket_size = bucket_size
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_recorded = None
+
+    # Writing
+
+    def _readings(self, snapshot) -> List[dict]:
+        """One reading per sensor with a valid value in the snapshot"""
+        now = datetime.utcnow()
+        readings = []
+        for place, reading in snapshot.humidity.items():
+            if reading.get("status") == "success" and reading.get("humidity") is not None:
+                readings.append({"sensor": humidity_sensor_id(place), "t": now,
+                                 "v": reading["humidity"], "raw": reading.get("raw_value")})
+        temperature = snapshot.temperature
+        if temperature.get("status") == "success" and temperature.get("temperature") is not None:
+            readings.append({"sensor": TEMPERATURE_SENSOR_ID, "t": now, "v": temperature["temperature"], "raw": None})
+        return readings
+
+    def operations(self, readings: List[dict]) -> List[UpdateOne]:
+        """One upsert per hourly bucket for queued readings
+
+        The filter excludes a bucket that already holds the first sample, so
+        replaying a batch hits the unique (sensor, hour) index instead of
+        counting the samples twice. count / sum / min / max are recomputed
+        from the samples kept once the bucket is capped, in the same update
+        (pipeline), so they never count a dropped sample.
+        """
+        buckets = {}
+        for reading in readings:
+            hour = reading["t"].replace(minute=0, second=0, microsecond=0)
+            sample = {"t": reading["t"], "v": reading["v"]}
+            if reading.get("raw") is not None:
+                sample["raw"] = reading["raw"]
+            buckets.setdefault((reading["sensor"], hour), []).append(sample)
+
+        operations = []
+        for (sensor, hour), samples in buckets.items():
+            operations.append(UpdateOne(
+                {"sensor": sensor, "hour": hour, "samples.t": {"$ne": samples[0]["t"]}},
+                [
+                    {"$set": {"samples": {"$slice": [
+                        {"$concatArrays": [{"$ifNull": ["$samples", []]}, {"$literal": samples}]},
+                        self.bucket_size,
+                    ]}}},
+                    {"$set": {
+                        "count": {"$size": "$samples"},
+                        "sum": {"$sum": "$samples.v"},
+                        "min": {"$min": "$samples.v"},
+                        "max": {"$max": "$samples.v"},
+                    }},
+                ],
+                upsert=True,
+            ))
+        return operations
+
+    async def record(self, snapshot) -> int:
+        """Queue a snapshot for MongoDB, returns the number of sensors recorded"""
+        readings = self._readings(snapshot)
+        await local_store.queue_readings(readings)
+        return len(readings)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = sensor_sampler.snapshot
+            # Only persist fresh sweeps, and each sweep once
+            if snapshot is None or snapshot is self._last_recorded or snapshot.age() > sensor_sampler.stale_after:
+                continue
+            try:
+                await self.record(snapshot)
+                self._last_recorded = snapshot
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to record sensor history: {e}")
+
+    def start(self, db):
+        self.db = db
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Reading
+
+    async def query(self, db, sensor: str, start: datetime, end: datetime, step: int) -> List[dict]:
+        """min / max / avg of a sensor per `step` seconds between start and end (UTC)"""
+        step_ms = step * 1000
+        first_hour = start.replace(minute=0, second=0, microsecond=0)
+        pipeline = [
+            {"$match": {"sensor": sensor, "hour": {"$gte": first_hour, "$lt": end}}},
+            {"$unwind": "$samples"},
+            {"$match": {"samples.t": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": {"$subtract": [
+                    {"$toLong": "$samples.t"},
+                    {"$mod": [{"$toLong": "$samples.t"}, step_ms]},
+                ]},
+                "min": {"$min": "$samples.v"},
+                "max": {"$max": "$samples.v"},
+                "avg": {"$avg": "$samples.v"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]
+        points = []
+        async for doc in db[HISTORY_COLLECTION].aggregate(pipeline):
+            points.append({
+                "timestamp": datetime.utcfromtimestamp(doc["_id"] / 1000).isoformat(),
+                "min": round(doc["min"], 2),
+                "max": round(doc["max"], 2),
+                "avg": round(doc["avg"], 2),
+                "count": doc["count"],
+            })
+        return points
+
+    async def recompute(self, db, sensor: str, convert, start: datetime, end: datetime,
+                        batch_size: int = 500) -> int:
+        """
+        Re-derive stored values from stored raw samples with `convert`
+        (a vectorized raw -> value function), e.g. after a calibration change.
+        Returns the number of buckets rewritten.
+        """
+        first_hour = start.replace(minute=0, second=0, microsecond=0)
+        cursor = db[HISTORY_COLLECTION].find(
+            {"sensor": sensor, "hour": {"$gte": first_hour, "$lt": end}},
+            {"samples": 1}
+        )
+        operations = []
+        rewritten = 0
+        async for bucket in cursor:
+            samples = bucket.get("samples", [])
+            raws = np.array([sample.get("raw", np.nan) for sample in samples], dtype=np.float64)
+            has_raw = ~np.isnan(raws)
+            if not has_raw.any():
+                continue
+            values = np.array([sample["v"] for sample in samples], dtype=np.float64)
+            values[has_raw] = np.round(convert(raws[has_raw]), 2)
+            for sample, value in zip(samples, values.tolist()):
+                sample["v"] = value
+            operations.append(UpdateOne(
+                {"_id": bucket["_id"]},
+                {"$set": {
+                    "samples": samples,
+                    "count": len(samples),
+                    "sum": float(values.sum()),
+                    "min": float(values.min()),
+                    "max": float(values.max()),
+                }}
+            ))
+            if len(operations) >= batch_size:
+                await db[HISTORY_COLLECTION].bulk_write(operations, ordered=False)
+                rewritten += len(operations)
+                operations = []
+        if operations:
+            await db[HISTORY_COLLECTION].bulk_write(operations, ordered=False)
+            rewritten += len(operations)
+        return rewritten
+
+
+def resolve_range(start: Optional[datetime], end: Optional[datetime], step: int):
+    """Default to the last 24 hours and validate the number of points"""
+    if end is None:
+        end = datetime.utcnow()
+    if start is None:
+        start = end - timedelta(days=1)
+    # Stored timestamps are naive UTC
+    if start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    if step <= 0:
+        raise ValueError("'step' must be a positive number of seconds")
+    if (end - start).total_seconds() / step > HISTORY_MAX_POINTS:
+        raise ValueError(f"Too many points requested (max {HISTORY_MAX_POINTS}), increase 'step'")
+    return start, end
+
+
+# Create a single instance of the history recorder
+sensor_history = SensorHistory()
@@ -0,0 +1,153 @@
+"""
+Background acquisition of the humidity (MCP3008) and temperature (MCP9808) sensors.
+
+A single task samples every sensor at a fixed rate and publishes an immutable
+snapshot. HTTP handlers only read the latest snapshot, so the number of
+requests no longer drives the number of bus transactions.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from dotenv import load_dotenv
+
+from event_hub import event_hub
+from executors import hardware_executor
+from humidity_service import humidity_service
+from temperature_service import temperature_service
+
+load_dotenv()
+
+logger = logging.getLogger("sensor_sampler")
+
+# Sampling configuration (seconds)
+SENSOR_SAMPLE_INTERVAL = float(os.getenv("SENSOR_SAMPLE_INTERVAL", "2.0"))
+SENSOR_STALE_AFTER = float(os.getenv("SENSOR_STALE_AFTER", str(SENSOR_SAMPLE_INTERVAL * 3)))
+
+
+@dataclass(frozen=True)
+class SensorSnapshot:
+    """Readings of every sensor taken during one acquisition sweep"""
+    humidity: Mapping[int, Mapping]
+    temperature: Mapping
+    taken_at: datetime
+    monotonic: float
+
+    def age(self) -> float:
+        """Seconds elapsed since the sweep"""
+        return time.monotonic() - self.monotonic
+
+    def to_dict(self) -> dict:
+        return {
+            "humidity": {place: dict(reading) for place, reading in self.humidity.items()},
+            "temperature": dict(self.temperature),
+            "taken_at": self.taken_at.isoformat(),
+        }
+
+
+class SensorSampler:
+    def __init__(self, interval: float = SENSOR_SAMPLE_INTERVAL, stale_after: float = SENSOR_STALE_AFTER):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.snapshot: Optional[SensorSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _sample(self) -> SensorSnapshot:
+        """Blocking sweep over every sensor (runs outside the event loop)"""
+        humidity = humidity_service.read_humidity()
+        temperature = temperature_service.read_temperature()
+        return SensorSnapshot(
+            humidity=MappingProxyType({
+                place: MappingProxyType(dict(reading))
+                for place, reading in humidity.items()
+                if isinstance(reading, dict)
+            }),
+            temperature=MappingProxyType(dict(temperature)),
+            taken_at=datetime.now(),
+            monotonic=time.monotonic(),
+        )
+
+    async def refresh(self) -> SensorSnapshot:
+        """Take a new sample and publish it"""
+        async with self._lock:
+            snapshot = await hardware_executor.run(self._sample)
+            self.snapshot = snapshot
+        event_hub.publish("sensors", snapshot.to_dict())
+        return snapshot
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Sensor sampling failed: {e}")
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    def start(self):
+        """Start the acquisition task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the acquisition task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get_snapshot(self) -> SensorSnapshot:
+        """Latest snapshot, sampling once if none has been taken yet"""
+        if self.snapshot is None:
+            return await self.refresh()
+        return self.snapshot
+
+    def _freshness(self, snapshot: SensorSnapshot) -> dict:
+        age = snapshot.age()
+        return {
+            "age_seconds": round(age, 3),
+            "stale": age > self.stale_after,
+        }
+
+    async def get_humidity(self, place: Optional[int] = None) -> dict:
+        """Humidity readings in the same shape as HumiditySensor.read_humidity"""
+        snapshot = await self.get_snapshot()
+        freshness = self._freshness(snapshot)
+
+        if place is not None:
+            reading = snapshot.humidity.get(place)
+            if reading is None:
+                return {
+                    "status": "error",
+                    "error": f"No humidity sensor for place {place}",
+                    "timestamp": snapshot.taken_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    **freshness,
+                }
+            return {"place": place, **reading, **freshness}
+
+        return {
+            place: {**reading, **freshness}
+            for place, reading in snapshot.humidity.items()
+        }
+
+    async def get_temperature(self) -> dict:
+        """Temperature reading in the same shape as TemperatureSensor.read_temperature"""
+        snapshot = await self.get_snapshot()
+        return {**snapshot.temperature, **self._freshness(snapshot)}
+
+
+# Create a single instance of the sampler
+sensor_sampler = SensorSampler()
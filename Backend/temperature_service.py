@@ -2,13 +2,11 @@
 Service pour la gestion du capteur de température MCP9808
 """
 
-import time
-import smbus2
+import logging
 from datetime import datetime
+from hardware import get_hardware
 
-# Configuration pour MCP9808
-MCP9808_I2C_ADDR = 0x18  # Adresse I2C par défaut
-MCP9808_REG_AMBIENT_TEMP = 0x05
+logger = logging.getLogger("temperature_service")
 
 class TemperatureSensor:
     def __init__(self):
@@ -18,25 +16,16 @@ class TemperatureSensor:
     def read_temperature(self):
         """Lit la température du capteur MCP9808"""
         try:
-            # Initialiser le bus I2C
-            bus = smbus2.SMBus(1)
-            
-            # Lire la température
-            data = bus.read_i2c_block_data(MCP9808_I2C_ADDR, MCP9808_REG_AMBIENT_TEMP, 2)
-            raw_temp = (data[0] << 8) | data[1]
-            
-            # Extraire la température
-            temp_c = (raw_temp & 0x0FFF) / 16.0
-            if raw_temp & 0x1000:  # Bit de signe
-                temp_c -= 256.0
+            # Le pilote (MCP9808 réel ou simulé) est choisi par HARDWARE_BACKEND
+            thermometer = get_hardware().thermometer
+            if thermometer is None:
+                raise RuntimeError("Temperature sensor not available")
+            temp_c = thermometer.read_celsius()
             
             # Mettre à jour les attributs
             self.last_reading = round(temp_c, 2)
             self.last_timestamp = datetime.now()
             
-            # Fermer le bus
-            bus.close()
-            
             return {
                 "temperature": self.last_reading,
                 "timestamp": self.last_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
@@ -45,7 +34,7 @@ class TemperatureSensor:
             
         except Exception as e:
             error_msg = str(e)
-            print(f"Erreur de lecture du capteur: {error_msg}")
+            logger.error(f"Erreur de lecture du capteur: {error_msg}")
             
             # En cas d'erreur, retourner la dernière lecture valide si disponible
             if self.last_reading is not None:
@@ -0,0 +1,100 @@
+"""
+Shared fixtures of the backend tests.
+
+The tests run against the simulated hardware backend, an in-memory MongoDB
+(mongomock-motor) and a local store in a temporary directory. The settings
+below are set before any backend module is imported, since the modules read
+them at import time.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("HARDWARE_BACKEND", "simulated")
+# Never contacted: routes get the in-memory database through their dependency
+os.environ.setdefault("MONGODB_URL", "mongodb://127.0.0.1:1")
+os.environ.setdefault("MONGODB_DB", "test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+# Position 1 has a flow sensor; the simulated line delivers 200 ml/s
+os.environ.setdefault("FLOW_SENSOR_PINS", "1:20")
+os.environ.setdefault("SIMULATION_FLOW_ML_S", "200")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from auth import create_token_pair
+from database import get_database
+from hardware import close_hardware, get_hardware
+from local_store import local_store
+from main import app
+from tokens import token_service
+from user_cache import user_cache
+from watering_scheduler import WateringScheduler
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["test"]
+
+
+@pytest.fixture(autouse=True)
+async def store(tmp_path):
+    """The local store singleton, on a fresh file for each test"""
+    local_store.path = str(tmp_path / "local_store.db")
+    await local_store.open()
+    local_store.changed.clear()
+    yield local_store
+    await local_store.close()
+
+
+@pytest.fixture
+def garden():
+    """Simulated outputs and soil, rebuilt for each test"""
+    yield get_hardware().outputs.garden
+    close_hardware()
+
+
+@pytest.fixture
+async def scheduler(db, garden):
+    scheduler = WateringScheduler(max_open_valves=2)
+    await scheduler.start(db)
+    yield scheduler
+    await scheduler.stop()
+
+
+@pytest.fixture
+async def client(db):
+    """HTTP client of the app on the in-memory database (startup handlers are not run)"""
+    await token_service.load(db)
+    user_cache.clear()
+    app.dependency_overrides[get_database] = lambda: db
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+async def add_user(db, username: str = "alice", role: str = "user") -> dict:
+    """Store a user and return a token pair for it"""
+    await db.users.insert_one({
+        "username": username,
+        "email": f"{username}@example.com",
+        "hashed_password": "not-used",
+        "disabled": False,
+        "role": role,
+    })
+    return create_token_pair(username)
+
+
+@pytest.fixture
+async def auth_headers(db):
+    tokens = await add_user(db)
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+
+@pytest.fixture
+async def admin_headers(db):
+    tokens = await add_user(db, "admin", role="admin")
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
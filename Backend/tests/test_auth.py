@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import tokens
+from tests.conftest import add_user
+from tokens import REVOKED_COLLECTION, TokenService
+
+
+async def test_refresh_rotates_the_token(db, client):
+    pair = await add_user(db)
+
+    response = await client.post("/auth/refresh", json={"refresh_token": pair["refresh_token"]})
+    assert response.status_code == 200
+    rotated = response.json()
+
+    # The old refresh token is spent, the new one works
+    response = await client.post("/auth/refresh", json={"refresh_token": pair["refresh_token"]})
+    assert response.status_code == 401
+    response = await client.post("/auth/refresh", json={"refresh_token": rotated["refresh_token"]})
+    assert response.status_code == 200
+
+
+async def test_access_token_is_not_a_refresh_token(db, client):
+    pair = await add_user(db)
+
+    response = await client.post("/auth/refresh", json={"refresh_token": pair["access_token"]})
+
+    assert response.status_code == 401
+
+
+async def test_concurrent_refreshes_with_one_token(db, client):
+    await db[REVOKED_COLLECTION].create_index("jti", unique=True)
+    pair = await add_user(db)
+
+    responses = await asyncio.gather(*(
+        client.post("/auth/refresh", json={"refresh_token": pair["refresh_token"]}) for _ in range(2)
+    ))
+
+    assert sorted(response.status_code for response in responses) == [200, 401]
+
+
+async def test_revocation_filter_is_rebuilt_when_full(db, monkeypatch):
+    monkeypatch.setattr(tokens, "TOKEN_BLOOM_CAPACITY", 4)
+    service = TokenService()
+    # An expired revocation the TTL index has not removed yet
+    await db[REVOKED_COLLECTION].insert_one({"jti": "expired", "exp": datetime.utcnow() - timedelta(hours=1)})
+    await service.load(db)
+
+    exp = (datetime.utcnow() + timedelta(hours=1)).timestamp()
+    for index in range(5):
+        await service.revoke({"jti": f"jti-{index}", "sub": "alice", "exp": exp})
+    # The fifth revocation overfills the filter
+    assert service._rebuild is not None
+    await service._rebuild
+
+    stats = service.stats()
+    assert stats["bloom_rebuilds"] == 1
+    assert stats["bloom_capacity"] >= 2 * stats["revoked"]
+    assert all([await service.is_revoked(f"jti-{index}") for index in range(5)])
+    assert not await service.is_revoked("expired")
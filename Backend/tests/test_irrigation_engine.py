@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from irrigation_engine import DECISIONS_COLLECTION, IrrigationEngine
+
+
+@pytest.fixture
+def engine(db):
+    engine = IrrigationEngine(enabled=False)
+    engine.db = db
+    return engine
+
+
+@pytest.fixture
+async def plant(engine, store):
+    plant = {"_id": ObjectId(), "nom": "Basilic", "place": next(iter(engine.places))}
+    await store.put("semis", [plant])
+    return plant
+
+
+async def test_failed_dispatch_closes_the_record(engine, plant, store):
+    # The watering scheduler is not started: submit refuses the job
+    watering_id = await engine._dispatch(plant, plant["place"], datetime.now())
+
+    assert watering_id is None
+    [record] = await store.find("arrosages")
+    assert record["completed"] and not record["success"]
+    assert "dernier_arrosage" not in await store.get("semis", str(plant["_id"]))
+    assert engine.places[plant["place"]].budget_used == 0
+
+
+async def test_state_is_restored_from_mongodb_and_the_local_store(engine, plant, db, store):
+    place = plant["place"]
+    morning = datetime.now().replace(hour=6, minute=0, second=0, microsecond=0)
+    pushed = {"_id": ObjectId(), "place": place, "automated": True, "duration": 0.5,
+              "dateTime": morning.isoformat(), "success": True}
+    await db.arrosages.insert_one(dict(pushed))
+    # Already pushed but still kept locally: counted once
+    await store.put("arrosages", [pushed])
+    # Written while MongoDB was unreachable
+    await store.insert("arrosages", [{"_id": ObjectId(), "place": place, "automated": True, "duration": 1.0,
+                                      "dateTime": morning.replace(hour=7).isoformat(), "success": True}])
+    # Failed without delivering water: not counted
+    await db.arrosages.insert_one({"_id": ObjectId(), "place": place, "automated": True, "duration": 0.5,
+                                   "dateTime": morning.replace(hour=8).isoformat(), "success": False})
+    await store.insert("arrosages", [{"_id": ObjectId(), "place": place, "automated": True, "duration": 0.5,
+                                      "dateTime": morning.replace(hour=9).isoformat(), "success": False,
+                                      "cancelled": True, "measured_ml": 0}])
+
+    await engine._restore_state()
+
+    state = engine.places[place]
+    assert state.budget_used == 1.5
+    assert state.last_watering == morning.replace(hour=7)
+
+
+async def test_decisions_are_logged_locally_first(engine, plant, store, client, auth_headers):
+    await engine._record(plant["place"], plant, 35.0, 50.0, 70.0, "water", "below target", datetime.now())
+
+    [decision] = await store.find(DECISIONS_COLLECTION)
+    assert decision["decision"] == "water"
+    assert (await store.stats())["pending"] == 1
+
+    # Served before it reaches MongoDB
+    response = await client.get(f"/plant/irrigation/decisions?place={plant['place']}", headers=auth_headers)
+    assert [decision["reason"] for decision in response.json()] == ["below target"]
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from job_journal import JOBS_COLLECTION, job_journal
+
+
+async def add_job(store, job_id, status, watering_id=None, deadline=None):
+    await store.insert(JOBS_COLLECTION, [{"_id": job_id, "position": 2, "status": status,
+                                          "watering_id": watering_id, "deadline": deadline}])
+
+
+async def test_jobs_left_open_are_closed_at_startup(scheduler, db, store):
+    # scheduler.start() already ran on an empty journal: simulate the previous run
+    queued_record, running_record = ObjectId(), ObjectId()
+    await store.insert("arrosages", [{"_id": queued_record, "completed": False},
+                                     {"_id": running_record, "completed": False}])
+    await add_job(store, "queued-job", "queued", str(queued_record))
+    await add_job(store, "running-job", "running", str(running_record), datetime.now() + timedelta(minutes=5))
+    await add_job(store, "done-job", "completed")
+
+    assert await job_journal.close_open_jobs("interrupted") == 2
+
+    for job_id in ("queued-job", "running-job"):
+        job = await store.get(JOBS_COLLECTION, job_id)
+        assert job["status"] == "failed" and job["reason"] == "interrupted"
+    assert (await store.get(JOBS_COLLECTION, "done-job"))["status"] == "completed"
+    for record_id in (queued_record, running_record):
+        record = await store.get("arrosages", str(record_id))
+        assert record["completed"] and not record["success"]
+
+
+async def test_open_jobs_only_in_mongodb_are_closed_there(scheduler, db):
+    record_id = ObjectId()
+    await db.arrosages.insert_one({"_id": record_id, "completed": False})
+    await db[JOBS_COLLECTION].insert_one({"_id": "lost-job", "status": "running", "watering_id": str(record_id)})
+
+    assert await job_journal.close_open_jobs("interrupted") == 1
+
+    assert (await db[JOBS_COLLECTION].find_one({"_id": "lost-job"}))["status"] == "failed"
+    assert (await db.arrosages.find_one({"_id": record_id}))["success"] is False
+
+
+async def test_sweep_only_closes_overdue_jobs(scheduler, store):
+    now = datetime.now()
+    await add_job(store, "overdue", "running", deadline=now - timedelta(seconds=1))
+    await add_job(store, "on-time", "running", deadline=now + timedelta(minutes=5))
+    await add_job(store, "still-queued", "queued")
+
+    await scheduler.sweep()
+
+    assert (await store.get(JOBS_COLLECTION, "overdue"))["reason"] == "deadline expired"
+    assert (await store.get(JOBS_COLLECTION, "on-time"))["status"] == "running"
+    assert (await store.get(JOBS_COLLECTION, "still-queued"))["status"] == "queued"
+
+
+async def test_jobs_of_this_run_are_left_alone(scheduler, store):
+    job = await scheduler.submit(2, 60)
+    await asyncio.sleep(0.05)
+    assert (await store.get(JOBS_COLLECTION, job.id))["status"] == "running"
+
+    await job_journal.close_open_jobs("deadline expired", exclude=[job.id],
+                                      overdue_before=datetime.now() + timedelta(hours=1))
+
+    assert (await store.get(JOBS_COLLECTION, job.id))["status"] == "running"
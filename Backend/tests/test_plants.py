@@ -0,0 +1,222 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import indexes
+import main
+import plant
+from flow_meter import flow_meter
+from replicator import replicator
+from watering_scheduler import MAX_JOB_DURATION
+
+
+async def test_update_keeps_unpushed_watering_fields(db, store, client, auth_headers):
+    plant_id = ObjectId()
+    plant = {"_id": plant_id, "nom": "Basilic", "date_plantation": "2024-04-01", "place": 2,
+             "dernier_arrosage": datetime(2024, 5, 1)}
+    await db.semis.insert_one(dict(plant))
+    await store.put("semis", [plant])
+    # Watering recorded offline, still in the outbox
+    await store.update("semis", str(plant_id), {"dernier_arrosage": datetime(2024, 5, 3), "txHumidMesure": 61})
+
+    response = await client.put(f"/plant/semis/{plant_id}", json={"nom": "Basilic pourpre"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json()["nom"] == "Basilic pourpre"
+    assert response.json()["txHumidMesure"] == 61
+    local = await store.get("semis", str(plant_id))
+    assert local["nom"] == "Basilic pourpre"
+    assert local["dernier_arrosage"] == datetime(2024, 5, 3)
+    assert local["txHumidMesure"] == 61
+
+
+@pytest.fixture
+async def indexed_db(db, monkeypatch):
+    monkeypatch.setattr(indexes, "_required_verified", False)
+    assert await indexes.ensure_required_indexes(db) == []
+    return db
+
+
+async def test_concurrent_creates_on_one_place(indexed_db, client, auth_headers):
+    plant = {"nom": "Tomate", "date_plantation": "2024-04-01", "place": 7}
+
+    responses = await asyncio.gather(
+        client.post("/plant/semis", json=plant, headers=auth_headers),
+        client.post("/plant/semis", json={**plant, "nom": "Poivron"}, headers=auth_headers),
+    )
+
+    assert sorted(response.status_code for response in responses) == [201, 400]
+    assert await indexed_db.semis.count_documents({"place": 7}) == 1
+
+
+async def test_moving_a_plant_to_a_taken_place(indexed_db, client, auth_headers):
+    await indexed_db.semis.insert_many([
+        {"nom": "Tomate", "date_plantation": "2024-04-01", "place": 1},
+        {"nom": "Poivron", "date_plantation": "2024-04-01", "place": 2},
+    ])
+    pepper = await indexed_db.semis.find_one({"place": 2})
+
+    response = await client.put(f"/plant/semis/{pepper['_id']}", json={"place": 1}, headers=auth_headers)
+
+    assert response.status_code == 400
+
+
+async def test_startup_fails_without_the_place_index(db, monkeypatch):
+    monkeypatch.setattr(indexes, "_required_verified", False)
+    # Duplicates left from before the index: it cannot be built
+    await db.semis.insert_many([{"nom": "Tomate", "place": 3}, {"nom": "Poivron", "place": 3}])
+
+    async def ping(timeout_ms=None):
+        return 1.0
+
+    monkeypatch.setattr(main.database, "ping", ping)
+    monkeypatch.setattr(main.database, "db", db)
+
+    with pytest.raises(indexes.MissingIndexError, match="semis.place_unique"):
+        await main.startup_db_client()
+
+    async def ready():
+        return True
+
+    monkeypatch.setattr(main.database, "ready", ready)
+    response = await main.readiness()
+    assert response.status_code == 503
+
+
+@pytest.fixture
+def slow_line(monkeypatch):
+    # Position 2 learned 0.2 ml/s: 1000 ml would take 5000 s, over MAX_JOB_DURATION
+    monkeypatch.setitem(flow_meter.rates, 2, {"position": 2, "ml_per_s": 0.2})
+    return 2
+
+
+async def test_volume_over_the_longest_watering_is_refused(db, store, client, auth_headers, slow_line):
+    plant_id = ObjectId()
+    await store.put("semis", [{"_id": plant_id, "nom": "Menthe", "place": slow_line}])
+
+    response = await client.post("/plant/watering/now", headers=auth_headers,
+                                 json={"plantId": str(plant_id), "position": slow_line, "amount": 1000})
+
+    assert response.status_code == 422
+    assert f"At most {MAX_JOB_DURATION * 0.2:.0f} ml" in response.json()["detail"]
+    assert await store.find("arrosages") == []
+
+
+async def test_batch_with_one_volume_too_large_writes_nothing(db, store, client, auth_headers, slow_line):
+    mint, sage = ObjectId(), ObjectId()
+    await store.put("semis", [{"_id": mint, "nom": "Menthe", "place": slow_line},
+                              {"_id": sage, "nom": "Sauge", "place": 3}])
+
+    response = await client.post("/plant/watering/batch", headers=auth_headers, json={"items": [
+        {"plantId": str(sage), "position": 3, "duration": 1},
+        {"plantId": str(mint), "position": slow_line, "amount": 1000},
+    ]})
+
+    assert response.status_code == 422
+    assert await store.find("arrosages") == []
+    assert "dernier_arrosage" not in await store.get("semis", str(sage))
+
+
+async def test_history_merges_unpushed_waterings(db, store, client, auth_headers):
+    plant_id = str(ObjectId())
+    await db.arrosages.insert_many([
+        {"_id": ObjectId(), "plantId": plant_id, "dateTime": f"2024-05-0{day}T08:00:00", "duration": 1}
+        for day in (1, 2)
+    ])
+    # Recorded offline, still in the outbox
+    await store.insert("arrosages", [{"_id": ObjectId(), "plantId": plant_id,
+                                      "dateTime": "2024-05-03T08:00:00", "duration": 2}])
+
+    response = await client.get(f"/plant/arrosages/{plant_id}?limit=2", headers=auth_headers)
+    assert [record["dateTime"][:10] for record in response.json()] == ["2024-05-03", "2024-05-02"]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = await client.get(f"/plant/arrosages/{plant_id}?limit=2&after={cursor}", headers=auth_headers)
+    assert [record["dateTime"][:10] for record in response.json()] == ["2024-05-01"]
+
+
+async def test_history_and_dashboard_while_mongodb_is_down(store, client, auth_headers, monkeypatch):
+    monkeypatch.setattr(replicator, "online", False)
+    plant_id = ObjectId()
+    await store.put("semis", [{"_id": plant_id, "nom": "Basilic", "place": 2}])
+    await store.insert("arrosages", [{"_id": ObjectId(), "plantId": str(plant_id),
+                                      "dateTime": "2024-05-03T08:00:00", "duration": 2, "automated": True}])
+
+    response = await client.get(f"/plant/arrosages/{plant_id}?automated=true", headers=auth_headers)
+    assert response.status_code == 200 and len(response.json()) == 1
+
+    response = await client.get("/plant/dashboard", headers=auth_headers)
+    assert response.status_code == 200
+    [plant] = response.json()["plants"]
+    assert [record["duration"] for record in plant["waterings"]] == [2]
+
+
+async def test_deleting_a_plant_is_queued_for_mongodb(db, store, client, auth_headers):
+    plant_id = ObjectId()
+    plant = {"_id": plant_id, "nom": "Basilic", "place": 2}
+    await db.semis.insert_one(dict(plant))
+    await store.put("semis", [plant])
+    await db.arrosages.insert_one({"_id": ObjectId(), "plantId": str(plant_id), "dateTime": "2024-05-01T08:00:00"})
+    await store.insert("arrosages", [{"_id": ObjectId(), "plantId": str(plant_id),
+                                      "dateTime": "2024-05-03T08:00:00"}])
+
+    response = await client.delete(f"/plant/semis/{plant_id}", headers=auth_headers)
+
+    assert response.status_code == 204
+    assert await store.get("semis", str(plant_id)) is None
+    assert await store.find("arrosages") == []
+    # A pull before the push does not bring the plant back
+    replicator.db = db
+    try:
+        await replicator.pull()
+        assert await store.get("semis", str(plant_id)) is None
+        await replicator.drain()
+    finally:
+        replicator.db = None
+    assert await db.semis.count_documents({}) == 0
+    assert await db.arrosages.count_documents({}) == 0
+
+
+async def test_batch_reads_and_writes_plants_together(db, store, client, auth_headers, monkeypatch):
+    basil, sage = ObjectId(), ObjectId()
+    await store.put("semis", [{"_id": basil, "nom": "Basilic", "place": 2}])
+    # Not synced yet: only in MongoDB
+    await db.semis.insert_one({"_id": sage, "nom": "Sauge", "place": 3})
+
+    async def unavailable(jobs):
+        raise RuntimeError("pump unavailable")
+
+    monkeypatch.setattr(main.watering_scheduler, "submit_many", unavailable)
+
+    response = await client.post("/plant/watering/batch", headers=auth_headers, json={"items": [
+        {"plantId": str(basil), "position": 2, "duration": 1},
+        {"plantId": str(sage), "position": 3, "duration": 1},
+    ]})
+
+    assert response.status_code == 503
+    plants = await store.get_many("semis", [str(basil), str(sage)])
+    assert all("dernier_arrosage" in plant for plant in plants.values()) and len(plants) == 2
+    records = await store.find("arrosages")
+    assert len(records) == 2
+    assert all(record["completed"] and record["success"] is False for record in records)
+
+
+async def test_extending_a_metered_watering_keeps_its_volume(db, store, client, auth_headers, scheduler, monkeypatch):
+    monkeypatch.setattr(plant, "watering_scheduler", scheduler)
+    plant_id = ObjectId()
+    # Position 1 has a flow sensor: the job stops on the volume
+    await store.put("semis", [{"_id": plant_id, "nom": "Basilic", "place": 1}])
+    response = await client.post("/plant/watering/now", headers=auth_headers,
+                                 json={"plantId": str(plant_id), "position": 1, "amount": 300})
+    assert response.status_code == 200
+    watering_id = response.json()["watering_id"]
+    before = await store.get("arrosages", watering_id)
+
+    response = await client.patch(f"/plant/watering/{watering_id}", headers=auth_headers, json={"minutes": 2})
+
+    assert response.status_code == 200
+    after = await store.get("arrosages", watering_id)
+    assert after["amount"] == before["amount"] == 300
+    assert after["duration"] == before["duration"] + 2
@@ -0,0 +1,24 @@
+import pytest
+
+from humidity_service import humidity_service
+
+PLACE = next(iter(humidity_service.channel_mapping))
+
+
+@pytest.mark.parametrize("method, path", [
+    ("PUT", f"/protected/calibration/{PLACE}"),
+    ("POST", f"/protected/calibration/{PLACE}/capture?point=dry"),
+    ("POST", f"/protected/calibration/{PLACE}/recompute"),
+])
+async def test_calibration_changes_need_an_admin(client, auth_headers, method, path):
+    response = await client.request(method, path, json={"dry_raw": 900, "wet_raw": 300}, headers=auth_headers)
+
+    assert response.status_code == 403
+
+
+async def test_admin_sets_a_calibration(client, admin_headers):
+    response = await client.put(f"/protected/calibration/{PLACE}", json={"dry_raw": 900, "wet_raw": 300},
+                                headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.json()["dry_raw"] == 900
@@ -0,0 +1,136 @@
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from http_cache import revisions
+from replicator import replicator
+from sensor_history import HISTORY_COLLECTION, sensor_history
+
+
+@pytest.fixture
+def atlas(db):
+    replicator.db = db
+    yield db
+    replicator.db = None
+
+
+async def test_offline_writes_are_pushed_in_one_document(atlas, store):
+    record_id = ObjectId()
+    await store.insert("arrosages", [{"_id": record_id, "plantId": "p1", "completed": False}])
+    await store.update("arrosages", str(record_id), {"completed": True, "success": True})
+
+    assert await replicator.drain() == 2
+
+    assert await atlas.arrosages.find_one({"_id": record_id}) == {
+        "_id": record_id, "plantId": "p1", "completed": True, "success": True,
+    }
+    assert (await store.stats())["pending"] == 0
+
+
+async def test_replaying_a_batch_is_harmless(atlas, store, monkeypatch):
+    record_id = ObjectId()
+    await store.insert("arrosages", [{"_id": record_id, "completed": False}])
+    await store.update("arrosages", str(record_id), inc_fields={"duration": 5})
+
+    # The batch reaches MongoDB but its acknowledgement is lost
+    async def lost(seqs):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(store, "ack", lost)
+    with pytest.raises(ConnectionError):
+        await replicator.push()
+    monkeypatch.undo()
+
+    await replicator.drain()
+
+    assert await atlas.arrosages.count_documents({}) == 1
+    assert (await atlas.arrosages.find_one({"_id": record_id}))["duration"] == 5
+
+
+async def test_replayed_readings_are_stored_once(atlas, store, monkeypatch):
+    await atlas[HISTORY_COLLECTION].create_index([("sensor", 1), ("hour", 1)], unique=True)
+    await store.queue_readings([
+        {"sensor": "humidity:1", "t": datetime(2024, 5, 1, 10, minute), "v": 40.0 + minute, "raw": None}
+        for minute in range(3)
+    ])
+
+    async def lost(seqs):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(store, "ack", lost)
+    with pytest.raises(ConnectionError):
+        await replicator.push()
+    monkeypatch.undo()
+    await replicator.drain()
+
+    bucket = await atlas[HISTORY_COLLECTION].find_one({"sensor": "humidity:1"})
+    assert [sample["v"] for sample in bucket["samples"]] == [40.0, 41.0, 42.0]
+
+
+async def test_last_watering_time_only_moves_forward(atlas, store):
+    plant_id = ObjectId()
+    await atlas.semis.insert_one({"_id": plant_id, "dernier_arrosage": datetime(2024, 5, 2)})
+    await store.put("semis", [{"_id": plant_id, "dernier_arrosage": datetime(2024, 5, 1)}])
+    # Offline watering recorded after the newer one was written elsewhere
+    await store.update("semis", str(plant_id), {"dernier_arrosage": datetime(2024, 5, 1, 12)})
+
+    await replicator.drain()
+
+    assert (await atlas.semis.find_one({"_id": plant_id}))["dernier_arrosage"] == datetime(2024, 5, 2)
+
+
+async def test_deleted_document_drops_local_changes(atlas, store):
+    plant_id = ObjectId()
+    await store.put("semis", [{"_id": plant_id, "place": 3}])
+    await store.update("semis", str(plant_id), {"humidite": 40})
+
+    await replicator.drain()
+
+    assert await atlas.semis.count_documents({}) == 0
+    assert await store.get("semis", str(plant_id)) is None
+
+
+async def test_conditional_get_is_revalidated_after_a_push(atlas, store, client, auth_headers):
+    plant_id = str(ObjectId())
+    # A watering written locally, as the watering routes do
+    await store.insert("arrosages", [{"_id": ObjectId(), "plantId": plant_id, "dateTime": datetime.now(),
+                                      "duration": 1, "completed": False}])
+    revisions.bump("arrosages")
+
+    # MongoDB does not have it yet, the local copy is served
+    response = await client.get(f"/plant/arrosages/{plant_id}", headers=auth_headers)
+    assert response.status_code == 200 and len(response.json()) == 1
+    etag = response.headers["ETag"]
+
+    await replicator.drain()
+
+    response = await client.get(f"/plant/arrosages/{plant_id}", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
+async def test_pull_revalidates_the_mirrored_plants(atlas, store):
+    plant_id = ObjectId()
+    await atlas.semis.insert_one({"_id": plant_id, "place": 4})
+    before = revisions.get("semis")
+
+    await replicator.pull()
+    assert revisions.get("semis") == before + 1
+    assert (await store.get("semis", str(plant_id)))["place"] == 4
+
+    # Nothing changed in MongoDB: cached responses stay valid
+    await replicator.pull()
+    assert revisions.get("semis") == before + 1
+
+
+async def test_bucket_statistics_only_count_kept_samples(atlas, store, monkeypatch):
+    monkeypatch.setattr(sensor_history, "bucket_size", 3)
+    for minute in range(5):
+        await store.queue_readings([{"sensor": "temperature", "t": datetime(2024, 5, 1, 10, minute),
+                                     "v": 20.0 + minute, "raw": None}])
+        await replicator.drain()
+
+    bucket = await atlas[HISTORY_COLLECTION].find_one({"sensor": "temperature"})
+    assert [sample["v"] for sample in bucket["samples"]] == [20.0, 21.0, 22.0]
+    assert (bucket["count"], bucket["sum"], bucket["min"], bucket["max"]) == (3, 63.0, 20.0, 22.0)
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import hardware
+from job_journal import JOBS_COLLECTION
+from valve_controller import PUMP_GPIO, VALVE_MAPPING, valve_controller
+from watering_scheduler import MAX_JOB_DURATION, WateringScheduler
+
+
+async def wait_for(job, timeout=5.0):
+    """Wait until a job has finished"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while job.status in ("queued", "running"):
+        assert loop.time() < deadline, f"job still {job.status}"
+        await asyncio.sleep(0.02)
+
+
+async def test_job_opens_valve_and_pump_then_closes_them(scheduler, garden):
+    job = await scheduler.submit(2, 0.2)
+
+    assert job.status == "running"
+    assert garden.outputs[VALVE_MAPPING[2]] and garden.outputs[PUMP_GPIO]
+
+    await wait_for(job)
+    assert job.status == "completed"
+    assert 0.2 <= job.watered() < 0.5
+    assert not garden.outputs[VALVE_MAPPING[2]] and not garden.outputs[PUMP_GPIO]
+    assert not valve_controller.open_valves and not valve_controller.pump_on
+
+
+async def test_positions_sharing_a_valve_run_one_after_the_other(scheduler, garden):
+    # Positions 5 and 12 are both wired to GPIO 16
+    first = await scheduler.submit(5, 0.2)
+    second = await scheduler.submit(12, 0.2)
+
+    assert first.status == "running"
+    assert second.status == "queued"
+
+    await wait_for(first)
+    assert second.status == "running"
+    # The pump kept running between the two jobs
+    assert garden.outputs[PUMP_GPIO]
+    await wait_for(second)
+    assert not garden.outputs[PUMP_GPIO]
+
+
+async def test_open_valves_are_limited_by_the_pump(scheduler):
+    jobs = await scheduler.submit_many([
+        {"position": position, "duration": 0.2} for position in (2, 3, 4)
+    ])
+
+    assert [job.status for job in jobs] == ["running", "running", "queued"]
+    await wait_for(jobs[2])
+    assert all(job.status == "completed" for job in jobs)
+
+
+async def test_metered_job_stops_on_the_target_volume(scheduler):
+    # 200 ml/s simulated line: 100 ml in about half a second, long before the timeout
+    job = await scheduler.submit(1, target_ml=100)
+
+    assert job.metered
+    assert job.duration > 1
+    await wait_for(job)
+    assert job.status == "completed"
+    assert job.measured_ml == pytest.approx(100, abs=15)
+    assert job.watered() < job.duration
+
+
+async def test_cancel_closes_the_valve(scheduler, garden):
+    job = await scheduler.submit(3, 10)
+
+    scheduler.cancel(job)
+
+    assert job.status == "cancelled"
+    assert not garden.outputs[VALVE_MAPPING[3]] and not garden.outputs[PUMP_GPIO]
+
+
+async def test_invalid_batch_queues_nothing(scheduler):
+    with pytest.raises(ValueError):
+        await scheduler.submit_many([
+            {"position": 2, "duration": 1},
+            {"position": 3, "duration": MAX_JOB_DURATION + 1},
+        ])
+
+    assert not scheduler.running and not scheduler.queued_jobs()
+
+
+async def test_volume_over_the_longest_job_is_refused(scheduler):
+    with pytest.raises(ValueError, match="At most"):
+        await scheduler.submit(2, target_ml=scheduler.max_volume(2) + 1)
+
+
+async def test_completion_is_recorded_on_the_local_watering(scheduler, store):
+    await store.insert("arrosages", [{"_id": "0123456789abcdef01234567", "completed": False}])
+
+    job = await scheduler.submit(2, 0.1, watering_id="0123456789abcdef01234567")
+    await wait_for(job)
+    await asyncio.sleep(0.1)
+
+    record = await store.get("arrosages", "0123456789abcdef01234567")
+    assert record["completed"] and record["success"]
+    assert record["mode"] == "timed"
+
+
+async def test_jobs_are_journaled_without_mongodb(garden, store):
+    # Nothing listens on this port: every MongoDB call fails after the timeout
+    offline = AsyncIOMotorClient("mongodb://127.0.0.1:1", serverSelectionTimeoutMS=500)["test"]
+    scheduler = WateringScheduler()
+    await scheduler.start(offline)
+    try:
+        started = time.monotonic()
+        job = await scheduler.submit(2, 0.1)
+        assert time.monotonic() - started < 0.25
+
+        await wait_for(job)
+        await asyncio.sleep(0.1)
+        journal = await store.get(JOBS_COLLECTION, job.id)
+        assert journal["status"] == "completed"
+        assert journal["deadline"] is not None
+    finally:
+        await scheduler.stop()
+
+
+@pytest.mark.parametrize("has_gpio", [True, False])
+def test_auto_backend_only_simulates_without_gpio(monkeypatch, has_gpio):
+    def broken():
+        raise RuntimeError("No access to /dev/mem")
+
+    monkeypatch.setattr(hardware, "RPiGPIOOutputs", broken)
+    monkeypatch.setattr(hardware, "_has_gpio", lambda: has_gpio)
+
+    if has_gpio:
+        with pytest.raises(RuntimeError, match="HARDWARE_BACKEND=simulated"):
+            hardware._build("auto")
+    else:
+        built = hardware._build("auto")
+        assert built.simulated
+        built.close()
@@ -0,0 +1,277 @@
+"""
+Access and refresh tokens.
+
+- Access tokens are short-lived (ACCESS_TOKEN_EXPIRE_MINUTES) and sent on
+  every request. Refresh tokens (REFRESH_TOKEN_EXPIRE_DAYS) are only accepted
+  by /auth/refresh, which rotates them: a new session never needs the
+  password, so no bcrypt work.
+- Verified tokens are cached by SHA-256 of the token until they expire, so a
+  repeat request skips the signature check.
+- Every token carries a jti. Revoked jtis are stored in the `revoked_tokens`
+  collection (expired entries removed by a TTL index) and summarized in
+  memory by a Bloom filter: a negative answer is final, a positive one is
+  confirmed in MongoDB. The filter is rebuilt from the collection every
+  TOKEN_BLOOM_REBUILD_HOURS, or as soon as it holds more revocations than it
+  was sized for, so expired entries leave it and its error rate holds.
+- A refresh token is claimed by inserting its jti in `revoked_tokens`: the
+  unique index lets only one of two concurrent refreshes succeed.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import secrets
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
+
+load_dotenv()
+
+logger = logging.getLogger("tokens")
+
+# JWT Configuration
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
+if not SECRET_KEY:
+    # Random per process: tokens cannot be forged, but every restart signs
+    # everybody out (refresh tokens included)
+    SECRET_KEY = secrets.token_urlsafe(32)
+    logger.error(
+        "JWT_SECRET_KEY is not set: using a random key, every token is invalidated "
+        "when the server restarts. Set JWT_SECRET_KEY in the .env file."
+    )
+
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# Verified tokens kept in memory
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+# Revocations the Bloom filter is sized for, at TOKEN_BLOOM_ERROR false positives
+TOKEN_BLOOM_CAPACITY = int(os.getenv("TOKEN_BLOOM_CAPACITY", "10000"))
+TOKEN_BLOOM_ERROR = float(os.getenv("TOKEN_BLOOM_ERROR", "0.01"))
+# Age at which the filter is rebuilt without its expired revocations
+TOKEN_BLOOM_REBUILD_HOURS = float(os.getenv("TOKEN_BLOOM_REBUILD_HOURS", "6"))
+# Wait before retrying a failed rebuild (seconds)
+TOKEN_BLOOM_RETRY = 60.0
+
+REVOKED_COLLECTION = "revoked_tokens"
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on SHA-256)"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.sha256(value.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TokenService:
+    def __init__(self, cache_size: int = TOKEN_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.db = None
+        self._verified: "OrderedDict[str, dict]" = OrderedDict()
+        self._revoked = BloomFilter(TOKEN_BLOOM_CAPACITY, TOKEN_BLOOM_ERROR)
+        self.hits = 0
+        self.misses = 0
+        self.bloom_positives = 0
+        self.rebuilds = 0
+        self._rebuild_at = 0.0
+        self._retry_at = 0.0
+        self._rebuild: Optional[asyncio.Task] = None
+        # Revocations made while a rebuild reads the collection
+        self._during_rebuild: Optional[List[str]] = None
+
+    async def load(self, db) -> int:
+        """Rebuild the revocation filter from the unexpired revocations
+
+        The filter is sized for twice the current revocations, at least
+        TOKEN_BLOOM_CAPACITY.
+        """
+        self.db = db
+        jtis = {doc["jti"] async for doc in db[REVOKED_COLLECTION].find(
+            {"exp": {"$gt": datetime.utcnow()}}, {"jti": 1}
+        )}
+        jtis.update(self._during_rebuild or ())
+        revoked = BloomFilter(max(TOKEN_BLOOM_CAPACITY, 2 * len(jtis)), TOKEN_BLOOM_ERROR)
+        for jti in jtis:
+            revoked.add(jti)
+        self._revoked = revoked
+        self._rebuild_at = time.monotonic() + TOKEN_BLOOM_REBUILD_HOURS * 3600
+        return revoked.count
+
+    async def _reload(self):
+        try:
+            await self.load(self.db)
+            self.rebuilds += 1
+        except Exception as e:
+            self._retry_at = time.monotonic() + TOKEN_BLOOM_RETRY
+            logger.error(f"Failed to rebuild the revoked token filter: {e}")
+        finally:
+            self._during_rebuild = None
+            self._rebuild = None
+
+    def _remember(self, jti: str):
+        """Add a revocation to the filter, rebuilding it in the background when due"""
+        now = time.monotonic()
+        if (self.db is not None and self._rebuild is None and now >= self._retry_at
+                and (self._revoked.count >= self._revoked.capacity or now >= self._rebuild_at)):
+            # From here on, revocations may be missed by the read of the rebuild
+            self._during_rebuild = []
+            self._rebuild = asyncio.create_task(self._reload())
+        self._revoked.add(jti)
+        if self._during_rebuild is not None:
+            self._during_rebuild.append(jti)
+
+    # Issuing
+
+    def _encode(self, subject: str, token_type: str, lifetime: timedelta, claims: Optional[dict] = None) -> str:
+        now = datetime.utcnow()
+        payload = dict(claims or {})
+        payload.update({
+            "sub": subject,
+            "type": token_type,
+            "jti": uuid.uuid4().hex,
+            "iat": now,
+            "exp": now + lifetime,
+        })
+        return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+    def create_access_token(self, subject: str, expires_delta: Optional[timedelta] = None,
+                            claims: Optional[dict] = None) -> str:
+        return self._encode(subject, "access", expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), claims)
+
+    def create_refresh_token(self, subject: str) -> str:
+        return self._encode(subject, "refresh", timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+    # Verification
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _decode(self, token: str) -> dict:
+        key = self._key(token)
+        payload = self._verified.get(key)
+        if payload is not None and payload["exp"] > time.time():
+            self._verified.move_to_end(key)
+            self.hits += 1
+            return payload
+        self.misses += 1
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            self._verified.pop(key, None)
+            raise InvalidToken(str(e))
+        if "exp" not in payload:
+            raise InvalidToken("Token without expiry")
+        self._verified[key] = payload
+        while len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return payload
+
+    async def verify(self, token: str, token_type: str = "access") -> dict:
+        """Claims of a valid, unrevoked token of the given type"""
+        payload = self._decode(token)
+        # Tokens issued before refresh tokens existed have no type: access only
+        if payload.get("type", "access") != token_type:
+            raise InvalidToken(f"Not an {token_type} token")
+        jti = payload.get("jti")
+        if jti and await self.is_revoked(jti):
+            raise InvalidToken("Token revoked")
+        return payload
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti not in self._revoked:
+            return False
+        self.bloom_positives += 1
+        if self.db is None:
+            return True
+        return await self.db[REVOKED_COLLECTION].find_one({"jti": jti}, {"_id": 1}) is not None
+
+    # Revocation
+
+    @staticmethod
+    def _revocation(payload: dict) -> dict:
+        return {
+            "jti": payload["jti"],
+            "sub": payload.get("sub"),
+            "type": payload.get("type", "access"),
+            "exp": datetime.utcfromtimestamp(payload["exp"]),
+            "revoked_at": datetime.utcnow(),
+        }
+
+    async def revoke(self, payload: dict):
+        """Revoke a verified token until its expiry"""
+        jti = payload.get("jti")
+        if not jti:
+            return
+        self._remember(jti)
+        if self.db is not None:
+            await self.db[REVOKED_COLLECTION].update_one(
+                {"jti": jti}, {"$set": self._revocation(payload)}, upsert=True
+            )
+
+    async def claim(self, payload: dict) -> bool:
+        """Revoke a verified token for its single use; False if it was already used
+
+        The insert hits the unique jti index when the token has been revoked
+        or claimed since it was verified.
+        """
+        jti = payload.get("jti")
+        if not jti:
+            return False
+        if self.db is None:
+            if jti in self._revoked:
+                return False
+        else:
+            try:
+                await self.db[REVOKED_COLLECTION].insert_one(self._revocation(payload))
+            except DuplicateKeyError:
+                return False
+        self._remember(jti)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "verified_cached": len(self._verified),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revoked": self._revoked.count,
+            "bloom_capacity": self._revoked.capacity,
+            "bloom_bits": self._revoked.size,
+            "bloom_rebuilds": self.rebuilds,
+            "bloom_positives": self.bloom_positives,
+        }
+
+
+# Create a single instance of the service
+token_service = TokenService()
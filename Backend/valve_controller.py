@@ -0,0 +1,204 @@
+"""
+In-process controller for the watering pump and solenoid valves.
+
+The controller owns the GPIO lines for the whole life of the API process, so
+triggering a watering no longer spawns a privileged interpreter per request.
+Scheduling of watering jobs lives in watering_scheduler.py; this module only
+switches outputs and keeps the pump on while at least one valve is open.
+
+Outputs go through the driver selected by HARDWARE_BACKEND (see hardware.py);
+the API user needs access to the GPIO device (member of the `gpio` group).
+
+Valve closings are driven by DeadlineTimers: one event-loop timer per open
+valve, armed for a time.monotonic() deadline. Timers live in the loop's timer
+heap, so hundreds of them cost no thread, process or task, and a deadline can
+be moved (extend) or dropped (cancel) at any time.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from hardware import get_hardware
+
+load_dotenv()
+
+logger = logging.getLogger("valve_controller")
+
+# GPIO pin for the water pump - will be activated with any valve
+PUMP_GPIO = 6
+
+# Mapping des positions aux GPIO pins des électrovannes
+VALVE_MAPPING = {
+    1: 4,    # Position 1 -> GPIO 4
+    2: 17,   # Position 2 -> GPIO 17
+    3: 27,   # Position 3 -> GPIO 27
+    4: 22,   # Position 4 -> GPIO 22
+    5: 16,   # Position 5 -> GPIO 16 (EV5)
+    6: 5,    # Position 6 -> GPIO 5
+    7: 26,   # Position 7 -> GPIO 26
+    8: 23,   # Position 8 -> GPIO 23
+    9: 24,   # Position 9 -> GPIO 24
+    10: 25,  # Position 10 -> GPIO 25 (EV8)
+    11: 12,  # Position 11 -> GPIO 12 (EV11)
+    12: 16   # Position 12 -> GPIO 16 (partagé avec 5)
+}
+
+
+def _parse_pin_mapping(value: str) -> Dict[int, int]:
+    """Parse "1:20,2:21" into {1: 20, 2: 21}"""
+    mapping = {}
+    for item in value.split(","):
+        if item.strip():
+            position, pin = item.split(":")
+            mapping[int(position)] = int(pin)
+    return mapping
+
+
+# Flow sensor input of each valve line, e.g. FLOW_SENSOR_PINS="1:20,2:21"
+FLOW_SENSOR_MAPPING = _parse_pin_mapping(os.getenv("FLOW_SENSOR_PINS", ""))
+
+
+class DeadlineTimers:
+    """Callbacks keyed by id, fired on the event loop at monotonic deadlines"""
+
+    def __init__(self):
+        self._timers: Dict[str, Tuple[asyncio.TimerHandle, float, Callable[[], None]]] = {}
+
+    def schedule(self, key: str, deadline: float, callback: Callable[[], None]):
+        """Run `callback` once time.monotonic() reaches `deadline`"""
+        self.cancel(key)
+        loop = asyncio.get_running_loop()
+        # The loop clock may differ from time.monotonic(): convert the delay, not the date
+        when = loop.time() + max(0.0, deadline - time.monotonic())
+        handle = loop.call_at(when, self._fire, key)
+        self._timers[key] = (handle, deadline, callback)
+
+    def reschedule(self, key: str, deadline: float) -> bool:
+        entry = self._timers.get(key)
+        if entry is None:
+            return False
+        self.schedule(key, deadline, entry[2])
+        return True
+
+    def cancel(self, key: str) -> bool:
+        entry = self._timers.pop(key, None)
+        if entry is None:
+            return False
+        entry[0].cancel()
+        return True
+
+    def cancel_all(self):
+        for key in list(self._timers):
+            self.cancel(key)
+
+    def deadline(self, key: str) -> Optional[float]:
+        entry = self._timers.get(key)
+        return entry[1] if entry else None
+
+    def _fire(self, key: str):
+        entry = self._timers.pop(key, None)
+        if entry is None:
+            return
+        try:
+            entry[2]()
+        except Exception as e:
+            logger.error(f"Timer callback {key} failed: {e}")
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+
+class ValveController:
+    def __init__(self):
+        self.outputs = None
+        self.backend = None
+        self.open_valves = set()   # GPIO pins currently open
+        self.pump_on = False
+        self.timers = DeadlineTimers()
+
+    @property
+    def simulation(self) -> bool:
+        return self.backend in (None, "simulated")
+
+    # GPIO helpers
+
+    def _setup_gpio(self):
+        hardware = get_hardware()
+        hardware.outputs.setup({PUMP_GPIO, *VALVE_MAPPING.values()})
+        self.outputs = hardware.outputs
+        self.backend = hardware.backend
+
+    def _write(self, pin: int, active: bool):
+        if self.outputs is None:
+            raise RuntimeError("Valve controller is not started")
+        self.outputs.write(pin, active)
+
+    def all_off(self):
+        """Force every valve and the pump off"""
+        for pin in {*VALVE_MAPPING.values(), PUMP_GPIO}:
+            try:
+                self._write(pin, False)
+            except Exception as e:
+                logger.error(f"Failed to switch off GPIO {pin}: {e}")
+        self.open_valves.clear()
+        self.pump_on = False
+
+    # Lifecycle
+
+    def start(self):
+        """Claim the GPIO lines and leave every output switched off"""
+        self._setup_gpio()
+        self.all_off()
+
+    def stop(self):
+        """Switch every output off (the lines are released by close_hardware)"""
+        self.timers.cancel_all()
+        if self.outputs is not None:
+            self.all_off()
+
+    # Outputs
+
+    def open_valve(self, position: int):
+        """Open the valve of a position, starting the pump first if needed"""
+        pin = VALVE_MAPPING[position]
+        if not self.pump_on:
+            logger.info(f"Activation pompe (GPIO {PUMP_GPIO})")
+            self._write(PUMP_GPIO, True)
+            self.pump_on = True
+        logger.info(f"Ouverture électrovanne position {position} (GPIO {pin})")
+        self._write(pin, True)
+        self.open_valves.add(pin)
+
+    def close_valve(self, position: int):
+        """Close the valve of a position (the pump is left as is)"""
+        pin = VALVE_MAPPING[position]
+        logger.info(f"Fermeture électrovanne position {position} (GPIO {pin})")
+        try:
+            self._write(pin, False)
+        finally:
+            self.open_valves.discard(pin)
+
+    def release_pump(self):
+        """Stop the pump once no valve is open any more"""
+        if self.pump_on and not self.open_valves:
+            logger.info(f"Désactivation pompe (GPIO {PUMP_GPIO})")
+            self._write(PUMP_GPIO, False)
+            self.pump_on = False
+
+    def state(self) -> dict:
+        return {
+            "backend": self.backend,
+            "simulation": self.simulation,
+            "pump_on": self.pump_on,
+            "open_valves": sorted(self.open_valves),
+            "timers": len(self.timers),
+        }
+
+
+# Create a single instance of the controller
+valve_controller = ValveController()
@@ -0,0 +1,468 @@
+"""
+Scheduler for watering jobs sharing a single pump.
+
+Jobs wait in a priority queue. The dispatcher starts as many of them as the
+pump can feed (MAX_OPEN_VALVES), never opens two jobs on the same valve GPIO
+(positions 5 and 12 share GPIO 16) and keeps the pump running while jobs
+follow each other, so compatible positions are watered in one pump window.
+
+A running job has no task of its own: its valve is closed by a deadline
+timer of the valve controller (time.monotonic(), seconds), which can be moved
+to extend the job or dropped to cancel it. Durations are in seconds here;
+the API takes minutes and converts once.
+
+A job may instead ask for a volume (target_ml). On a line with a flow sensor
+the valve closes when the volume has been measured, the duration only acting
+as a safety timeout; elsewhere the volume is turned into a duration with the
+learned flow rate of the line (see flow_meter).
+
+Every job is journaled in the local store, replicated to MongoDB (see
+job_journal), so queuing a job never waits on Atlas. At startup all outputs
+are switched off and jobs left open by a previous run are closed as failed;
+they are not replayed. A sweeper stops any job still running past its
+deadline and switches off outputs that no job accounts for.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+
+from event_hub import event_hub
+from flow_meter import flow_meter, FLOW_TIMEOUT_FACTOR
+from http_cache import revisions
+from job_journal import job_journal
+from local_store import local_store
+from valve_controller import valve_controller, VALVE_MAPPING
+
+load_dotenv()
+
+logger = logging.getLogger("watering_scheduler")
+
+# Maximum number of valves the pump can feed at the same time
+MAX_OPEN_VALVES = int(os.getenv("MAX_OPEN_VALVES", "3"))
+# Longest watering a job can reach, extensions included (seconds)
+MAX_JOB_DURATION = float(os.getenv("MAX_JOB_DURATION", "3600"))
+# Seconds a job may overrun its deadline before the sweeper stops it
+JOB_DEADLINE_GRACE = float(os.getenv("JOB_DEADLINE_GRACE", "30"))
+# Seconds between two sweeps of running jobs
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "10"))
+
+# Lower value = served first
+PRIORITY_MANUAL = 0
+PRIORITY_AUTOMATIC = 10
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+@dataclass
+class WateringJob:
+    position: int
+    duration: float  # seconds
+    watering_id: Optional[str] = None
+    plant_id: Optional[str] = None
+    priority: int = PRIORITY_MANUAL
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    started: Optional[float] = None   # time.monotonic() when the valve opened
+    deadline: Optional[float] = None  # time.monotonic() when the valve closes
+    ended: Optional[float] = None     # time.monotonic() when the valve closed
+    reason: Optional[str] = None
+    target_ml: Optional[float] = None
+    metered: bool = False             # closed by the flow sensor, not by the timer
+    pulses_start: Optional[int] = None
+    measured_ml: Optional[float] = None
+    flow_watch: Optional[object] = field(default=None, repr=False)
+
+    @property
+    def gpio(self) -> int:
+        return VALVE_MAPPING[self.position]
+
+    def remaining(self) -> Optional[float]:
+        if self.status == "queued":
+            return self.duration
+        if self.status != "running" or self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def watered(self) -> float:
+        """Seconds the valve has actually been open"""
+        if self.started is None:
+            return 0.0
+        end = self.deadline if self.status == "running" else self.ended
+        return max(0.0, min(end, time.monotonic()) - self.started)
+
+    def flow_rate(self) -> Optional[float]:
+        """Measured ml/s over the time the valve was open"""
+        watered = self.watered()
+        if self.measured_ml is None or watered <= 0:
+            return None
+        return self.measured_ml / watered
+
+    def to_dict(self) -> dict:
+        remaining = self.remaining()
+        flow_rate = self.flow_rate()
+        return {
+            "id": self.id,
+            "watering_id": self.watering_id,
+            "plantId": self.plant_id,
+            "position": self.position,
+            "gpio": self.gpio,
+            "duration": self.duration,
+            "remaining": round(remaining, 1) if remaining is not None else None,
+            "target_ml": self.target_ml,
+            "mode": "metered" if self.metered else "timed",
+            "measured_ml": round(self.measured_ml, 1) if self.measured_ml is not None else None,
+            "flow_rate": round(flow_rate, 3) if flow_rate is not None else None,
+            "priority": self.priority,
+            "status": self.status,
+            "reason": self.reason,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class WateringScheduler:
+    def __init__(self, max_open_valves: int = MAX_OPEN_VALVES):
+        self.max_open_valves = max(1, max_open_valves)
+        self.db = None
+        self.running: Dict[str, WateringJob] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._writes: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._started = False
+
+    # Lifecycle
+
+    async def start(self, db) -> int:
+        """Claim the GPIO lines (all off) and close jobs left open by a previous run
+
+        Returns the number of recovered jobs.
+        """
+        self.db = db
+        job_journal.attach(db)
+        valve_controller.start()
+        await flow_meter.start(db)
+        recovered = 0
+        try:
+            recovered = await job_journal.close_open_jobs("interrupted")
+            if recovered:
+                revisions.bump("arrosages")
+        except Exception as e:
+            logger.error(f"Failed to recover watering jobs: {e}")
+        self._started = True
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+        return recovered
+
+    async def stop(self):
+        """Stop running jobs and switch every output off"""
+        self._started = False
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        for job in list(self.running.values()):
+            self._finish(job, "failed", "shutdown")
+        writes = list(self._writes.values())
+        if writes:
+            await asyncio.gather(*writes, return_exceptions=True)
+        valve_controller.stop()
+
+    # Queue
+
+    async def submit(self, position: int, duration: Optional[float] = None, watering_id: Optional[str] = None,
+                     plant_id: Optional[str] = None, priority: int = PRIORITY_MANUAL,
+                     target_ml: Optional[float] = None) -> WateringJob:
+        """Queue a watering job of `duration` seconds or `target_ml` millilitres
+
+        The job starts as soon as the pump allows.
+        """
+        jobs = await self.submit_many([{
+            "position": position,
+            "duration": duration,
+            "target_ml": target_ml,
+            "watering_id": watering_id,
+            "plant_id": plant_id,
+        }], priority=priority)
+        return jobs[0]
+
+    @staticmethod
+    def plan(position: int, duration: Optional[float], target_ml: Optional[float]) -> float:
+        """Duration in seconds of a job; for a volume, the timed or safety duration"""
+        if target_ml is None:
+            return duration
+        expected = flow_meter.timed_duration(position, target_ml)
+        if flow_meter.metered(position):
+            # The sensor closes the valve; the timer only stops a stuck line
+            return min(MAX_JOB_DURATION, expected * FLOW_TIMEOUT_FACTOR)
+        return expected
+
+    @staticmethod
+    def max_volume(position: int) -> float:
+        """Largest volume (ml) one job can deliver on a line at its learned flow rate"""
+        return MAX_JOB_DURATION * flow_meter.rate(position)
+
+    async def submit_many(self, requests: List[dict], priority: int = PRIORITY_MANUAL) -> List[WateringJob]:
+        """Queue several jobs at once so they share one pump window
+
+        Each request holds position, duration (seconds) or target_ml, and
+        optionally watering_id and plant_id. Nothing is queued if one request
+        is invalid.
+        """
+        durations = []
+        for request in requests:
+            if request["position"] not in VALVE_MAPPING:
+                raise ValueError(f"Invalid position: {request['position']}")
+            target_ml = request.get("target_ml")
+            if target_ml is not None and target_ml <= 0:
+                raise ValueError(f"Invalid volume: {target_ml}")
+            if target_ml is not None and target_ml > self.max_volume(request["position"]):
+                # Even a metered job would time out before the volume has gone through
+                raise ValueError(f"At most {self.max_volume(request['position']):.0f} ml "
+                                 f"can be delivered at position {request['position']}")
+            duration = self.plan(request["position"], request.get("duration"), target_ml)
+            if duration is None or not 0 < duration <= MAX_JOB_DURATION:
+                raise ValueError(f"Invalid duration: {duration}")
+            durations.append(duration)
+        if not self._started:
+            raise RuntimeError("Watering scheduler is not running")
+        jobs = []
+        for request, duration in zip(requests, durations):
+            job = WateringJob(position=request["position"], duration=duration,
+                              watering_id=request.get("watering_id"), plant_id=request.get("plant_id"),
+                              priority=priority, target_ml=request.get("target_ml"))
+            jobs.append(job)
+        await asyncio.gather(*(job_journal.queued(job) for job in jobs))
+        for job in jobs:
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            event_hub.publish("watering", job.to_dict())
+        self._dispatch()
+        return jobs
+
+    def queued_jobs(self) -> List[WateringJob]:
+        return [job for _, _, job in sorted(self._heap)]
+
+    def find(self, job_or_watering_id: str) -> Optional[WateringJob]:
+        """Running or queued job by job id or arrosages id"""
+        for job in list(self.running.values()) + self.queued_jobs():
+            if job_or_watering_id in (job.id, job.watering_id):
+                return job
+        return None
+
+    def cancel(self, job: WateringJob, reason: str = "cancelled") -> WateringJob:
+        """Drop a queued job or close the valve of a running one now"""
+        if job.status == "queued":
+            self._heap = [entry for entry in self._heap if entry[2] is not job]
+            heapq.heapify(self._heap)
+            job.status = "cancelled"
+            job.reason = reason
+            job.finished_at = datetime.now()
+            event_hub.publish("watering", job.to_dict())
+            self._track(job.id, self._complete(job))
+        elif job.status == "running":
+            self._finish(job, "cancelled", reason)
+        return job
+
+    def extend(self, job: WateringJob, seconds: float) -> WateringJob:
+        """Add `seconds` of watering to a queued or running job"""
+        if job.status not in ("queued", "running"):
+            raise ValueError(f"Job {job.id} is {job.status}")
+        if job.duration + seconds > MAX_JOB_DURATION:
+            raise ValueError(f"A watering cannot exceed {MAX_JOB_DURATION:g} seconds")
+        job.duration += seconds
+        if job.status == "running":
+            job.deadline += seconds
+            valve_controller.timers.reschedule(job.id, job.deadline)
+            self._track(job.id, job_journal.running(job, self._journal_deadline(job)))
+        event_hub.publish("watering", job.to_dict())
+        return job
+
+    def state(self) -> dict:
+        return {
+            "max_open_valves": self.max_open_valves,
+            "controller": valve_controller.state(),
+            "running": [job.to_dict() for job in self.running.values()],
+            "queued": [job.to_dict() for job in self.queued_jobs()],
+        }
+
+    # Dispatch
+
+    def _dispatch(self):
+        """Start every queued job that fits next to the running ones"""
+        if not self._heap or len(self.running) >= self.max_open_valves:
+            return
+        busy_gpios = {job.gpio for job in self.running.values()}
+        waiting = []
+        while self._heap and len(self.running) < self.max_open_valves:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.gpio in busy_gpios:
+                # Conflicting valve: keep its place in the queue
+                waiting.append(entry)
+                continue
+            busy_gpios.add(job.gpio)
+            self._start(job)
+        for entry in waiting:
+            heapq.heappush(self._heap, entry)
+
+    def _start(self, job: WateringJob):
+        job.status = "running"
+        job.started_at = datetime.now()
+        self.running[job.id] = job
+        try:
+            valve_controller.open_valve(job.position)
+        except Exception as e:
+            logger.error(f"Erreur pendant l'arrosage position {job.position}: {e}")
+            job.started = job.deadline = time.monotonic()
+            self._finish(job, "failed", str(e))
+            return
+        job.started = time.monotonic()
+        job.deadline = job.started + job.duration
+        if flow_meter.metered(job.position):
+            job.pulses_start = flow_meter.count(job.position)
+            if job.target_ml is not None:
+                job.metered = True
+                job.flow_watch = flow_meter.watch(job.position, job.pulses_start, job.target_ml,
+                                                  lambda: self._finish(job, "completed"))
+        valve_controller.timers.schedule(job.id, job.deadline, lambda: self._on_deadline(job))
+        self._track(job.id, job_journal.running(job, self._journal_deadline(job)))
+        event_hub.publish("watering", job.to_dict())
+
+    def _on_deadline(self, job: WateringJob):
+        if job.metered:
+            # The target volume never went through: dry line or dead sensor
+            self._finish(job, "failed", "flow timeout")
+        else:
+            self._finish(job, "completed")
+
+    def _finish(self, job: WateringJob, status: str, reason: Optional[str] = None):
+        """Close the valve of a running job and record how it ended"""
+        if job.id not in self.running:
+            return
+        valve_controller.timers.cancel(job.id)
+        try:
+            valve_controller.close_valve(job.position)
+        except Exception as e:
+            logger.error(f"Failed to close valve position {job.position}: {e}")
+        job.ended = time.monotonic()
+        if job.flow_watch is not None:
+            flow_meter.unwatch(job.position, job.flow_watch)
+            job.flow_watch = None
+        if job.pulses_start is not None:
+            job.measured_ml = flow_meter.to_ml(flow_meter.count(job.position) - job.pulses_start)
+            if self.db is not None:
+                self._track(f"flow:{job.position}", flow_meter.learn(self.db, job.position,
+                                                                      job.measured_ml, job.watered()))
+        job.status = status
+        job.reason = reason
+        job.finished_at = datetime.now()
+        self.running.pop(job.id, None)
+        event_hub.publish("watering", job.to_dict())
+        # Start the next jobs before deciding to stop the pump
+        if self._started:
+            self._dispatch()
+        try:
+            valve_controller.release_pump()
+        except Exception as e:
+            logger.error(f"Failed to stop the pump: {e}")
+        self._track(job.id, self._complete(job))
+
+    def _journal_deadline(self, job: WateringJob) -> datetime:
+        return datetime.now() + timedelta(seconds=job.remaining() + JOB_DEADLINE_GRACE)
+
+    def _track(self, job_id: str, coroutine):
+        """Run a database write after the previous one of the same job"""
+        previous = self._writes.get(job_id)
+
+        async def chained():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await coroutine
+
+        def forget(task):
+            if self._writes.get(job_id) is task:
+                del self._writes[job_id]
+
+        task = asyncio.create_task(chained())
+        self._writes[job_id] = task
+        task.add_done_callback(forget)
+
+    async def _complete(self, job: WateringJob):
+        await job_journal.finished(job, job.reason)
+        if self.db is None or not job.watering_id:
+            return
+        try:
+            await local_store.update_one(self.db, "arrosages", ObjectId(job.watering_id),
+                                         self._completion_fields(job))
+            revisions.bump("arrosages")
+        except Exception as e:
+            logger.error(f"Failed to update watering status for {job.watering_id}: {e}")
+
+    @staticmethod
+    def _completion_fields(job: WateringJob) -> dict:
+        fields = {
+            "completed": True,
+            "success": job.status == "completed",
+            "cancelled": job.status == "cancelled",
+            "watered_seconds": round(job.watered(), 1),
+            "mode": "metered" if job.metered else "timed",
+            "completed_at": datetime.now().isoformat()
+        }
+        if job.measured_ml is not None:
+            fields["measured_ml"] = round(job.measured_ml, 1)
+            fields["flow_rate"] = job.flow_rate()
+        return fields
+
+    # Sweeper
+
+    async def sweep(self):
+        """Stop overdue jobs and switch off outputs no job accounts for"""
+        now = time.monotonic()
+        for job in list(self.running.values()):
+            if job.deadline is not None and now > job.deadline + JOB_DEADLINE_GRACE:
+                logger.warning(f"Watering job {job.id} at position {job.position} overran its deadline")
+                self._finish(job, "failed", "deadline expired")
+
+        if not self.running and (valve_controller.open_valves or valve_controller.pump_on):
+            logger.warning("Outputs active without a running job, switching everything off")
+            valve_controller.all_off()
+
+        expired = await job_journal.close_open_jobs(
+            "deadline expired",
+            exclude=[job.id for job in self.running.values()] + [job.id for job in self.queued_jobs()],
+            overdue_before=datetime.now()
+        )
+        if expired:
+            revisions.bump("arrosages")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Watering job sweep failed: {e}")
+
+
+# Create a single instance of the scheduler
+watering_scheduler = WateringScheduler()
@@ -8,6 +8,7 @@ export const useAuth = () => {
   const apiBase = config.public.apiBaseUrl;
 
   const token = ref(null);
+  const refreshToken = ref(null);
   const user = ref(null);
   const error = ref(null);
   const isLoading = ref(false);
@@ -20,6 +21,7 @@ export const useAuth = () => {
   const initAuth = () => {
     if (isClient) {
       const storedToken = localStorage.getItem("auth_token");
+      const storedRefreshToken = localStorage.getItem("refresh_token");
       const storedUser = localStorage.getItem("user");
 
       if (storedToken) {
@@ -27,6 +29,10 @@ export const useAuth = () => {
         isAuthenticated.value = true;
       }
 
+      if (storedRefreshToken) {
+        refreshToken.value = storedRefreshToken;
+      }
+
       if (storedUser) {
         try {
           user.value = JSON.parse(storedUser);
@@ -81,6 +87,7 @@ export const useAuth = () => {
       // Store token and user info
       if (response.access_token) {
         token.value = response.access_token;
+        refreshToken.value = response.refresh_token || null;
         isAuthenticated.value = true;
 
         // Get user profile
@@ -89,6 +96,9 @@ export const useAuth = () => {
         // Save to localStorage if in browser
         if (isClient) {
           localStorage.setItem("auth_token", token.value);
+          if (refreshToken.value) {
+            localStorage.setItem("refresh_token", refreshToken.value);
+          }
           if (user.value) {
             localStorage.setItem("user", JSON.stringify(user.value));
           }
@@ -130,18 +140,60 @@ export const useAuth = () => {
   // Logout
   // Modification de la fonction logout pour qu'elle soit asynchrone et utilise navigateTo
   const logout = async () => {
+    // Révoquer les jetons côté serveur (sans bloquer la déconnexion locale)
+    if (token.value) {
+      try {
+        await $fetch(`${apiBase}/auth/logout`, {
+          method: "POST",
+          headers: { Authorization: `Bearer ${token.value}` },
+          body: { refresh_token: refreshToken.value },
+        });
+      } catch (err) {
+        console.error("Logout error:", err);
+      }
+    }
+
+    clearSession();
+
+    // Utiliser navigateTo au lieu de router.push
+    return navigateTo("/login", { replace: true });
+  };
+
+  // Clear the session state and localStorage
+  const clearSession = () => {
     token.value = null;
+    refreshToken.value = null;
     user.value = null;
     isAuthenticated.value = false;
 
-    // Clear localStorage if in browser
     if (isClient) {
       localStorage.removeItem("auth_token");
+      localStorage.removeItem("refresh_token");
       localStorage.removeItem("user");
     }
+  };
 
-    // Utiliser navigateTo au lieu de router.push
-    return navigateTo("/login", { replace: true });
+  // Obtenir un nouveau jeton d'accès avec le jeton de rafraîchissement
+  const refreshSession = async () => {
+    if (!refreshToken.value) return false;
+
+    try {
+      const response = await $fetch(`${apiBase}/auth/refresh`, {
+        method: "POST",
+        body: { refresh_token: refreshToken.value },
+      });
+
+      token.value = response.access_token;
+      refreshToken.value = response.refresh_token;
+      if (isClient) {
+        localStorage.setItem("auth_token", token.value);
+        localStorage.setItem("refresh_token", refreshToken.value);
+      }
+      return true;
+    } catch (err) {
+      console.error("Token refresh error:", err);
+      return false;
+    }
   };
 
   // Fonction pour effectuer une requête authentifiée
@@ -151,26 +203,26 @@ export const useAuth = () => {
     }
 
     // Ajouter l'en-tête d'autorisation avec le token JWT
-    const headers = {
-      ...(options.headers || {}),
-      Authorization: `Bearer ${token.value}`,
-    };
-
-    try {
-      return await $fetch(url, {
+    const send = () =>
+      $fetch(url, {
         ...options,
-        headers,
+        headers: {
+          ...(options.headers || {}),
+          Authorization: `Bearer ${token.value}`,
+        },
       });
+
+    try {
+      return await send();
     } catch (error) {
       // Si l'erreur est 401, le token est probablement expiré
       if (error.response?.status === 401) {
-        // Redirigez vers la page de connexion
-        isAuthenticated.value = false;
-        token.value = null;
-        if (isClient) {
-          localStorage.removeItem("auth_token");
-          localStorage.removeItem("user");
+        // Renouveler le jeton une fois puis rejouer la requête
+        if (await refreshSession()) {
+          return await send();
         }
+        // Redirigez vers la page de connexion
+        clearSession();
         await navigateTo("/login");
         throw new Error("Session expirée, veuillez vous reconnecter");
       }
@@ -189,6 +241,7 @@ export const useAuth = () => {
     login,
     logout,
     fetchUserProfile,
+    refreshSession,
     authenticatedFetch,
   };
 };
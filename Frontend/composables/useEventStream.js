@@ -0,0 +1,47 @@
+import { ref } from 'vue';
+import { useApi } from '~/composables/useApi';
+
+// Live updates pushed by the API on /protected/stream (server-sent events).
+// Each handler receives the parsed JSON payload of its event type.
+export function useEventStream(handlers = {}) {
+  const { apiBase, token } = useApi();
+  const connected = ref(false);
+  let source = null;
+
+  const open = () => {
+    if (source || !token.value || typeof EventSource === 'undefined') return;
+
+    source = new EventSource(`${apiBase}/protected/stream?token=${encodeURIComponent(token.value)}`);
+    source.onopen = () => {
+      connected.value = true;
+    };
+    source.onerror = () => {
+      // The browser reconnects automatically; callers fall back to polling meanwhile
+      connected.value = false;
+    };
+
+    for (const [eventName, handler] of Object.entries(handlers)) {
+      source.addEventListener(eventName, (event) => {
+        try {
+          handler(JSON.parse(event.data));
+        } catch (e) {
+          console.error(`Invalid ${eventName} event:`, e);
+        }
+      });
+    }
+  };
+
+  const close = () => {
+    if (source) {
+      source.close();
+      source = null;
+    }
+    connected.value = false;
+  };
+
+  return {
+    connected,
+    open,
+    close
+  };
+}